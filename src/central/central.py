@@ -17,12 +17,22 @@ class CentralNode:
     CORNER_OFFSET_CM = 0.5 # offset from the corner to the edge of our rectangle
     HEIGHT_CM = 61.5 - 2*CORNER_OFFSET_CM  
     LENGTH_CM = 92 - 2*CORNER_OFFSET_CM
-    def __init__(self, camera_input, robots, thread = True):
-        self.vg = v2g.VideoToGraph(CentralNode.HEIGHT_CM, CentralNode.LENGTH_CM, camera_input, robots, thread=thread)
+    def __init__(self, camera_input, robots, thread = True, marker_detector = None, tracker_workers = None):
+        # A MarkerDetector switches vision to the fiducial marker mode, no clicking during setup.
+        # tracker_workers > 1 runs the actor trackers in that many processes.
+        self.vg = v2g.VideoToGraph(CentralNode.HEIGHT_CM, CentralNode.LENGTH_CM, camera_input, robots, thread=thread,
+                                   marker_detector=marker_detector, tracker_workers=tracker_workers)
         self.robot_data = robots
         self.camera_input = camera_input
         self.has_already_calibrated = False
         self.robots = []
+        # Per robot time (time.time()) its last W:<ms> wait runs out, see robot_ready
+        self.ready_at = {}
+
+        # Optional per robot radius in devices.json, drives the clearance costs around obstacles
+        for r in robots:
+            if 'footprint_cm' in r:
+                self.vg.set_robot_footprint(r['name'], r['footprint_cm'])
 
     def init(self):
         # TEMPORARY, REMOVE LATER
@@ -66,6 +76,10 @@ class CentralNode:
 
             new_robot.init()
 
+            # Calibration carried over from the last session snapshot
+            if r['name'] in self.vg.robot_calibrations:
+                new_robot.set_calibration(self.vg.robot_calibrations[r['name']])
+
             # Mark the robot as available for the task
             new_robot.current_task = None
 
@@ -139,19 +153,25 @@ class CentralNode:
     def send_instruction(self, robot, instruction, duration=None):
         print("Sending instruction ", instruction)
         if instruction.startswith('F'):
-            robot.physical_interface.move(int(instruction.split(':')[-1]) * self.vg.block_size_cm)
+            robot.physical_interface.move(float(instruction.split(':')[-1]) * self.vg.block_size_cm)
         elif instruction.startswith('L'):
-            robot.physical_interface.turn(-int(instruction.split(':')[-1]))
+            robot.physical_interface.turn(-float(instruction.split(':')[-1]))
         elif instruction.startswith('R'):
-            robot.physical_interface.turn(int(instruction.split(':')[-1]))
+            robot.physical_interface.turn(float(instruction.split(':')[-1]))
         elif instruction.startswith('P') or  instruction.startswith('D'):
             robot.physical_interface.turn(360)
             # self.motor_controller.spin()
         elif instruction.startswith('W'):
-            pass # TO IMPLEMENT
+            # Hold position for the given ms without blocking the other robots, the driver
+            # loop skips this robot until robot_ready. Collision free plans rely on these waits.
+            self.ready_at[robot.name] = time.time() + max(0.0, float(instruction.split(':')[-1])) / 1000
         else:
             print("Invalid command") 
 
+    def robot_ready(self, robot):
+        # False while the robot is still waiting out a W:<ms> instruction
+        return time.time() >= self.ready_at.get(robot.name, 0)
+
     def robot_calibration_and_sync(self, robots, eps = 1e-3):
         # ensure that movement is calibrated
         # move forward, orientation etc
@@ -162,9 +182,16 @@ class CentralNode:
             
             # Calibrate movement
             calibration = self.calibrate_robot(robot)
+            self.record_robot_calibration(robot.physical_interface, calibration)
             self.robots.append(robot)
             print("DOOONE")
 
+    def record_robot_calibration(self, physical_interface, calibration_factor):
+        # Applied right away, and kept in the session snapshot so a warm restart applies the same factor
+        physical_interface.set_calibration(calibration_factor)
+        self.vg.robot_calibrations[physical_interface.device_name] = calibration_factor
+        self.vg.save_snapshot()
+
     def calibrate_robot(self, robot, target = 1, eps = 1e-2):
         print("Calibrating", robot.name)
 
@@ -0,0 +1,146 @@
+import json
+import time
+
+import cv2 as cv
+import numpy as np
+
+from central.vision import TrackerBackend
+from utils import UtilityFunctions as uf
+
+
+class MarkerDetector:
+    """
+    Fiducial marker (ArUco / AprilTag) detection of every robot, action point and arena corner.
+
+    One detectMarkers pass per frame finds all markers, and marker ids are mapped to names
+    through the "markers" section of devices.json:
+
+        "marker_dictionary": "DICT_4X4_50",
+        "markers": [{"id": 0, "name": "top_left"}, {"id": 10, "name": "robot 1"}, ...]
+
+    Arena corners use the uf.TOP_LEFT / TOP_RIGHT / BOTTOM_LEFT / BOTTOM_RIGHT names. Each
+    detection gives the marker's bbox, center and orientation (direction of the marker's top
+    edge, degrees in image coordinates like Actor.estimate_orientation), so marker actors
+    need neither a tracker nor the PCA orientation estimate.
+    """
+
+    DICTIONARY = "DICT_4X4_50"
+    CORNER_NAMES = (uf.TOP_LEFT, uf.TOP_RIGHT, uf.BOTTOM_LEFT, uf.BOTTOM_RIGHT)
+
+    def __init__(self, markers, dictionary=DICTIONARY):
+        # markers: {marker id: name}
+        self.names = {int(marker_id): name for marker_id, name in markers.items()}
+        self.dictionary = cv.aruco.getPredefinedDictionary(getattr(cv.aruco, dictionary))
+        parameters = cv.aruco.DetectorParameters()
+        parameters.cornerRefinementMethod = cv.aruco.CORNER_REFINE_SUBPIX
+        if hasattr(cv.aruco, "ArucoDetector"):
+            self.detector = cv.aruco.ArucoDetector(self.dictionary, parameters)
+        else:
+            # OpenCV < 4.7 only has the free function
+            self.detector = None
+        self.parameters = parameters
+
+    @staticmethod
+    def from_config(config):
+        """Detector for a parsed devices.json, None if it has no markers section."""
+        markers = config.get("markers")
+        if not markers:
+            return None
+        return MarkerDetector({m["id"]: m["name"] for m in markers}, config.get("marker_dictionary", MarkerDetector.DICTIONARY))
+
+    @staticmethod
+    def load(path="devices.json"):
+        with open(path, "r") as f:
+            return MarkerDetector.from_config(json.load(f))
+
+    def actor_names(self):
+        return [name for name in self.names.values() if name not in MarkerDetector.CORNER_NAMES]
+
+    def detect(self, frame):
+        """{name: 4x2 marker corners (clockwise from the marker's top left)} for every known marker in frame."""
+        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if self.detector is not None:
+            corners, ids, _ = self.detector.detectMarkers(gray)
+        else:
+            corners, ids, _ = cv.aruco.detectMarkers(gray, self.dictionary, parameters=self.parameters)
+        if ids is None:
+            return {}
+        return {self.names[marker_id]: points.reshape(4, 2) for marker_id, points in zip(ids.ravel().tolist(), corners)
+                if marker_id in self.names}
+
+    @staticmethod
+    def bbox(points):
+        return tuple(int(v) for v in cv.boundingRect(np.asarray(points, dtype=np.float32)))
+
+    @staticmethod
+    def center(points):
+        return tuple(float(v) for v in np.asarray(points).mean(axis=0))
+
+    @staticmethod
+    def orientation(points):
+        # Average direction of the marker's top and bottom edges
+        points = np.asarray(points, dtype=np.float64)
+        direction = (points[1] - points[0]) + (points[2] - points[3])
+        return float(np.degrees(np.arctan2(direction[1], direction[0])))
+
+    def find_arena(self, frame, detections=None):
+        """
+        Arena corners and homography, in the same format as uf.find_corners_feed, from the
+        four corner markers. Each corner is the marker's outermost point. None unless all
+        four corner markers are visible.
+        """
+        detections = self.detect(frame) if detections is None else detections
+        if any(name not in detections for name in MarkerDetector.CORNER_NAMES):
+            return None
+
+        middle = np.mean([MarkerDetector.center(detections[name]) for name in MarkerDetector.CORNER_NAMES], axis=0)
+        corners = {}
+        for name in MarkerDetector.CORNER_NAMES:
+            points = detections[name]
+            outer = points[np.argmax(np.linalg.norm(points - middle, axis=1))]
+            corners[name] = (int(round(outer[0])), int(round(outer[1])))
+
+        src_points = np.array([corners[name] for name in MarkerDetector.CORNER_NAMES], dtype=np.float32)
+        dst_points = np.array([
+            [0, 0],
+            [frame.shape[1], 0],
+            [0, frame.shape[0]],
+            [frame.shape[1], frame.shape[0]]
+        ], dtype=np.float32)
+        H, _ = cv.findHomography(src_points, dst_points)
+        return corners, H
+
+    def create_actors(self, frame, detections=None):
+        """
+        Actors for every visible robot and action point marker, same {name: actor} as
+        uf.get_all_objects. Their poses come from update, so they are created without a tracker.
+        """
+        detections = self.detect(frame) if detections is None else detections
+        actors = {}
+        for name, points in detections.items():
+            if name in MarkerDetector.CORNER_NAMES:
+                continue
+            actor = uf.create_actor(name, TrackerBackend.STATIC)
+            if actor is None:
+                continue
+            actor.orientation = MarkerDetector.orientation(points)
+            actor.initialize_tracker(frame, MarkerDetector.bbox(points))
+            actors[name] = actor
+        return actors
+
+    def update(self, frame, actors, stamp=None):
+        """
+        One detection pass for all actors, returns {name: success}. Actors whose marker isn't
+        visible keep their filtered pose moving until it is seen again.
+        """
+        detections = self.detect(frame)
+        results = {}
+        for actor in actors:
+            points = detections.get(actor.name)
+            if points is None:
+                if actor.pose_filter.initialized():
+                    actor.pose_filter.predict(time.perf_counter() if stamp is None else stamp)
+                results[actor.name] = actor.apply_update(False, None)
+                continue
+            results[actor.name] = actor.apply_update(True, MarkerDetector.bbox(points), MarkerDetector.orientation(points), stamp)
+        return results
@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+
+
+class StampedFrame:
+    """A captured frame and the time (perf_counter seconds) each pipeline stage finished with it."""
+
+    CAPTURE = "capture"
+    VISION = "vision"
+    PLANNING = "planning"
+    RENDER = "render"
+
+    def __init__(self, frame, frame_id):
+        self.frame = frame
+        self.frame_id = frame_id
+        self.stamps = {}
+        self.stamp(StampedFrame.CAPTURE)
+
+    def stamp(self, stage):
+        self.stamps[stage] = time.perf_counter()
+
+    def latency_ms(self, stage, since=CAPTURE):
+        if stage not in self.stamps or since not in self.stamps:
+            return None
+        return (self.stamps[stage] - self.stamps[since]) * 1000
+
+
+class DropOldestQueue(queue.Queue):
+    """Bounded queue whose put never blocks, a full queue drops its oldest item instead."""
+
+    def __init__(self, maxsize=1):
+        super().__init__(maxsize)
+        self.dropped = 0
+
+    def put(self, item, block=False, timeout=None):
+        with self.not_full:
+            while self.maxsize > 0 and self._qsize() >= self.maxsize:
+                self._get()
+                # Dropped items never see task_done, keep join() balanced
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def put_nowait(self, item):
+        self.put(item)
+
+
+class LatestFrameCapture:
+    """
+    Reads a cv.VideoCapture on its own thread and only keeps the newest frame.
+
+    Consumers that fall behind skip frames instead of draining the camera's internal
+    buffer, so they always work on the most recent image. read / isOpened / release
+    match cv.VideoCapture, so it can be handed to anything that expects a capture.
+    frame_interval (seconds) paces file playback, live cameras leave it at 0.
+    """
+
+    def __init__(self, cap, frame_interval=0.0):
+        self.cap = cap
+        self.frame_interval = frame_interval
+        self.condition = threading.Condition()
+        self.latest = None
+        self.frame_id = 0
+        self.last_read_id = 0
+        self.running = False
+        self.ended = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        next_read = time.perf_counter()
+        while self.running:
+            if self.frame_interval:
+                time.sleep(max(0.0, next_read - time.perf_counter()))
+                next_read += self.frame_interval
+
+            ret, frame = self.cap.read()
+            with self.condition:
+                if not ret:
+                    self.ended = True
+                    self.condition.notify_all()
+                    break
+                self.frame_id += 1
+                self.latest = StampedFrame(frame, self.frame_id)
+                self.condition.notify_all()
+
+    def next_frame(self, after_id=0, timeout=None):
+        # Newest frame with an id above after_id, None on timeout or once the stream has ended
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.ended or not self.running or (self.latest is not None and self.latest.frame_id > after_id),
+                timeout,
+            )
+            if self.latest is None or self.latest.frame_id <= after_id:
+                return None
+            return self.latest
+
+    def read(self):
+        stamped = self.next_frame(self.last_read_id)
+        if stamped is None:
+            return False, None
+        self.last_read_id = stamped.frame_id
+        return True, stamped.frame
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.cap.release()
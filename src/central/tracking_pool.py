@@ -0,0 +1,223 @@
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+
+import cv2 as cv
+import numpy as np
+
+from central.vision import Actor, TrackerBackend
+
+
+# Messages to a worker, (command, payload)
+_INIT = "init"
+_REMOVE = "remove"
+_UPDATE = "update"
+_STOP = "stop"
+
+
+def _tracker_worker(connection, shm_name, shape, dtype):
+    # Owns the trackers of its actors, frames are read in place from the shared block.
+    # One OpenCV thread per worker, the pool itself is the parallelism.
+    cv.setNumThreads(1)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    trackers = {}
+    # Actors whose tracker couldn't be started, reported as lost until they are registered again
+    failed = set()
+    try:
+        while True:
+            command, payload = connection.recv()
+            if command == _STOP:
+                break
+            if command == _INIT:
+                name, bbox, backend = payload
+                bbox = tuple(int(v) for v in bbox)
+                failed.discard(name)
+                try:
+                    tracker = Actor.create_tracker(TrackerBackend(backend))
+                    if tracker is not None:
+                        tracker.init(frame, bbox)
+                except (cv.error, ValueError) as e:
+                    print(f"Couldn't start the tracker of {name}: {e}")
+                    tracker = None
+                    failed.add(name)
+                trackers[name] = (tracker, bbox)
+                connection.send(name)
+            elif command == _REMOVE:
+                trackers.pop(payload, None)
+                failed.discard(payload)
+            elif command == _UPDATE:
+                # payload holds the actors due for a tracker update and those that also want their orientation re-estimated
+                due, oriented = payload
+                results = []
+                for name in due:
+                    if name not in trackers:
+                        continue
+                    tracker, bbox = trackers[name]
+                    # An error on one actor (e.g. a box partly off the frame) only fails that actor
+                    try:
+                        if name in failed:
+                            success = False
+                        else:
+                            # Static actors keep the box they were registered with
+                            success, bbox = tracker.update(frame) if tracker is not None else (True, bbox)
+                        orientation = Actor.estimate_orientation(frame, bbox) if success and name in oriented else None
+                    except (cv.error, ValueError):
+                        success, orientation = False, None
+                    results.append((name, success, tuple(int(v) for v in bbox), orientation))
+                connection.send(results)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        del frame
+        shm.close()
+
+
+class TrackerPool:
+    """
+    Actor tracking spread over worker processes.
+
+    Every actor is pinned to one worker, which owns its tracker for as long as the actor is
+    registered. Each frame is copied once into a shared memory block that all workers
+    map, so only the small per-actor results are pickled. Results are merged back into
+    the actors with Actor.merge_tracker_result (confidence, backend adaptation, bbox,
+    history, orientation and pose filter). When that restarts an actor's tracker, e.g.
+    on a backend switch, the worker's tracker is restarted from the actor's box too.
+    STATIC actors have no tracker and are checked here instead of in a worker.
+    Actors whose predicted pose is still good (Actor.needs_tracker_update) skip the frame.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.context = mp.get_context("spawn")
+        self.shm = None
+        self.frame = None
+        self.processes = []
+        self.connections = []
+
+        # actor name -> (actor, worker index)
+        self.assignment = {}
+        # actor name -> Actor.tracker_starts when its worker tracker was started
+        self.starts = {}
+
+    def __contains__(self, name):
+        return name in self.assignment
+
+    def start(self, shape, dtype):
+        self.stop_workers()
+        dtype = np.dtype(dtype)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self.frame = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        for _ in range(self.workers):
+            connection, child = self.context.Pipe()
+            process = self.context.Process(target=_tracker_worker, args=(child, self.shm.name, shape, dtype.str), daemon=True)
+            process.start()
+            child.close()
+            self.processes.append(process)
+            self.connections.append(connection)
+
+    def write_frame(self, frame):
+        if self.frame is None or self.frame.shape != frame.shape or self.frame.dtype != frame.dtype:
+            # New resolution, the workers are restarted and every tracker re-initialized on this frame
+            actors = [actor for actor, _ in self.assignment.values()]
+            self.assignment = {}
+            self.starts = {}
+            self.start(frame.shape, frame.dtype)
+            np.copyto(self.frame, frame)
+            for actor in actors:
+                self.add_actor(actor)
+            return
+        np.copyto(self.frame, frame)
+
+    def add_actor(self, actor, frame=None):
+        """Pin the actor to the least loaded worker and start its tracker from actor.bbox on frame."""
+        if frame is not None:
+            self.write_frame(frame)
+        if actor.bbox is None or self.frame is None:
+            return False
+        if actor.name in self.assignment:
+            self.remove_actor(actor.name)
+
+        load = [0] * self.workers
+        for _, worker in self.assignment.values():
+            load[worker] += 1
+        worker = load.index(min(load))
+        self.assignment[actor.name] = (actor, worker)
+        self.starts[actor.name] = actor.tracker_starts
+
+        # Wait for the worker to take the frame before the shared block gets overwritten
+        self.connections[worker].send((_INIT, (actor.name, actor.bbox, actor.backend.value)))
+        self.connections[worker].recv()
+        return True
+
+    def remove_actor(self, name):
+        entry = self.assignment.pop(name, None)
+        self.starts.pop(name, None)
+        if entry is not None:
+            self.connections[entry[1]].send((_REMOVE, name))
+
+    def update(self, frame, actors=(), stamp=None):
+        """
+        One tracking step for every registered actor that is due for one. Actors in `actors`
+        that aren't registered yet (and have a bbox) are added first. Returns {name: success}
+        for the actors that were tracked on this frame. stamp is the frame's capture time.
+        """
+        self.write_frame(frame)
+        for actor in actors:
+            if actor.name not in self.assignment and actor.bbox is not None:
+                self.add_actor(actor)
+
+        stamp = time.perf_counter() if stamp is None else stamp
+        due = [(name, actor, worker) for name, (actor, worker) in self.assignment.items() if actor.needs_tracker_update(stamp)]
+        tracked = [(name, actor, worker) for name, actor, worker in due if actor.backend != TrackerBackend.STATIC]
+        workers = sorted({worker for _, _, worker in tracked})
+        for worker in workers:
+            names = [name for name, _, w in tracked if w == worker]
+            oriented = {name for name, actor, w in tracked if w == worker and actor.orientation_point}
+            self.connections[worker].send((_UPDATE, (names, oriented)))
+
+        # Static actors only compare their patch every few updates, done here while the workers track
+        results = {}
+        for name, actor, _ in due:
+            if actor.backend == TrackerBackend.STATIC:
+                success, bbox, checked = actor.check_static(frame)
+                results[name] = actor.merge_tracker_result(frame, success, bbox, checked, stamp)
+
+        for worker in workers:
+            for name, success, bbox, orientation in self.connections[worker].recv():
+                entry = self.assignment.get(name)
+                if entry is not None:
+                    results[name] = entry[0].merge_tracker_result(frame, success, bbox, True, stamp, orientation)
+
+        # Backend switches restarted the actor's tracker, the worker's copy restarts from the actor's box
+        for name in results:
+            actor = self.assignment[name][0]
+            if actor.tracker_starts != self.starts.get(name):
+                self.add_actor(actor)
+        return results
+
+    def stop_workers(self):
+        for connection in self.connections:
+            try:
+                connection.send((_STOP, None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+        self.processes, self.connections = [], []
+
+        if self.shm is not None:
+            self.frame = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        self.stop_workers()
+        self.assignment = {}
+        self.starts = {}
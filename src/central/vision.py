@@ -1,6 +1,7 @@
 import cv2 as cv 
 from collections import deque
 import numpy as np
+import time
 
 from enum import Enum
 
@@ -12,14 +13,148 @@ class ActorType(Enum):
     MISC = "MISC"
 
 
+# Tracker backends, from cheapest to most accurate
+class TrackerBackend(Enum):
+    STATIC = "STATIC"  # No tracker, the bbox is only re-checked every few frames
+    MOSSE = "MOSSE"
+    KCF = "KCF"
+    CSRT = "CSRT"
+
+
+class PoseFilter:
+    """
+    Constant velocity Kalman filter over an actor's pose (cx, cy in pixels, theta in degrees).
+
+    The state is [cx, cy, theta, vx, vy, vtheta] with velocities per second, so predictions
+    follow wall clock time (perf_counter seconds) however irregular the frames are.
+    Measurements without an orientation only correct the position.
+    """
+
+    # Acceleration noise (px^2 / s^3 and deg^2 / s^3) of the constant velocity model
+    POSITION_NOISE = 400.0
+    ANGLE_NOISE = 900.0
+    MEASUREMENT_NOISE_PX = 1.5
+    MEASUREMENT_NOISE_DEG = 5.0
+    INITIAL_VELOCITY_NOISE = 1e4
+    UNKNOWN_NOISE = 1e8
+
+    def __init__(self):
+        self.kalman = cv.KalmanFilter(6, 3)
+        self.kalman.measurementMatrix = np.hstack([np.eye(3), np.zeros((3, 3))]).astype(np.float32)
+        self.stamp = None
+
+    def initialized(self):
+        return self.stamp is not None
+
+    def reset(self, center, theta=None, stamp=None):
+        self.kalman.statePost = np.array([[center[0]], [center[1]], [theta or 0.0], [0.0], [0.0], [0.0]], dtype=np.float32)
+        self.kalman.errorCovPost = np.diag([
+            PoseFilter.MEASUREMENT_NOISE_PX ** 2, PoseFilter.MEASUREMENT_NOISE_PX ** 2,
+            PoseFilter.MEASUREMENT_NOISE_DEG ** 2 if theta is not None else PoseFilter.UNKNOWN_NOISE,
+            PoseFilter.INITIAL_VELOCITY_NOISE, PoseFilter.INITIAL_VELOCITY_NOISE, PoseFilter.INITIAL_VELOCITY_NOISE,
+        ]).astype(np.float32)
+        self.stamp = time.perf_counter() if stamp is None else stamp
+
+    def clear(self):
+        self.stamp = None
+
+    def predict(self, stamp):
+        # Advance the state to stamp, repeated predictions compound until the next correction
+        dt = stamp - self.stamp
+        if dt <= 0:
+            return
+        transition = np.eye(6, dtype=np.float32)
+        transition[0, 3] = transition[1, 4] = transition[2, 5] = dt
+        noise = np.zeros((6, 6), dtype=np.float32)
+        for i, q in ((0, PoseFilter.POSITION_NOISE), (1, PoseFilter.POSITION_NOISE), (2, PoseFilter.ANGLE_NOISE)):
+            noise[i, i] = q * dt ** 3 / 3
+            noise[i, i + 3] = noise[i + 3, i] = q * dt ** 2 / 2
+            noise[i + 3, i + 3] = q * dt
+        self.kalman.transitionMatrix = transition
+        self.kalman.processNoiseCov = noise
+        self.kalman.predict()
+        # OpenCV predicts from statePost, carry the prediction over so the next one builds on it
+        self.kalman.statePost = self.kalman.statePre.copy()
+        self.kalman.errorCovPost = self.kalman.errorCovPre.copy()
+        self.stamp = stamp
+
+    def correct(self, center, theta=None, stamp=None):
+        stamp = time.perf_counter() if stamp is None else stamp
+        if not self.initialized():
+            self.reset(center, theta, stamp)
+            return
+        self.predict(stamp)
+
+        predicted = float(self.kalman.statePost[2, 0])
+        if theta is None:
+            theta, theta_noise = predicted, PoseFilter.UNKNOWN_NOISE
+        else:
+            # The state angle is unwrapped, measure it as the closest equivalent angle
+            theta, theta_noise = predicted + (theta - predicted + 180.0) % 360.0 - 180.0, PoseFilter.MEASUREMENT_NOISE_DEG ** 2
+        self.kalman.measurementNoiseCov = np.diag([PoseFilter.MEASUREMENT_NOISE_PX ** 2, PoseFilter.MEASUREMENT_NOISE_PX ** 2, theta_noise]).astype(np.float32)
+        self.kalman.correct(np.array([[center[0]], [center[1]], [theta]], dtype=np.float32))
+
+    def pose(self, dt=0.0):
+        # (cx, cy, theta) at the last prediction, extrapolated dt seconds further along the velocity
+        state = self.kalman.statePost[:, 0]
+        cx, cy, theta = (float(state[i] + state[i + 3] * dt) for i in range(3))
+        return cx, cy, (theta + 180.0) % 360.0 - 180.0
+
+    def uncertainty(self):
+        # Standard deviation of the position estimate in pixels
+        covariance = self.kalman.errorCovPost
+        return float(np.sqrt(covariance[0, 0] + covariance[1, 1]))
+
+
 # Actor class to define a simple object being tracked by central node vision
 class Actor:
     TYPE = ActorType.MISC
 
-    def __init__(self, name):
+    BACKENDS = (TrackerBackend.STATIC, TrackerBackend.MOSSE, TrackerBackend.KCF, TrackerBackend.CSRT)
+
+    # Confidence is the normalized correlation between the tracked patch and the last confident one.
+    # Below MIN_CONFIDENCE the backend's error is too large and a more accurate one takes over.
+    MIN_CONFIDENCE = 0.5
+    # After STABLE_FRAMES updates above HIGH_CONFIDENCE a cheaper backend is tried,
+    # STATIC once the center moves less than STATIC_MOTION_PX per frame
+    HIGH_CONFIDENCE = 0.8
+    STABLE_FRAMES = 30
+    STATIC_MOTION_PX = 0.5
+    STATIC_CHECK_INTERVAL = 10
+    # Cheapest backend adaptation may step down to, robots override it since they start moving without warning
+    MIN_BACKEND = TrackerBackend.STATIC
+    # A lost actor is searched for around its last box, enlarged by this factor
+    SEARCH_SCALE = 3.0
+
+    # With a tracker_interval above 1 the tracker only runs every that many frames, or as soon as
+    # the predicted position is more than MAX_UNCERTAINTY_PX uncertain, and the Kalman filter
+    # carries the pose in between. CSRT / KCF expect consecutive frames of a moving target, so
+    # by default every frame is tracked.
+    TRACKER_INTERVAL = 1
+    MAX_UNCERTAINTY_PX = 4.0
+
+    def __init__(self, name, backend=None, tracker_interval=TRACKER_INTERVAL):
         self.name = name
-        self.tracker = cv.TrackerCSRT_create()
+
+        # An explicit backend is kept as is, otherwise it adapts to the actor's motion
+        self.adaptive = backend is None
+        self.backend = backend if backend is not None else TrackerBackend.CSRT
+        self.tracker = Actor.create_tracker(self.backend)
+        self.template = None
+        self.confidence = None
+        self.motion = 0.0
+        self.stable_frames = 0
+        self.patience = Actor.STABLE_FRAMES
+        self.frames_since_check = 0
+        # Bumped whenever the tracker is (re)started, tells a TrackerPool to restart its copy
+        self.tracker_starts = 0
+
+        self.pose_filter = PoseFilter()
+        self.tracker_interval = tracker_interval
+        self.frames_since_update = 0
+
         self.bbox = None
+        self.tracked = False  # Whether the last tracker update succeeded
         self.history = deque(maxlen=300)
         self.origin = None
         self.orientation = None  # Angle in degrees
@@ -28,21 +163,189 @@ class Actor:
 
     def initialize_tracker(self, frame, bbox):
         self.bbox = bbox
-        self.tracker.init(frame, bbox)
+        self.template = Actor.patch(frame, bbox)
+        if self.tracker is not None:
+            self.tracker.init(frame, bbox)
+        self.tracker_starts += 1
+        self.pose_filter.reset(self.get_location(), self.orientation)
+        self.frames_since_update = 0
+
+    @staticmethod
+    def create_tracker(backend):
+        if backend == TrackerBackend.STATIC:
+            return None
+        if backend == TrackerBackend.MOSSE:
+            legacy = getattr(cv, 'legacy', None)
+            if legacy is not None and hasattr(legacy, 'TrackerMOSSE_create'):
+                return legacy.TrackerMOSSE_create()
+            # MOSSE only ships with the contrib legacy module, KCF is the next cheapest
+            return cv.TrackerKCF_create()
+        if backend == TrackerBackend.KCF:
+            return cv.TrackerKCF_create()
+        return cv.TrackerCSRT_create()
+
+    def set_backend(self, frame, backend, bbox=None):
+        # Restart tracking with another backend from bbox (the last known box by default)
+        bbox = tuple(int(v) for v in (bbox if bbox is not None else self.bbox))
+        self.backend = backend
+        self.tracker = Actor.create_tracker(backend)
+        if self.tracker is not None:
+            self.tracker.init(frame, bbox)
+        self.tracker_starts += 1
+        # The new backend is judged against the box it starts from
+        self.template = Actor.patch(frame, bbox)
+        self.stable_frames = 0
+        self.frames_since_check = 0
     
     def set_physical_interface(self, physical_interface):
         self.physical_interface = physical_interface
 
-    def update(self, frame):
-        success, new_bbox = self.tracker.update(frame)
+    def needs_tracker_update(self, stamp=None):
+        # Advances the pose filter to stamp, True if the tracker has to run on this frame
+        if not self.pose_filter.initialized() or self.tracker_interval <= 1:
+            return True
+        self.pose_filter.predict(time.perf_counter() if stamp is None else stamp)
+        self.frames_since_update += 1
+        return self.frames_since_update >= self.tracker_interval or self.pose_filter.uncertainty() > Actor.MAX_UNCERTAINTY_PX
+
+    def update(self, frame, stamp=None):
+        # stamp is when frame was captured (perf_counter seconds), now by default
+        stamp = time.perf_counter() if stamp is None else stamp
+        if not self.needs_tracker_update(stamp):
+            return self.tracked
+
+        if self.backend == TrackerBackend.STATIC:
+            success, new_bbox, checked = self.check_static(frame)
+        else:
+            (success, new_bbox), checked = self.tracker.update(frame), True
+        return self.merge_tracker_result(frame, success, new_bbox, checked, stamp)
+
+    def merge_tracker_result(self, frame, success, bbox, checked=True, stamp=None, orientation=None):
+        # Confidence, backend adaptation and orientation for one tracker result, also used for TrackerPool results
+        if success and checked:
+            self.confidence = self.measure_confidence(frame, bbox)
+        if self.adaptive and self.bbox is not None:
+            success, adapted = self.adapt_backend(frame, success, bbox, checked)
+            if adapted is not bbox:
+                bbox, orientation = adapted, None
+
+        if orientation is None and success and checked and self.orientation_point:
+            orientation = Actor.estimate_orientation(frame, bbox)
+        return self.apply_update(success, bbox, orientation, stamp)
+
+    def check_static(self, frame):
+        # Static actors keep their box, only every STATIC_CHECK_INTERVAL frames the patch is compared again
+        self.frames_since_check += 1
+        if self.frames_since_check < Actor.STATIC_CHECK_INTERVAL:
+            return True, self.bbox, False
+        self.frames_since_check = 0
+        return True, self.bbox, True
+
+    def adapt_backend(self, frame, success, bbox, checked):
+        # Returns (trusted, bbox) for the update, switching backends on lost confidence or sustained stability
+        level = Actor.BACKENDS.index(self.backend)
+        if not success or (checked and self.confidence < Actor.MIN_CONFIDENCE):
+            if level == len(Actor.BACKENDS) - 1:
+                # Nothing more accurate to fall back to, keep following the tracker from its current box
+                if success:
+                    self.template = Actor.patch(frame, bbox)
+                return success, bbox
+            # A static actor that moved has to be re-acquired, which only the most accurate backend does well.
+            # The new tracker starts where the actor was found again, not on its stale box.
+            target = Actor.BACKENDS[-1] if self.backend == TrackerBackend.STATIC else Actor.BACKENDS[level + 1]
+            found = self.reacquire(frame)
+            self.set_backend(frame, target, found)
+            self.patience = min(self.patience * 2, Actor.STABLE_FRAMES * 8)
+            return found is not None, found if found is not None else bbox
+
+        if not checked:
+            return True, bbox
+        center = (bbox[0] + bbox[2] / 2, bbox[1] + bbox[3] / 2)
+        previous = self.get_location()
+        self.motion = 0.8 * self.motion + 0.2 * np.hypot(center[0] - previous[0], center[1] - previous[1])
+
+        self.stable_frames = self.stable_frames + 1 if self.confidence >= Actor.HIGH_CONFIDENCE else 0
+        floor = Actor.BACKENDS.index(self.MIN_BACKEND)
+        if self.stable_frames >= self.patience and level > floor:
+            if floor == 0 and self.motion < Actor.STATIC_MOTION_PX:
+                self.set_backend(frame, TrackerBackend.STATIC, bbox)
+            elif level > max(floor, 1):
+                self.set_backend(frame, Actor.BACKENDS[level - 1], bbox)
+            else:
+                self.stable_frames = 0
+        return True, bbox
+
+    def reacquire(self, frame):
+        # Box where the template matches best around the last box, None if nothing matches well enough
+        if self.template is None or self.bbox is None:
+            return None
+        th, tw = self.template.shape
+        x, y, w, h = self.bbox
+        cx, cy = x + w / 2, y + h / 2
+        half_w, half_h = tw * Actor.SEARCH_SCALE / 2, th * Actor.SEARCH_SCALE / 2
+        x0, y0 = max(0, int(cx - half_w)), max(0, int(cy - half_h))
+        x1, y1 = min(frame.shape[1], int(cx + half_w)), min(frame.shape[0], int(cy + half_h))
+        if x1 - x0 < tw or y1 - y0 < th:
+            return None
+
+        window = frame[y0:y1, x0:x1]
+        window = cv.cvtColor(window, cv.COLOR_BGR2GRAY) if window.ndim == 3 else window
+        scores = cv.matchTemplate(window.astype(np.float32), self.template, cv.TM_CCOEFF_NORMED)
+        _, score, _, (mx, my) = cv.minMaxLoc(scores)
+        if score < Actor.MIN_CONFIDENCE:
+            return None
+        return x0 + mx, y0 + my, tw, th
+
+    @staticmethod
+    def patch(frame, bbox, size=None):
+        # Grayscale crop around the bbox center, bbox sized unless size = (w, h) is given.
+        # None if the crop doesn't fit on the frame.
+        x, y, w, h = bbox
+        w, h = (int(w), int(h)) if size is None else size
+        x0, y0 = int(round(x + bbox[2] / 2 - w / 2)), int(round(y + bbox[3] / 2 - h / 2))
+        if w <= 0 or h <= 0 or x0 < 0 or y0 < 0 or x0 + w > frame.shape[1] or y0 + h > frame.shape[0]:
+            return None
+        roi = frame[y0:y0 + h, x0:x0 + w]
+        gray = cv.cvtColor(roi, cv.COLOR_BGR2GRAY) if roi.ndim == 3 else roi
+        return gray.astype(np.float32)
+
+    def measure_confidence(self, frame, bbox):
+        if self.template is None:
+            self.template = Actor.patch(frame, bbox)
+            return 1.0
+        # Same size as the template, so box scale changes don't count as appearance changes
+        current = Actor.patch(frame, bbox, self.template.shape[::-1])
+        if current is None:
+            return 0.0
+
+        a, b = current - current.mean(), self.template - self.template.mean()
+        norm = np.sqrt((a * a).sum() * (b * b).sum())
+        if norm < 1e-6:
+            # Flat patches only match other flat patches
+            confidence = 1.0 if a.std() < 1.0 and b.std() < 1.0 else 0.0
+        else:
+            confidence = float((a * b).sum() / norm)
+
+        # Follow slow appearance changes (rotation, lighting) while the match is good
+        if confidence >= Actor.HIGH_CONFIDENCE:
+            self.template = current
+        return confidence
+
+    def apply_update(self, success, bbox, orientation=None, stamp=None):
+        # Merge one tracker result into the actor, also used for results coming back from a TrackerPool worker
+        self.tracked = success
         if success:
-            self.bbox = tuple(map(int, new_bbox))
+            self.bbox = tuple(map(int, bbox))
             self.history.append(self.get_location())
-            if self.orientation_point:
-                self.update_orientation(frame)
+            if orientation is not None:
+                self.orientation = orientation
+            self.pose_filter.correct(self.history[-1], orientation, stamp)
+            self.frames_since_update = 0
         return success
 
     def get_location(self):
+        # Center of the last tracked bbox, as measured. Calibration and control read this one,
+        # the Kalman filtered pose is only given out by filtered_location / get_pose / predict_location.
         if not self.bbox:
             return None
         x, y, w, h = self.bbox
@@ -50,6 +353,30 @@ class Actor:
         center_y = y + h / 2
         return center_x, center_y
 
+    def filtered_location(self):
+        # Filtered center, predicted forward on frames the tracker skipped
+        if not self.bbox:
+            return None
+        if not self.pose_filter.initialized():
+            return self.get_location()
+        cx, cy, _ = self.pose_filter.pose()
+        return cx, cy
+
+    def get_pose(self):
+        """Filtered (cx, cy, theta), theta is None until an orientation has been measured."""
+        location = self.filtered_location()
+        if location is None:
+            return None
+        theta = self.pose_filter.pose()[2] if self.pose_filter.initialized() and self.orientation is not None else self.orientation
+        return location[0], location[1], theta
+
+    def predict_location(self, dt):
+        """Where the actor will be dt seconds from now at its current velocity, e.g. when a command lands."""
+        if not self.pose_filter.initialized():
+            return self.get_location()
+        cx, cy, _ = self.pose_filter.pose(dt + time.perf_counter() - self.pose_filter.stamp)
+        return cx, cy
+
     def set_orientation_point(self, point):
         self.orientation_point = point
         self.update_orientation_from_point()
@@ -64,19 +391,27 @@ class Actor:
 
     def update_orientation(self, frame):
         if self.bbox:
-            x, y, w, h = map(int, self.bbox)
-            roi = frame[y:y+h, x:x+w]
-            if roi.size > 0:
-                gray = cv.cvtColor(roi, cv.COLOR_BGR2GRAY)
-                _, binary = cv.threshold(gray, 50, 255, cv.THRESH_BINARY | cv.THRESH_OTSU)
-                contours, _ = cv.findContours(binary, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-                if contours:
-                    largest_contour = max(contours, key=cv.contourArea)
-                    if len(largest_contour) >= 5:  # PCA requires at least 5 points
-                        data = largest_contour.reshape(-1, 2).astype(np.float32)
-                        mean, eigenvectors = cv.PCACompute(data, mean=None)
-                        angle = np.arctan2(eigenvectors[0, 1], eigenvectors[0, 0])
-                        self.orientation = np.degrees(angle)
+            orientation = Actor.estimate_orientation(frame, self.bbox)
+            if orientation is not None:
+                self.orientation = orientation
+
+    @staticmethod
+    def estimate_orientation(frame, bbox):
+        # Angle in degrees of the main axis of the largest contour inside bbox, None if there is none
+        x, y, w, h = map(int, bbox)
+        roi = frame[y:y+h, x:x+w]
+        if roi.size > 0:
+            gray = cv.cvtColor(roi, cv.COLOR_BGR2GRAY)
+            _, binary = cv.threshold(gray, 50, 255, cv.THRESH_BINARY | cv.THRESH_OTSU)
+            contours, _ = cv.findContours(binary, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+            if contours:
+                largest_contour = max(contours, key=cv.contourArea)
+                if len(largest_contour) >= 5:  # PCA requires at least 5 points
+                    data = largest_contour.reshape(-1, 2).astype(np.float32)
+                    mean, eigenvectors = cv.PCACompute(data, mean=None)
+                    angle = np.arctan2(eigenvectors[0, 1], eigenvectors[0, 0])
+                    return np.degrees(angle)
+        return None
 
     # def distance_from_origin_cm(self, frame, location):
     #     if not self.origin or not location:
@@ -130,5 +465,7 @@ class Environment:
     def reset_bounding_boxes(self):
         for actor in self.actors:
             actor.history.clear()
+            actor.pose_filter.clear()
             actor.bbox = None
-            actor.tracker.clear()
+            if actor.tracker is not None:
+                actor.tracker.clear()
@@ -1,11 +1,13 @@
 import json
-from central.vision import Actor, ActorType
+from central.vision import Actor, ActorType, TrackerBackend
 from apis.bluetooth import BluetoothAPI
 from individual.client import RobotPhysicalInterface
 
 
 class IndividualNode(Actor):
     TYPE = ActorType.ROBOT
+    # Robots sit still during setup and then drive off, a static actor would lose them
+    MIN_BACKEND = TrackerBackend.KCF
 
     def can_connect(name):
         data = BluetoothAPI.get_device_data(name)
@@ -13,8 +15,8 @@ class IndividualNode(Actor):
             return False 
         return BluetoothAPI.can_connect(data['address'], data['write_uuid'])
 
-    def __init__(self, name):
-        super().__init__(name)
+    def __init__(self, name, backend=None):
+        super().__init__(name, backend)
 
         # Connect to the physical bluetooth device
         device_data = BluetoothAPI.get_device_data(name)
@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 
 import cv2 as cv
 from central.central import CentralNode
+from central.markers import MarkerDetector
 from utils import UtilityFunctions
 from frames.references import Frame, FramePipeline
 
@@ -19,9 +20,13 @@ def main():
     web_cam_further_top = "img/video/webcam_red_further_top.mov"
     web_cam_distance = "img/video/center_test.mov"
 
-    # Read robots
+    # Read robots, and the fiducial markers if the arena is set up with them
     with open('devices.json', 'r') as f:
-        robots = json.load(f)['devices']
+        config = json.load(f)
+    robots = config['devices']
+    marker_detector = MarkerDetector.from_config(config)
+    # Optional number of processes tracking the actors, unset tracks in the vision stage itself
+    tracker_workers = config.get('tracker_workers')
 
     video_feed = [web_cam_close, web_cam_further_angle, web_cam_further_top]
 
@@ -29,7 +34,7 @@ def main():
     print("Searching for env", e)
     video_feed = [int(os.getenv('VIDEO_FEED', 0))]
     for video_input in video_feed:
-        driver_code(video_input, robots)
+        driver_code(video_input, robots, marker_detector, tracker_workers)
         print("Video feed completed: ", video_input)
 
 def get_robot_configs(name):
@@ -40,10 +45,10 @@ def get_robot_configs(name):
             if d['name'] == name:
                 return [d]
 
-def driver_code(video_input, robots):
+def driver_code(video_input, robots, marker_detector=None, tracker_workers=None):
     solver_ran = False
     # parse the video adjust parameter to 0 to use webcam 
-    central_node = CentralNode(video_input, robots)
+    central_node = CentralNode(video_input, robots, marker_detector=marker_detector, tracker_workers=tracker_workers)
     central_node.init()
 
     # Wait for the mapping to be completed
@@ -147,7 +152,10 @@ def driver_code(video_input, robots):
                     action = rob['action']
 
                     completed = False
-                    if len(sol):
+                    if len(sol) and not central_node.robot_ready(robot):
+                        # Still holding a W:<ms> wait, the other robots keep getting their instructions
+                        new_smt_dict[name] = rob
+                    elif len(sol):
                         print("Running SMT solution")
                         central_node.send_instruction(robot, sol[0])
                         sol.pop(0)
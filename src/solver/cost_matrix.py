@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from solver.graph import Graph as gr
+from solver.grid_map import GridMap
+
+
+# Grid arrays and timings shipped once to every pool worker
+_worker_grid = {}
+
+
+def _init_worker(weights, height, timings):
+    _worker_grid["weights"] = weights
+    _worker_grid["height"] = height
+    _worker_grid["timings"] = timings
+
+
+def _worker_search(source, targets):
+    return gr.lattice_search(_worker_grid["weights"], _worker_grid["height"], source, *_worker_grid["timings"], targets=targets)
+
+
+class CostMatrixBuilder:
+    """
+    Builds the action point duration matrix for the MRTA solver.
+
+    One search per source settles every target at once, instead of an A* (plus a
+    reachability search) per ordered pair. The search is Graph.lattice_search with a
+    free initial heading, so every entry is exactly the driving and turning time the
+    lattice planner gives that leg, and the paths are returned alongside the matrix.
+    """
+
+    UNREACHABLE_COST = 10000
+
+    def __init__(self, grid, move_duration_ms, turn_duration_ms, block_size_cm):
+        self.grid = grid
+        self.move_duration_ms = move_duration_ms
+        self.turn_duration_ms = turn_duration_ms
+        self.block_size_cm = block_size_cm
+
+        # Row-per-node weights, node id = x * height + y
+        self.weights = grid.weights.reshape(-1, len(GridMap.OFFSETS))
+
+    def node_id(self, node):
+        return node[0] * self.grid.height + node[1]
+
+    def node_of(self, node_id):
+        return divmod(node_id, self.grid.height)
+
+    def timings(self):
+        return self.move_duration_ms, self.turn_duration_ms, self.block_size_cm
+
+    def build(self, points, workers=None):
+        """
+        points -> list of grid nodes (action points)
+        workers -> size of the process pool, None or 1 runs in this process
+
+        Returns the (N x N) duration matrix and a dict of (i, j) -> (node path, duration in ms).
+        """
+        ids = [self.node_id(p) for p in points]
+        size = len(points)
+        matrix = np.ones((size, size)) * CostMatrixBuilder.UNREACHABLE_COST
+        paths = {}
+
+        # Only search for targets in the same connected component as the source
+        targets = [[t for t, q in zip(ids, points) if self.grid.is_reachable(p, q)] for p in points]
+
+        if workers is not None and workers > 1 and size > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self.weights, self.grid.height, self.timings())) as pool:
+                searches = list(pool.map(_worker_search, ids, targets))
+        else:
+            searches = [gr.lattice_search(self.weights, self.grid.height, source, *self.timings(), targets=reachable) if reachable else {}
+                        for source, reachable in zip(ids, targets)]
+
+        for i, results in enumerate(searches):
+            for j, target in enumerate(ids):
+                if i == j:
+                    matrix[i][j] = 0
+                    continue
+                if target not in results:
+                    continue
+
+                duration, id_path = results[target]
+                matrix[i][j] = int(duration)
+                paths[(i, j)] = ([self.node_of(node_id) for node_id in id_path], duration)
+
+        return matrix, paths
@@ -0,0 +1,97 @@
+import heapq
+
+import numpy as np
+
+try:
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import dijkstra as sparse_dijkstra
+except ImportError:
+    coo_matrix = None
+
+from solver.grid_map import GridMap
+
+
+class FlowField:
+    """
+    Distance-to-goal field over a GridMap for one fixed goal (an action point).
+
+    A single reverse Dijkstra from the goal fills `distance` (cm to the goal) for every
+    node, and `next_cell` stores the neighbour each node should step to. Any robot then
+    gets its next cell, or its whole remaining path, without searching. Edge weights
+    are symmetric, so searching from the goal gives the same costs as towards it.
+    `version` is the map version the field was computed for.
+    """
+
+    def __init__(self, grid, goal_node, version=None):
+        self.grid = grid
+        self.goal = tuple(goal_node)
+        self.version = version
+        self.distance = None
+        self.next_cell = None
+        self.compute()
+
+    def compute(self):
+        grid = self.grid
+        goal_id = self.goal[0] * grid.height + self.goal[1]
+        if coo_matrix is not None:
+            sources, targets, weights = grid.edge_arrays()
+            size = grid.width * grid.height
+            matrix = coo_matrix((weights, (sources, targets)), shape=(size, size)).tocsr()
+            distance = sparse_dijkstra(matrix, indices=goal_id)
+        else:
+            distance = FlowField.dijkstra(grid, goal_id)
+        self.distance = distance.reshape(grid.width, grid.height)
+
+        # Best neighbour of every node: argmin over the 8 offsets of edge weight + neighbour distance
+        candidates = np.full((grid.width, grid.height, len(GridMap.OFFSETS)), GridMap.INF)
+        for k, (dx, dy) in enumerate(GridMap.OFFSETS):
+            src, dst = GridMap.shifted_slices(dx, dy, grid.width, grid.height)
+            candidates[src + (k,)] = grid.weights[src + (k,)] + self.distance[dst]
+        best = candidates.argmin(axis=2)
+
+        offsets = np.array(GridMap.OFFSETS)
+        nodes = np.stack(np.indices((grid.width, grid.height)), axis=-1)
+        self.next_cell = nodes + offsets[best]
+        stuck = ~np.isfinite(candidates.min(axis=2)) | ~np.isfinite(self.distance)
+        self.next_cell[stuck] = -1
+        self.next_cell[self.goal] = self.goal
+
+    @staticmethod
+    def dijkstra(grid, source):
+        # Plain heap Dijkstra over the flat weights, used when scipy isn't installed
+        weights = grid.weights.reshape(-1, len(GridMap.OFFSETS)).tolist()
+        offsets = [dx * grid.height + dy for dx, dy in GridMap.OFFSETS]
+        distance = [GridMap.INF] * (grid.width * grid.height)
+        distance[source] = 0.0
+
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > distance[u]:
+                continue
+            row = weights[u]
+            for k, offset in enumerate(offsets):
+                if row[k] == GridMap.INF:
+                    continue
+                new_distance = d + row[k]
+                if new_distance < distance[u + offset]:
+                    distance[u + offset] = new_distance
+                    heapq.heappush(heap, (new_distance, u + offset))
+        return np.array(distance)
+
+    def cost(self, node):
+        return float(self.distance[tuple(node)])
+
+    def next_step(self, node):
+        # O(1) lookup, None if the goal can't be reached from node
+        x, y = self.next_cell[tuple(node)].tolist()
+        return None if x < 0 else (x, y)
+
+    def path(self, node):
+        node = tuple(node)
+        if self.next_step(node) is None:
+            return None
+        path = [node]
+        while path[-1] != self.goal:
+            path.append(self.next_step(path[-1]))
+        return path
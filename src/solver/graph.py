@@ -1,10 +1,62 @@
+import heapq
 import math
+from collections import OrderedDict
 import networkx as nx
 import numpy as np
 from typing import Optional
 import cv2 as cv
 
 from utils import UtilityFunctions as uf
+from solver.grid_map import GridMap
+from solver.node_lookup import NodeLookup
+from solver.jump_point import JumpPointSearch
+from solver.hierarchical import HierarchicalPlanner
+from solver.flow_field import FlowField
+
+class PathCache:
+    """
+    LRU cache of search results keyed by query, at most `maxsize` of them.
+
+    Entries are only valid for the map version they were computed on, the whole cache
+    is evicted as soon as a lookup arrives with a different version. A graph keeps two:
+    the path cache holds (path, cost) entries of the planners, plus the solver's
+    (matrix, paths) entry per set of action points, and the flow field cache holds
+    FlowField objects. Flow fields are a whole grid each, so they get their own, much
+    smaller capacity instead of pushing paths out.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.version = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def sync_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        self.sync_version(version)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, version, entry):
+        self.sync_version(version)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
 
 class Graph(nx.Graph):
 
@@ -13,240 +65,472 @@ class Graph(nx.Graph):
     GRID_POS = "grid_pos"
     INF = float('inf')
     EDGE_WEIGHT = "distance_in_cm"
+    GRID_MAP = "grid_map"
+    NODE_LOOKUP = "node_lookup"
+    MAP_VERSION = "map_version"
+    PATH_CACHE = "path_cache"
+    FLOW_FIELD_CACHE = "flow_field_cache"
+    FLOW_FIELD_CACHE_SIZE = 16
+    HIERARCHY = "hierarchy"
+
+    # Cache key kinds
+    ASTAR = "astar"
+    JPS = "jps"
+    HPA = "hpa"
+    LATTICE = "lattice"
+    COST_MATRIX = "cost_matrix"
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    def set_node_positions(graph, matrix):
-        pos = {node: node for node in graph.nodes()}
-        nx.set_node_attributes(graph, pos, Graph.GRID_POS)
+    @staticmethod
+    def from_grid_map(grid):
+        # Materialize the array-backed grid as a networkx graph for the nx based helpers.
+        # Node attributes stay in the grid's arrays (see node_pixel_pos / is_node_near_obstacle), only edges carry data.
+        graph = nx.Graph()
+        graph.add_nodes_from(grid.nodes())
+        graph.add_edges_from((node_a, node_b, {Graph.EDGE_WEIGHT: weight}) for node_a, node_b, weight in grid.edges())
+        graph.graph[Graph.GRID_MAP] = grid
+        return graph
 
-        pixel_pos = {node: uf.apply_affine_transform(node, matrix) for node in graph.nodes()}
-        nx.set_node_attributes(graph, pixel_pos, Graph.PIXEL_POS)
+    @staticmethod
+    def get_grid_map(graph):
+        return graph.graph.get(Graph.GRID_MAP)
+
+    @staticmethod
+    def sync_nodes_from_grid_map(graph, nodes):
+        # Copy incident edge weights of the given nodes from the grid map, obstacle flags are read from it directly
+        grid = Graph.get_grid_map(graph)
+        for node in nodes:
+            for neighbor in graph.neighbors(node):
+                graph[node][neighbor][Graph.EDGE_WEIGHT] = grid.weight(node, neighbor)
+
+        # Only the clusters holding these nodes get recomputed
+        hierarchy = graph.graph.get(Graph.HIERARCHY)
+        if hierarchy is not None:
+            hierarchy.notify_changes(nodes)
+
+    @staticmethod
+    def node_arrays(graph, nodes=None):
+        # (pixel positions, obstacle flags) of the given nodes (all nodes in graph order if None) as arrays
+        nodes = list(graph.nodes()) if nodes is None else list(nodes)
+        grid = Graph.get_grid_map(graph)
+        if grid is not None:
+            ids = grid.node_ids(nodes)
+            return grid.node_positions()[ids], grid.node_flags()[ids]
+        positions = np.array([graph.nodes[node][Graph.PIXEL_POS] for node in nodes], dtype=np.float64).reshape(-1, 3)
+        flags = np.array([bool(graph.nodes[node].get(Graph.NEAR_OBSTACLE)) for node in nodes], dtype=bool)
+        return positions, flags
+
+    @staticmethod
+    def node_pixel_pos(graph, node):
+        grid = Graph.get_grid_map(graph)
+        if grid is not None:
+            return grid.get_pixel_pos(node)
+        return graph.nodes[node][Graph.PIXEL_POS]
+
+    @staticmethod
+    def node_grid_pos(graph, node):
+        # Grid-backed nodes are their own grid position
+        if Graph.get_grid_map(graph) is not None:
+            return node
+        return graph.nodes[node].get(Graph.GRID_POS)
 
     def draw_nodes_overlay(graph, overlay_image):
-        for node in graph.nodes():
-            transformed_node = graph.nodes[node][Graph.PIXEL_POS]
-            near_obstacle = Graph.is_node_near_obstacle(graph, node)
+        grid = Graph.get_grid_map(graph)
+        if grid is not None:
+            positions, flags = grid.node_positions(), grid.node_flags()
+        else:
+            positions, flags = Graph.node_arrays(graph)
+        for (x, y), near_obstacle in zip(positions[:, :2].astype(int).tolist(), flags.tolist()):
             color = uf.RED if near_obstacle else uf.GREEN
-            cv.circle(overlay_image, (int(transformed_node[0]), int(transformed_node[1])), radius=5, color=color, thickness=-1)
+            cv.circle(overlay_image, (x, y), radius=5, color=color, thickness=-1)
         return overlay_image
     
     def draw_edges_overlay(graph, overlay_image):
-        for edge in graph.edges():
-            node1_x, node1_y, _ = graph.nodes[edge[0]][Graph.PIXEL_POS]
-            node2_x, node2_y, _ = graph.nodes[edge[1]][Graph.PIXEL_POS]
-            color = uf.RED if Graph.is_node_near_obstacle(graph, edge[0], edge[1]) else uf.BLUE
-            cv.line(overlay_image, 
-                    (int(node1_x), int(node1_y)), 
-                    (int(node2_x), int(node2_y)), 
-                    color=color, thickness=1)
+        edges = list(graph.edges())
+        if not edges:
+            return overlay_image
+        positions_a, flags_a = Graph.node_arrays(graph, (a for a, _ in edges))
+        positions_b, flags_b = Graph.node_arrays(graph, (b for _, b in edges))
+        for (x1, y1), (x2, y2), blocked in zip(positions_a[:, :2].astype(int).tolist(), positions_b[:, :2].astype(int).tolist(), (flags_a | flags_b).tolist()):
+            color = uf.RED if blocked else uf.BLUE
+            cv.line(overlay_image, (x1, y1), (x2, y2), color=color, thickness=1)
         return overlay_image
 
     def is_node_near_obstacle(graph, node_a, node_b: Optional[any] = None):
+        grid = Graph.get_grid_map(graph)
+        if grid is not None:
+            return bool(grid.is_near_obstacle(node_a, node_b))
         if node_b is None:
             return graph.nodes[node_a].get(Graph.NEAR_OBSTACLE)
         return graph.nodes[node_a].get(Graph.NEAR_OBSTACLE) or graph.nodes[node_b].get(Graph.NEAR_OBSTACLE)
 
-    def add_diagonal_edges(grid_width, grid_height, graph):
-        for x, y in graph.nodes():
-            # Define the diagonal neighbors
-            diagonal_neighbors = [
-                (x - 1, y - 1),  # Northwest
-                (x - 1, y + 1),  # Northeast
-                (x + 1, y - 1),  # Southwest
-                (x + 1, y + 1)   # Southeast
-            ]
-
-            # Add edges to diagonal neighbors if they are within bounds
-            for node_x, node_y in diagonal_neighbors:
-                if 0 <= node_x < grid_width and 0 <= node_y < grid_height:
-                    graph.add_edge((x, y), (node_x, node_y))
-    
-    def update_graph_weights_based_on_obstacles(graph):
-        for node in graph.nodes:
-            if graph.nodes[node].get(Graph.NEAR_OBSTACLE, True):
-                for neighbor in graph.neighbors(node):
-                    graph[node][neighbor][Graph.EDGE_WEIGHT] = Graph.INF
-                    graph[neighbor][node][Graph.EDGE_WEIGHT] = Graph.INF 
-
-    DIAGONAL = "diagonal"
-    HORIZONTAL = "horizontal"
-    VERTICAL = "vertical"
-
-    def adjust_graph_weights(graph, conversion):
-        for edge in graph.edges():
-            node_a, node_b = edge
-            if Graph.is_node_near_obstacle(graph, node_a, node_b):
-                graph.edges[node_a, node_b][Graph.EDGE_WEIGHT] = Graph.INF
-                graph.edges[node_b, node_a][Graph.EDGE_WEIGHT] = Graph.INF
-            else:
-                distance_in_cm = Graph.adjust_distance_based_on_correction(graph, node_a, node_b, conversion)
-                graph.edges[node_a, node_b][Graph.EDGE_WEIGHT] = distance_in_cm
-                graph.edges[node_b, node_a][Graph.EDGE_WEIGHT] = distance_in_cm
-        return graph
+    def find_nodes_within_bounding_box(graph, min_x, max_x, min_y, max_y, proximity_threshold):
+        grid = Graph.get_grid_map(graph)
+        if grid is not None:
+            positions = grid.node_positions()
+        else:
+            nodes = list(graph.nodes())
+            positions, _ = Graph.node_arrays(graph, nodes)
+
+        # Check which nodes are within the bounding box of the QR code, all at once
+        xs, ys = positions[:, 0], positions[:, 1]
+        inside = (min_x - proximity_threshold <= xs) & (xs <= max_x + proximity_threshold) & \
+            (min_y - proximity_threshold <= ys) & (ys <= max_y + proximity_threshold)
+        ids = np.flatnonzero(inside)
+        return set(grid.node_of(ids)) if grid is not None else {nodes[i] for i in ids.tolist()}
     
     @staticmethod
-    def adjust_distance_based_on_correction(graph, node_a, node_b, conversion):
-            node_a_x, node_a_y, _ = graph.nodes[node_a][Graph.PIXEL_POS]
-            node_b_x, node_b_y, _ = graph.nodes[node_b][Graph.PIXEL_POS]
-            pixel_distance = uf.euclidean_distance((node_a_x,node_a_y), (node_b_x, node_b_y))
+    def passable_weight(u, v, d):
+        # Returning None hides blocked edges from networkx, so they're never expanded
+        weight = d[Graph.EDGE_WEIGHT]
+        return None if weight == Graph.INF else weight
 
-            # adjust the weight based on direction
-            distance_in_cm = float('inf')
-            direction = Graph.direction(node_a, node_b)
-            if direction == Graph.DIAGONAL:
-                distance_in_cm = pixel_distance * conversion[2] 
-            
-            elif direction == Graph.HORIZONTAL:
-                distance_in_cm = pixel_distance * conversion[0]
-
-            elif direction == Graph.VERTICAL: 
-                distance_in_cm = pixel_distance * conversion[1]
-            return distance_in_cm
-
-    @staticmethod
-    def direction(node_a, node_b):
-        x1, y1 = node_a
-        x2, y2 = node_b
-        if (x1 < x2 or x2 > x1) and (y1 < y2 or y2 > y1):
-            return Graph.DIAGONAL
-        if (x1 < x2 or x2 < x1) and y1 == y2:
-            return Graph.HORIZONTAL
-        if (x1 == x2) and (y1 < y2 or y2 < y1):
-            return Graph.VERTICAL
-        else:
+    @staticmethod
+    def safe_astar_path(graph, start_node, goal_node, heuristic):
+        # Reject unreachable queries in O(1) through the grid's component labels
+        grid = Graph.get_grid_map(graph)
+        if grid is not None and not grid.is_reachable(start_node, goal_node):
             return None
-        
-    def adjust_distance_based_on_correction_pixel(graph, pixel_pos_a, pixel_pos_b, conversion):
-        # Extract real-world coordinate
-        pos_a_x, pos_a_y = pixel_pos_a
-        pos_b_x, pos_b_y = pixel_pos_b
-        
-        # Calculate pixel distance
-        pixel_distance = uf.euclidean_distance((pos_a_x, pos_a_y), (pos_b_x, pos_b_y))
-        
-        # Determine the direction based on threshold
-        direction = Graph.direction_pixel((pos_a_x, pos_a_y), (pos_b_x, pos_b_y), pixel_distance/3)
-        
-        # Adjust the weight based on the determined direction
-        if direction == Graph.DIAGONAL:
-            return pixel_distance * conversion[2]
-        elif direction == Graph.HORIZONTAL:
-            return pixel_distance * conversion[0]
-        elif direction == Graph.VERTICAL:
-            return pixel_distance * conversion[1]
-        
-        # Default case if no valid direction
-        return float('inf')
-
-
-    @staticmethod
-    def direction_pixel(node_a_coords, node_b_coords, threshold):
-        x1, y1 = node_a_coords
-        x2, y2 = node_b_coords
-        
-        # Calculate the differences in x and y directions
-        delta_x = abs(x2 - x1)
-        delta_y = abs(y2 - y1)
-        
-        # Determine the movement direction based on the threshold
-        if delta_x > threshold and delta_y > threshold:
-            return Graph.DIAGONAL
-        elif delta_x > threshold and delta_y <= threshold:
-            return Graph.HORIZONTAL
-        elif delta_y > threshold and delta_x <= threshold:
-            return Graph.VERTICAL
-        else:
-            # If the movement is too small in all directions
+
+        try:
+            return nx.astar_path(graph, source=start_node, target=goal_node,
+                                 weight=Graph.passable_weight, heuristic=heuristic)
+        except nx.NetworkXNoPath:
+            print(f"No path exists between {start_node} and {goal_node}.")
             return None
 
+    @staticmethod
+    def jump_point_path(graph, start_node, goal_node):
+        # Jump Point Search while the grid's edge costs are uniform, plain A* otherwise
+        grid = Graph.get_grid_map(graph)
+        if grid is None or not grid.uniform_step_costs():
+            return Graph.safe_astar_path(graph, start_node, goal_node, Graph.heuristic)
+        return JumpPointSearch(grid).search(start_node, goal_node)
 
-    def update_graph_based_on_obstacle(graph, contour, proximity_threshold):
-        for node in graph.nodes:
-            node_x, node_y,_ = graph.nodes[node][Graph.PIXEL_POS]
-            distance = abs(cv.pointPolygonTest(contour, (node_x,node_y), True)) 
-            if distance <= proximity_threshold:
-                graph.nodes[node][Graph.NEAR_OBSTACLE] = True
-            else:
-                graph.nodes[node].setdefault(Graph.NEAR_OBSTACLE, False)
+    @staticmethod
+    def get_hierarchy(graph):
+        hierarchy = graph.graph.get(Graph.HIERARCHY)
+        grid = Graph.get_grid_map(graph)
+        if hierarchy is None and grid is not None:
+            hierarchy = HierarchicalPlanner(grid)
+            graph.graph[Graph.HIERARCHY] = hierarchy
+        return hierarchy
 
-    def update_graph_based_on_qr_code(graph, overlapping_nodes, previous_overlapping_nodes):
-        subgraph = graph.subgraph(overlapping_nodes)
-        for node in subgraph.nodes:
-            graph.nodes[node][Graph.NEAR_OBSTACLE] = True
+    @staticmethod
+    def hierarchical_path(graph, start_node, goal_node):
+        hierarchy = Graph.get_hierarchy(graph)
+        if hierarchy is None:
+            return Graph.safe_astar_path(graph, start_node, goal_node, Graph.heuristic)
+        return hierarchy.path(start_node, goal_node)
 
-        non_overlapping_nodes = (previous_overlapping_nodes - overlapping_nodes)
-        subgraph = graph.subgraph(non_overlapping_nodes)
-        for node in subgraph.nodes:
-            graph.nodes[node][Graph.NEAR_OBSTACLE] = False
+    def a_star_from_pixel_pos(graph, pixel_pos, goal, jump_points=False):
+        nearest_node = Graph.find_nearest_node(graph, pixel_pos)
+        path, _ = Graph.cached_astar_path(graph, nearest_node, goal, jump_points)
+        return path
 
-    def find_nodes_within_bounding_box(graph, min_x, max_x, min_y, max_y, proximity_threshold):
-        overlapping_nodes = set()
-        for node in graph.nodes():
-            node_pos = graph.nodes[node][Graph.PIXEL_POS]
-            node_x, node_y = node_pos[0], node_pos[1]
-            
-            # Check if the node is within the bounding box of the QR code
-            if min_x - proximity_threshold <= node_x <= max_x + proximity_threshold and \
-            min_y - proximity_threshold <= node_y <= max_y + proximity_threshold:
-                overlapping_nodes.add(node)
-        return overlapping_nodes
-    
     @staticmethod
-    def safe_astar_path(graph, start_node, goal_node, heuristic):
-        if not nx.has_path(graph, start_node, goal_node):
-            return None
+    def get_path_cache(graph):
+        cache = graph.graph.get(Graph.PATH_CACHE)
+        if cache is None:
+            cache = graph.graph[Graph.PATH_CACHE] = PathCache()
+        return cache
 
-        path = nx.astar_path(graph, source=start_node, target=goal_node, 
-                            weight= lambda u, v, d: Graph.INF if d[Graph.EDGE_WEIGHT] == Graph.INF else d[Graph.EDGE_WEIGHT],
-                            heuristic=heuristic)
-        # lambda u, v, d: Graph.INF if d[Graph.EDGE_WEIGHT] == Graph.INF else d[Graph.EDGE_WEIGHT]
-        # Check if any edge in the path has infinite weight
-        for u, v in zip(path[:-1], path[1:]):
-            if graph.edges[u, v].get(Graph.EDGE_WEIGHT, None) == Graph.INF:
-                print(f"No path exists: Infinite weight edge encountered between {u} and {v}.")
-                return None
-        return path
-    
+    @staticmethod
+    def cached_path(graph, key, planner):
+        # Returns (path, cost) for key, running planner() only on a miss for the current map version
+        cache = Graph.get_path_cache(graph)
+        version = Graph.get_map_version(graph)
+        entry = cache.get(key, version)
+        if entry is None:
+            path = planner()
+            cost = Graph.print_path_weights(graph, path) if path is not None else Graph.INF
+            entry = (path, cost)
+            cache.put(key, version, entry)
+        return entry
 
-    def a_star_from_pixel_pos(graph, pixel_pos, goal):
-        nearest_node = Graph.find_nearest_node(graph, pixel_pos)
-        path = Graph.safe_astar_path(graph, nearest_node, goal, Graph.heuristic)
-        return path
+    @staticmethod
+    def cached_astar_path(graph, start_node, goal_node, jump_points=False):
+        if jump_points:
+            return Graph.cached_path(graph, (Graph.JPS, start_node, goal_node),
+                                     lambda: Graph.jump_point_path(graph, start_node, goal_node))
+        return Graph.cached_path(graph, (Graph.ASTAR, start_node, goal_node),
+                                 lambda: Graph.safe_astar_path(graph, start_node, goal_node, Graph.heuristic))
+
+    @staticmethod
+    def cached_hierarchical_path(graph, start_node, goal_node):
+        return Graph.cached_path(graph, (Graph.HPA, start_node, goal_node),
+                                 lambda: Graph.hierarchical_path(graph, start_node, goal_node))
+
+    @staticmethod
+    def lattice_key(start_node, goal_node, move_duration_ms, turn_duration_ms, block_size_cm, start_heading=None):
+        return (Graph.LATTICE, tuple(start_node), tuple(goal_node), move_duration_ms, turn_duration_ms, block_size_cm, start_heading)
+
+    @staticmethod
+    def cached_lattice_path(graph, start_node, goal_node, move_duration_ms, turn_duration_ms, block_size_cm, start_heading=None):
+        # (path, duration in ms), the cost is the lattice's own driving and turning time rather than the path length
+        cache = Graph.get_path_cache(graph)
+        version = Graph.get_map_version(graph)
+        key = Graph.lattice_key(start_node, goal_node, move_duration_ms, turn_duration_ms, block_size_cm, start_heading)
+        entry = cache.get(key, version)
+        if entry is None:
+            entry = Graph.lattice_astar_path(graph, start_node, goal_node, move_duration_ms, turn_duration_ms, block_size_cm, start_heading)
+            cache.put(key, version, entry)
+        return entry
+
+    @staticmethod
+    def get_flow_field_cache(graph):
+        cache = graph.graph.get(Graph.FLOW_FIELD_CACHE)
+        if cache is None:
+            cache = graph.graph[Graph.FLOW_FIELD_CACHE] = PathCache(Graph.FLOW_FIELD_CACHE_SIZE)
+        return cache
+
+    @staticmethod
+    def cached_flow_field(graph, goal_node):
+        # One reverse Dijkstra per goal and map version, shared by every start heading there
+        cache = Graph.get_flow_field_cache(graph)
+        version = Graph.get_map_version(graph)
+        key = tuple(goal_node)
+        field = cache.get(key, version)
+        if field is None:
+            field = FlowField(Graph.get_grid_map(graph), goal_node, version)
+            cache.put(key, version, field)
+        return field
+
+    @staticmethod
+    def batch_paths(graph, start_nodes, goal_nodes, jump_points=False):
+        """
+        Paths for many (start, goal) pairs at once, returned as a list of (path, cost).
+        Starts sharing a goal are all answered from one flow field for that goal, so the
+        search work grows with the number of distinct goals rather than robots. The
+        others are single A* searches, Jump Point Search with jump_points.
+        """
+        starts_per_goal = {}
+        for start, goal in zip(start_nodes, goal_nodes):
+            starts_per_goal.setdefault(goal, set()).add(start)
+
+        results = []
+        grid = Graph.get_grid_map(graph)
+        for start, goal in zip(start_nodes, goal_nodes):
+            if grid is None or len(starts_per_goal[goal]) < 2:
+                results.append(Graph.cached_astar_path(graph, start, goal, jump_points))
+                continue
+            field = Graph.cached_flow_field(graph, goal)
+            path = field.path(start)
+            results.append((path, field.cost(start) if path is not None else Graph.INF))
+        return results
+
+    @staticmethod
+    def batch_paths_from_pixel_pos(graph, pixel_positions, goal_nodes, jump_points=False):
+        # Every start is mapped onto the grid in one vectorized lookup
+        return Graph.batch_paths(graph, Graph.find_nearest_nodes(graph, pixel_positions), goal_nodes, jump_points)
+
+    @staticmethod
+    def seed_path_cache(graph, key, path, cost=None):
+        # cost defaults to the path length, like Graph.cached_path
+        cache = Graph.get_path_cache(graph)
+        cache.put(key, Graph.get_map_version(graph), (path, Graph.print_path_weights(graph, path) if cost is None else cost))
+
+    @staticmethod
+    def get_map_version(graph):
+        return graph.graph.get(Graph.MAP_VERSION, 0)
+
+    @staticmethod
+    def get_node_lookup(graph):
+        # Built once per grid, so the inverse transformation is only computed on refresh
+        lookup = graph.graph.get(Graph.NODE_LOOKUP)
+        grid = Graph.get_grid_map(graph)
+        if lookup is None and grid is not None:
+            lookup = NodeLookup(grid)
+            graph.graph[Graph.NODE_LOOKUP] = lookup
+        return lookup
 
-    # Feel free to improve try to use inverse_transformation instead
     @staticmethod
     def find_nearest_node(graph, query_point):
-        # Extract node positions
-        positions = nx.get_node_attributes(graph, Graph.PIXEL_POS)
-        query_point = query_point + (np.float32(1.0),)
-        distances = {
-                node: np.linalg.norm(np.array(pos) - np.array(query_point))
-                for node, pos in positions.items()
-            }
-        
-        # Find the node with the minimum distance
-        nearest_node = min(distances, key=distances.get)
-        return nearest_node
+        return Graph.find_nearest_nodes(graph, [query_point])[0]
+
+    @staticmethod
+    def find_nearest_nodes(graph, query_points):
+        lookup = Graph.get_node_lookup(graph)
+        if lookup is not None:
+            return lookup.nearest_batch(query_points)
+
+        # No grid map attached, compare against every node position at once
+        nodes = list(graph.nodes())
+        positions = Graph.node_arrays(graph, nodes)[0][:, :2]
+        points = np.array([tuple(p)[:2] for p in query_points], dtype=np.float64).reshape(-1, 2)
+        distances = ((positions[None, :, :] - points[:, None, :]) ** 2).sum(axis=-1)
+        return [nodes[i] for i in distances.argmin(axis=1)]
 
     @staticmethod
     def print_path_weights(graph, path):
         total_weight = []
-        pixel_distances = []
         for i in range(len(path) - 1):
             node1 = path[i]
             node2 = path[i + 1]
             weight = graph[node1][node2].get(Graph.EDGE_WEIGHT, None) 
-            pixel_dist = uf.euclidean_distance(graph.nodes[node1][Graph.PIXEL_POS], graph.nodes[node2][Graph.PIXEL_POS])
             total_weight.append(weight)
-            pixel_distances.append(pixel_dist)
         total = uf.kahan_sum(total_weight)
-        total_pixel_dist = uf.kahan_sum(pixel_distances)
-        # print(f"Total path weight: {total}, Total pixel distance: {total_pixel_dist}")
-
         return total
 
+    @staticmethod
+    def line_of_sight(graph, node_a, node_b):
+        grid = Graph.get_grid_map(graph)
+        if grid is None:
+            return False
+        return grid.line_of_sight(node_a, node_b)
+
+    @staticmethod
+    def smooth_path(graph, path):
+        # Line of sight string pulling, keeps only the nodes where the path has to bend around an obstacle
+        if path is None or len(path) < 3:
+            return path
+        waypoints = [path[0]]
+        i = 0
+        while i < len(path) - 1:
+            j = i + 1
+            while j + 1 < len(path) and Graph.line_of_sight(graph, path[i], path[j + 1]):
+                j += 1
+            waypoints.append(path[j])
+            i = j
+        return waypoints
+
+    @staticmethod
+    def segment_vector_cm(graph, node_a, node_b):
+        # (dx, dy) in cm along the grid axes between two possibly non-adjacent nodes
+        size_x, size_y = Graph.get_grid_map(graph).cell_size()
+        return (node_b[0] - node_a[0]) * size_x, (node_b[1] - node_a[1]) * size_y
+
+    @staticmethod
+    def heading(src, dest):
+        # Grid heading in degrees of the move src -> dest, 0 being +x and 90 being +y. Grid x runs
+        # to the right of the image and y down it, so headings grow clockwise on the image.
+        dx = dest[0] - src[0]
+        dy = dest[1] - src[1]
+
+        if dx == 0:
+            return 90 if dy > 0 else 270
+        elif dy == 0:
+            return 0 if dx > 0 else 180
+        elif dx > 0:
+            return 45 if dy > 0 else 315
+        else:
+            return 135 if dy > 0 else 225
+
+    @staticmethod
+    def move_duration(distance_cm, move_duration_ms, block_size_cm):
+        # Driving time in ms, the one time scale shared by the cost matrix, the planners and the instruction timing
+        return distance_cm * move_duration_ms / block_size_cm
+
+    HEADINGS = 8
+
+    @staticmethod
+    def heading_steps(heading_a, heading_b):
+        # Number of 45 degree turns between two heading indices
+        diff = abs(heading_a - heading_b) % Graph.HEADINGS
+        return min(diff, Graph.HEADINGS - diff)
+
+    @staticmethod
+    def lattice_search(weights, height, source, move_duration_ms, turn_duration_ms, block_size_cm, start_heading=None, targets=None, heuristic=None):
+        """
+        Search over (node id, heading) states of a grid, node id = x * height + y and
+        weights the (nodes x 8) edge weight array of a GridMap.
+
+        Moving costs Graph.move_duration of the edge weight and every 45 degree heading
+        change costs turn_duration_ms, so straighter routes win over equally long
+        staircases. start_heading is in degrees (see Graph.heading); None means the
+        first turn is free. Returns {target id: (duration ms, path of ids)} for every
+        reached target, targets=None settles the whole grid. heuristic(node id) turns
+        the search into A* and has to be admissible.
+        """
+        offsets = [dx * height + dy for dx, dy in GridMap.OFFSETS]
+        move_headings = [Graph.heading((0, 0), offset) // 45 for offset in GridMap.OFFSETS]
+        remaining = set(targets) if targets is not None else None
+
+        initial = int(round(start_heading / 45)) % Graph.HEADINGS if start_heading is not None else -1
+        costs = {(source, initial): 0.0}
+        parents = {(source, initial): None}
+        closed = set()
+        found = {}
+        rows = {}
+
+        heap = [(heuristic(source) if heuristic else 0.0, 0.0, source, initial)]
+        while heap:
+            _, cost, u, heading = heapq.heappop(heap)
+            state = (u, heading)
+            if state in closed:
+                continue
+            closed.add(state)
+
+            # The first state popped for a node is its cheapest over all headings
+            if u not in found and (remaining is None or u in remaining):
+                found[u] = (cost, state)
+                if remaining is not None:
+                    remaining.discard(u)
+                    if not remaining:
+                        break
+
+            row = rows.get(u)
+            if row is None:
+                row = rows[u] = weights[u].tolist()
+
+            for k, offset in enumerate(offsets):
+                weight = row[k]
+                if weight == Graph.INF:
+                    continue
+                new_heading = move_headings[k]
+                turns = Graph.heading_steps(heading, new_heading) if heading >= 0 else 0
+                new_cost = cost + Graph.move_duration(weight, move_duration_ms, block_size_cm) + turns * turn_duration_ms
+                next_state = (u + offset, new_heading)
+                if new_cost < costs.get(next_state, Graph.INF):
+                    costs[next_state] = new_cost
+                    parents[next_state] = state
+                    heapq.heappush(heap, (new_cost + (heuristic(u + offset) if heuristic else 0.0), new_cost, u + offset, new_heading))
+
+        results = {}
+        for target, (cost, state) in found.items():
+            path = []
+            while state is not None:
+                path.append(state[0])
+                state = parents[state]
+            results[target] = (cost, path[::-1])
+        return results
+
+    @staticmethod
+    def lattice_astar_path(graph, start_node, goal_node, move_duration_ms, turn_duration_ms, block_size_cm, start_heading=None):
+        """
+        Time-optimal path over (cell, heading) states, see Graph.lattice_search.
+
+        Returns (path, duration in ms), (None, INF) if the goal can't be reached.
+        """
+        grid = Graph.get_grid_map(graph)
+        if not grid.is_reachable(start_node, goal_node):
+            return None, Graph.INF
+
+        height = grid.height
+        weights = grid.weights.reshape(-1, len(GridMap.OFFSETS))
+        goal_x, goal_y = goal_node
+
+        # Cheapest cm per grid unit keeps the straight-line heuristic admissible
+        finite = np.isfinite(weights)
+        if not finite.any():
+            return ([start_node], 0.0) if tuple(start_node) == tuple(goal_node) else (None, Graph.INF)
+        per_unit = [weights[:, k][finite[:, k]] / math.hypot(*GridMap.OFFSETS[k]) for k in range(len(GridMap.OFFSETS))]
+        cm_per_unit = min(w.min() for w in per_unit if len(w))
+
+        def heuristic(node_id):
+            x, y = divmod(node_id, height)
+            return Graph.move_duration(math.hypot(goal_x - x, goal_y - y) * cm_per_unit, move_duration_ms, block_size_cm)
+
+        goal = goal_x * height + goal_y
+        results = Graph.lattice_search(weights, height, start_node[0] * height + start_node[1], move_duration_ms, turn_duration_ms,
+                                       block_size_cm, start_heading, [goal], heuristic)
+        if goal not in results:
+            return None, Graph.INF
+        cost, id_path = results[goal]
+        return [divmod(node_id, height) for node_id in id_path], cost
+
     @staticmethod
     def heuristic(node, goal):
         return uf.euclidean_distance(node, goal)       
@@ -257,7 +541,7 @@ class Graph(nx.Graph):
             node_a = path[i]
             node_b = path[i + 1]
             
-            pos_a = graph.nodes[node_a][Graph.PIXEL_POS]
+            pos_a = Graph.node_pixel_pos(graph, node_a)
             edge_weight = graph[node_a][node_b].get(Graph.EDGE_WEIGHT, None)
             cv.putText(overlay_image, str(edge_weight), (int(pos_a[0]), int(pos_a[1])), 
                 cv.FONT_HERSHEY_SIMPLEX, 0.8, uf.GREEN, 2)
@@ -269,8 +553,8 @@ class Graph(nx.Graph):
             node_a = path[i]
             node_b = path[i + 1]
             
-            pos_a = graph.nodes[node_a][Graph.PIXEL_POS]
-            pos_b = graph.nodes[node_b][Graph.PIXEL_POS]
+            pos_a = Graph.node_pixel_pos(graph, node_a)
+            pos_b = Graph.node_pixel_pos(graph, node_b)
 
             cv.line(image, (int(pos_a[0]), int(pos_a[1])), 
                     (int(pos_b[0]), int(pos_b[1])), uf.GREEN, 2)  
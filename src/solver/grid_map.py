@@ -0,0 +1,361 @@
+import math
+
+import cv2 as cv
+import numpy as np
+
+
+class GridMap:
+    """
+    Dense, array-backed 8-connected grid over the arena.
+
+    Node (x, y) lives at index [x, y] of every per-node array:
+        pixel_pos     -> (W, H, 3) homogeneous pixel position (x, y, w)
+        near_obstacle -> (W, H) occupancy flags
+        weights       -> (W, H, 8) edge weight in cm towards each of OFFSETS
+    Out-of-bounds and blocked edges are stored as INF.
+    """
+
+    INF = float('inf')
+
+    # Neighbour offsets (dx, dy); index k matches weights[..., k]
+    OFFSETS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1), (1, -1), (-1, 1))
+    OFFSET_INDEX = {offset: k for k, offset in enumerate(OFFSETS)}
+
+    # Offsets that yield every undirected edge exactly once
+    FORWARD_OFFSETS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
+    # Indices into the pixel conversion list
+    HORIZONTAL = 0
+    VERTICAL = 1
+    DIAGONAL = 2
+
+    # Relative spread of edge lengths still treated as a uniform cost grid
+    UNIFORM_TOLERANCE = 0.05
+
+    # The clearance penalty is quantized to this many steps between 0 and its maximum, and a
+    # node only moves to another step once its raw penalty is HYSTERESIS steps away, so per
+    # frame noise in the obstacle distances doesn't register as a map change
+    PENALTY_LEVELS = 8
+    PENALTY_HYSTERESIS = 0.75
+
+    def __init__(self, width, height, matrix, conversion=None):
+        self.width = width
+        self.height = height
+        self.matrix = matrix
+        self.pixel_pos = GridMap.compute_pixel_positions(width, height, matrix)
+        self.near_obstacle = np.zeros((width, height), dtype=bool)
+
+        # near_obstacle is the union of the detected contours and explicitly marked nodes (QR codes)
+        self.contour_obstacle = np.zeros((width, height), dtype=bool)
+        self.marked_obstacle = np.zeros((width, height), dtype=bool)
+
+        self.weights = np.full((width, height, len(GridMap.OFFSETS)), GridMap.INF)
+        self.distances = self.weights.copy()
+        self.obstacle_distance = np.full((width, height), GridMap.INF)
+        self.conversion = None
+        self.components = None
+        self.step_costs = None
+
+        # Soft clearance layer, per node extra cost factor from its obstacle distance (see set_clearance)
+        self.clearance = None
+        self.penalty = np.zeros((width, height))
+
+        if conversion is not None:
+            self.compute_weights(conversion)
+
+    @staticmethod
+    def compute_pixel_positions(width, height, matrix):
+        # Same result as uf.apply_affine_transform, for every node at once
+        xs, ys = np.meshgrid(np.arange(width), np.arange(height), indexing='ij')
+        points = np.stack([xs, ys, np.ones_like(xs)], axis=-1).astype(np.float32)
+        transformed = points @ np.asarray(matrix, dtype=np.float64).T
+
+        w = transformed[..., 2:3]
+        scale = np.where(w != 0, w, 1.0)
+        transformed[..., :2] /= scale
+        return transformed
+
+    @staticmethod
+    def shifted_slices(dx, dy, width, height):
+        # Slices selecting (source, neighbour) pairs for a constant offset
+        def axis(d, size):
+            if d >= 0:
+                return slice(0, size - d), slice(d, size)
+            return slice(-d, size), slice(0, size + d)
+
+        src_x, dst_x = axis(dx, width)
+        src_y, dst_y = axis(dy, height)
+        return (src_x, src_y), (dst_x, dst_y)
+
+    @staticmethod
+    def conversion_index(dx, dy):
+        if dx != 0 and dy != 0:
+            return GridMap.DIAGONAL
+        if dx != 0:
+            return GridMap.HORIZONTAL
+        return GridMap.VERTICAL
+
+    def compute_weights(self, conversion):
+        # Unblocked edge lengths only depend on the geometry, obstacles are applied on top
+        self.conversion = conversion
+        distances = np.full((self.width, self.height, len(GridMap.OFFSETS)), GridMap.INF)
+        for k, (dx, dy) in enumerate(GridMap.OFFSETS):
+            src, dst = GridMap.shifted_slices(dx, dy, self.width, self.height)
+            delta = self.pixel_pos[dst][..., :2] - self.pixel_pos[src][..., :2]
+            distances[src + (k,)] = np.hypot(delta[..., 0], delta[..., 1]) * conversion[GridMap.conversion_index(dx, dy)]
+
+        self.distances = distances
+        self.weights = distances.copy()
+        self.step_costs = None
+        self.penalty = self.clearance_penalty()
+        self.refresh_weights()
+        return self.weights
+
+    def uniform_step_costs(self):
+        # (straight, diagonal) edge length if every edge of each kind has about the same length, else False
+        if self.step_costs is None:
+            self.step_costs = False
+            straight = self.distances[..., :4][np.isfinite(self.distances[..., :4])]
+            diagonal = self.distances[..., 4:][np.isfinite(self.distances[..., 4:])]
+            if len(straight) and len(diagonal):
+                straight_cost, diagonal_cost = straight.mean(), diagonal.mean()
+                uniform = np.abs(straight - straight_cost).max() <= GridMap.UNIFORM_TOLERANCE * straight_cost and \
+                    np.abs(diagonal - diagonal_cost).max() <= GridMap.UNIFORM_TOLERANCE * diagonal_cost
+                if uniform and straight_cost <= diagonal_cost < 2 * straight_cost:
+                    self.step_costs = (float(straight_cost), float(diagonal_cost))
+        # Clearance penalties make the weights non-uniform even on a uniform geometry
+        return self.step_costs if not self.penalty.any() else False
+
+    def refresh_weights(self, changed=None):
+        # Re-apply obstacle blocking and clearance penalties to the edges touching changed nodes (every edge if None)
+        for k, (dx, dy) in enumerate(GridMap.OFFSETS):
+            src, dst = GridMap.shifted_slices(dx, dy, self.width, self.height)
+            blocked = self.near_obstacle[src] | self.near_obstacle[dst]
+            factor = 1.0 + (self.penalty[src] + self.penalty[dst]) / 2
+            weights = np.where(blocked, GridMap.INF, self.distances[src + (k,)] * factor)
+
+            view = self.weights[src + (k,)]
+            if changed is None:
+                view[...] = weights
+            else:
+                affected = changed[src] | changed[dst]
+                view[affected] = weights[affected]
+
+    def cm_per_pixel(self):
+        if self.conversion is None:
+            return None
+        return (self.conversion[GridMap.HORIZONTAL] + self.conversion[GridMap.VERTICAL]) / 2
+
+    def set_clearance(self, footprint_cm, inflation_cm, penalty=1.0):
+        """
+        Edges get more expensive the closer their nodes are to an obstacle. The extra cost,
+        relative to the edge length, grows quadratically from 0 at footprint_cm + inflation_cm
+        to penalty at footprint_cm. footprint_cm=None turns the layer off.
+        Returns the boolean mask of nodes whose penalty changed.
+        """
+        self.clearance = (footprint_cm, inflation_cm, penalty) if footprint_cm is not None else None
+        return self.refresh_penalty(force=True)
+
+    def clearance_penalty(self):
+        if self.clearance is None or self.conversion is None:
+            return np.zeros((self.width, self.height))
+        footprint_cm, inflation_cm, penalty = self.clearance
+        distance_cm = self.obstacle_distance * self.cm_per_pixel()
+        depth = np.clip((footprint_cm + inflation_cm - distance_cm) / max(inflation_cm, 1e-9), 0.0, 1.0)
+        return penalty * depth ** 2
+
+    def refresh_penalty(self, force=False):
+        # force re-quantizes every node, for when the clearance parameters themselves changed
+        penalty = self.clearance_penalty()
+        step = self.clearance[2] / GridMap.PENALTY_LEVELS if self.clearance is not None else 0.0
+        if step > 0:
+            quantized = np.round(penalty / step) * step
+            moved = np.abs(penalty - self.penalty) > GridMap.PENALTY_HYSTERESIS * step
+            penalty = np.where(moved | force, quantized, self.penalty)
+        changed = ~np.isclose(penalty, self.penalty)
+        self.penalty = penalty
+        if self.conversion is not None and changed.any():
+            self.refresh_weights(changed)
+        return changed
+
+    def clearance_reach_px(self):
+        # How far from an obstacle (in pixels) the clearance layer still adds cost
+        if self.clearance is None or self.conversion is None:
+            return 0
+        footprint_cm, inflation_cm, _ = self.clearance
+        return (footprint_cm + inflation_cm) / self.cm_per_pixel()
+
+    def edge_arrays(self, bounds=None):
+        # (sources, targets, weights) of every passable directed edge inside bounds = (x0, x1, y0, y1),
+        # ids are local to bounds (x * bound height + y), ready for a scipy sparse matrix
+        x0, x1, y0, y1 = bounds if bounds is not None else (0, self.width, 0, self.height)
+        width, height = x1 - x0, y1 - y0
+        block = self.weights[x0:x1, y0:y1]
+        local = np.arange(width * height).reshape(width, height)
+
+        sources, targets, weights = [], [], []
+        for k, (dx, dy) in enumerate(GridMap.OFFSETS):
+            src, dst = GridMap.shifted_slices(dx, dy, width, height)
+            edge_weights = block[src + (k,)]
+            passable = np.isfinite(edge_weights)
+            sources.append(local[src][passable])
+            targets.append(local[dst][passable])
+            weights.append(edge_weights[passable])
+        return np.concatenate(sources), np.concatenate(targets), np.concatenate(weights)
+
+    def in_bounds(self, node):
+        x, y = node
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def nodes(self):
+        return ((x, y) for x in range(self.width) for y in range(self.height))
+
+    # Node ids (x * height + y) index the flattened per-node arrays
+    def node_ids(self, nodes):
+        nodes = np.asarray(list(nodes), dtype=np.int64).reshape(-1, 2)
+        return nodes[:, 0] * self.height + nodes[:, 1]
+
+    def node_of(self, node_ids):
+        return [divmod(node_id, self.height) for node_id in np.asarray(node_ids).tolist()]
+
+    def node_positions(self):
+        # (N, 3) homogeneous pixel positions by node id, a view on pixel_pos
+        return self.pixel_pos.reshape(-1, 3)
+
+    def node_flags(self):
+        return self.near_obstacle.reshape(-1)
+
+    def neighbors(self, node):
+        x, y = node
+        for dx, dy in GridMap.OFFSETS:
+            if 0 <= x + dx < self.width and 0 <= y + dy < self.height:
+                yield (x + dx, y + dy)
+
+    def passable_neighbors(self, node):
+        # (neighbour, weight) pairs for every edge that is not blocked
+        x, y = node
+        row = self.weights[x, y]
+        for k, (dx, dy) in enumerate(GridMap.OFFSETS):
+            if row[k] != GridMap.INF:
+                yield (x + dx, y + dy), row[k]
+
+    def weight(self, node_a, node_b):
+        offset = (node_b[0] - node_a[0], node_b[1] - node_a[1])
+        k = GridMap.OFFSET_INDEX.get(offset)
+        if k is None or not self.in_bounds(node_a) or not self.in_bounds(node_b):
+            return None
+        return float(self.weights[node_a[0], node_a[1], k])
+
+    def edges(self):
+        # (node_a, node_b, weight) for each in-bounds undirected edge
+        for dx, dy in GridMap.FORWARD_OFFSETS:
+            k = GridMap.OFFSET_INDEX[(dx, dy)]
+            src, _ = GridMap.shifted_slices(dx, dy, self.width, self.height)
+            xs, ys = np.meshgrid(np.arange(self.width)[src[0]], np.arange(self.height)[src[1]], indexing='ij')
+            weights = self.weights[src + (k,)]
+            for x, y, w in zip(xs.ravel().tolist(), ys.ravel().tolist(), weights.ravel().tolist()):
+                yield (x, y), (x + dx, y + dy), w
+
+    def is_near_obstacle(self, node_a, node_b=None):
+        if node_b is None:
+            return bool(self.near_obstacle[node_a])
+        return bool(self.near_obstacle[node_a] or self.near_obstacle[node_b])
+
+    def line_of_sight(self, node_a, node_b):
+        # True if no cell under the straight segment between the two nodes is near an obstacle
+        (ax, ay), (bx, by) = node_a, node_b
+        samples = max(2, 4 * int(max(abs(bx - ax), abs(by - ay))) + 1)
+        t = np.linspace(0.0, 1.0, samples)
+        xs = np.rint(ax + t * (bx - ax)).astype(int)
+        ys = np.rint(ay + t * (by - ay)).astype(int)
+        return not self.near_obstacle[xs, ys].any()
+
+    def cell_size(self):
+        # Typical length in cm of one step along x and along y
+        sizes = []
+        for offset in ((1, 0), (0, 1)):
+            lengths = self.distances[..., GridMap.OFFSET_INDEX[offset]]
+            lengths = lengths[np.isfinite(lengths)]
+            sizes.append(float(np.median(lengths)) if len(lengths) else 0.0)
+        return tuple(sizes)
+
+    def update_obstacles(self, contours, image_shape, proximity_threshold):
+        """
+        Rasterize all obstacle contours once and flag every node whose pixel position
+        lies within proximity_threshold pixels of an obstacle (inside counts as 0).
+        Returns the boolean mask of nodes whose flag changed.
+        """
+        # Only the part of the image around the grid matters, obstacles further out can't flag a node
+        margin = int(math.ceil(max(proximity_threshold, self.clearance_reach_px()))) + 1
+        x0 = max(0, int(np.floor(self.pixel_pos[..., 0].min())) - margin)
+        y0 = max(0, int(np.floor(self.pixel_pos[..., 1].min())) - margin)
+        x1 = min(image_shape[1], int(np.ceil(self.pixel_pos[..., 0].max())) + margin + 1)
+        y1 = min(image_shape[0], int(np.ceil(self.pixel_pos[..., 1].max())) + margin + 1)
+
+        self.obstacle_distance = np.full((self.width, self.height), GridMap.INF)
+        if x1 > x0 and y1 > y0:
+            free = np.full((y1 - y0, x1 - x0), 255, dtype=np.uint8)
+            if len(contours):
+                cv.drawContours(free, list(contours), -1, 0, thickness=cv.FILLED, offset=(-x0, -y0))
+            distance = cv.distanceTransform(free, cv.DIST_L2, 5)
+
+            # Sample the distance field at every node, nodes off-image are never near an obstacle
+            cols = np.rint(self.pixel_pos[..., 0]).astype(int) - x0
+            rows = np.rint(self.pixel_pos[..., 1]).astype(int) - y0
+            on_image = (rows >= 0) & (rows < distance.shape[0]) & (cols >= 0) & (cols < distance.shape[1])
+            self.obstacle_distance[on_image] = distance[rows[on_image], cols[on_image]]
+
+        self.contour_obstacle = self.obstacle_distance <= proximity_threshold
+        return self.merge_obstacle_layers() | self.refresh_penalty()
+
+    def set_near_obstacle(self, nodes, value=True):
+        for node in nodes:
+            self.marked_obstacle[node] = value
+        return self.merge_obstacle_layers()
+
+    def merge_obstacle_layers(self):
+        # Returns the boolean mask of nodes whose flag changed
+        near_obstacle = self.contour_obstacle | self.marked_obstacle
+        changed = near_obstacle != self.near_obstacle
+        self.near_obstacle = near_obstacle
+        if changed.any():
+            self.components = None
+
+        if self.conversion is not None:
+            self.refresh_weights(changed)
+        return changed
+
+    def restore_obstacles(self, contour_obstacle, marked_obstacle, obstacle_distance):
+        # Obstacle layers saved from an earlier grid of the same size, returns the changed mask
+        if np.shape(contour_obstacle) != self.near_obstacle.shape:
+            return np.zeros_like(self.near_obstacle)
+        self.contour_obstacle = np.asarray(contour_obstacle, dtype=bool)
+        self.marked_obstacle = np.asarray(marked_obstacle, dtype=bool)
+        self.obstacle_distance = np.asarray(obstacle_distance, dtype=np.float64)
+        return self.merge_obstacle_layers() | self.refresh_penalty()
+
+    def copy_obstacles_from(self, other):
+        if other.near_obstacle.shape != self.near_obstacle.shape:
+            return
+        self.contour_obstacle = other.contour_obstacle.copy()
+        self.marked_obstacle = other.marked_obstacle.copy()
+        self.near_obstacle = other.near_obstacle.copy()
+        self.obstacle_distance = other.obstacle_distance.copy()
+        self.components = None
+
+    def component_labels(self):
+        # 8-connected components of the free cells, 0 marks blocked cells.
+        # An edge is only blocked when one of its ends is, so free neighbours are always connected.
+        if self.components is None:
+            free = (~self.near_obstacle).astype(np.uint8)
+            _, self.components = cv.connectedComponents(free, connectivity=8, ltype=cv.CV_32S)
+        return self.components
+
+    def is_reachable(self, node_a, node_b):
+        if tuple(node_a) == tuple(node_b):
+            return True
+        labels = self.component_labels()
+        return labels[node_a] != 0 and labels[node_a] == labels[node_b]
+
+    def get_pixel_pos(self, node):
+        return tuple(self.pixel_pos[node].tolist())
@@ -0,0 +1,310 @@
+import heapq
+import math
+
+import numpy as np
+
+try:
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import dijkstra as sparse_dijkstra
+except ImportError:
+    coo_matrix = None
+
+from solver.grid_map import GridMap
+
+
+class HierarchicalPlanner:
+    """
+    HPA* (hierarchical path-finding A*) over a GridMap.
+
+    The grid is cut into square clusters. Every run of free cells along the border of
+    two neighbouring clusters is an entrance, represented by one transition (two for
+    wide entrances). Entrance-to-entrance costs inside each cluster are precomputed,
+    so a query only searches a small abstract graph and then stitches the cached
+    cluster paths together.
+
+    notify_changes marks the clusters holding changed nodes as dirty. Only those
+    clusters, and the neighbours whose shared entrances moved, are recomputed on the
+    next query.
+    """
+
+    CLUSTER_SIZE = 10
+
+    # Entrances at least this wide get a transition at both ends instead of one in the middle
+    WIDE_ENTRANCE = 6
+
+    def __init__(self, grid, cluster_size=CLUSTER_SIZE):
+        self.grid = grid
+        self.width = grid.width
+        self.height = grid.height
+        self.cluster_size = cluster_size
+        self.clusters_x = math.ceil(grid.width / cluster_size)
+        self.clusters_y = math.ceil(grid.height / cluster_size)
+
+        self.offsets = [dx * grid.height + dy for dx, dy in GridMap.OFFSETS]
+        self.weights = None
+
+        distances = grid.distances.reshape(-1, len(GridMap.OFFSETS))
+        per_unit = [distances[:, k][np.isfinite(distances[:, k])] / math.hypot(*GridMap.OFFSETS[k]) for k in range(len(GridMap.OFFSETS))]
+        per_unit = [w.min() for w in per_unit if len(w)]
+        self.cm_per_unit = min(per_unit) if per_unit else 0.0
+
+        # (cluster_a, cluster_b) -> [(cell_a, cell_b, weight)], cluster_a < cluster_b
+        self.borders = {}
+        # cluster -> {(cell_a, cell_b): (cost, path)} between its transition cells
+        self.intra = {}
+        # cluster -> search trees of compute_intra_sparse, used to recover cell paths
+        self.trees = {}
+        # cell -> {cell: (cost, path)} over all clusters, rebuilt after a refresh
+        self.abstract = None
+        self.dirty = {(cx, cy) for cx in range(self.clusters_x) for cy in range(self.clusters_y)}
+
+    def node_id(self, node):
+        return node[0] * self.height + node[1]
+
+    def node_of(self, node_id):
+        return divmod(node_id, self.height)
+
+    def cluster_of(self, node_id):
+        x, y = divmod(node_id, self.height)
+        return (x // self.cluster_size, y // self.cluster_size)
+
+    def bounds(self, cluster):
+        cx, cy = cluster
+        x0, y0 = cx * self.cluster_size, cy * self.cluster_size
+        return x0, min(x0 + self.cluster_size, self.width), y0, min(y0 + self.cluster_size, self.height)
+
+    def heuristic(self, a, b):
+        ax, ay = divmod(a, self.height)
+        bx, by = divmod(b, self.height)
+        return math.hypot(ax - bx, ay - by) * self.cm_per_unit
+
+    def local_search(self, source, targets, bounds):
+        # Dijkstra from source that never leaves bounds, returns {target: (cost, path of ids)}
+        x0, x1, y0, y1 = bounds
+        distances = {source: 0.0}
+        parents = {source: None}
+        remaining = set(targets)
+        settled = set()
+
+        heap = [(0.0, source)]
+        while heap and remaining:
+            distance, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            remaining.discard(u)
+
+            row = self.weights[u]
+            for k, offset in enumerate(self.offsets):
+                if row[k] == GridMap.INF:
+                    continue
+                v = u + offset
+                x, y = divmod(v, self.height)
+                if not (x0 <= x < x1 and y0 <= y < y1):
+                    continue
+                new_distance = distance + row[k]
+                if new_distance < distances.get(v, GridMap.INF):
+                    distances[v] = new_distance
+                    parents[v] = u
+                    heapq.heappush(heap, (new_distance, v))
+
+        results = {}
+        for target in targets:
+            if target not in settled:
+                continue
+            path = [target]
+            while parents[path[-1]] is not None:
+                path.append(parents[path[-1]])
+            results[target] = (distances[target], path[::-1])
+        return results
+
+    def neighbour_clusters(self, cluster):
+        cx, cy = cluster
+        for other in ((cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)):
+            if 0 <= other[0] < self.clusters_x and 0 <= other[1] < self.clusters_y:
+                yield other
+
+    def compute_border(self, cluster_a, cluster_b):
+        # Transitions between two neighbouring clusters, cluster_a is left of / below cluster_b
+        x0, x1, y0, y1 = self.bounds(cluster_a)
+        if cluster_b[0] > cluster_a[0]:
+            k = GridMap.OFFSET_INDEX[(1, 0)]
+            pairs = [((x1 - 1, y), (x1, y)) for y in range(y0, y1)]
+        else:
+            k = GridMap.OFFSET_INDEX[(0, 1)]
+            pairs = [((x, y1 - 1), (x, y1)) for x in range(x0, x1)]
+
+        runs, run = [], []
+        for cell_a, cell_b in pairs:
+            weight = self.weights[self.node_id(cell_a)][k]
+            if weight == GridMap.INF:
+                if run:
+                    runs.append(run)
+                run = []
+                continue
+            run.append((self.node_id(cell_a), self.node_id(cell_b), weight))
+        if run:
+            runs.append(run)
+
+        transitions = []
+        for run in runs:
+            if len(run) >= HierarchicalPlanner.WIDE_ENTRANCE:
+                transitions.extend([run[0], run[-1]])
+            else:
+                transitions.append(run[len(run) // 2])
+        return transitions
+
+    def transition_cells(self, cluster):
+        cells = set()
+        for other in self.neighbour_clusters(cluster):
+            key = (min(cluster, other), max(cluster, other))
+            for cell_a, cell_b, _ in self.borders.get(key, []):
+                cells.add(cell_a if key[0] == cluster else cell_b)
+        return sorted(cells)
+
+    def compute_intra(self, cluster):
+        bounds = self.bounds(cluster)
+        cells = self.transition_cells(cluster)
+        if coo_matrix is not None and len(cells) > 1:
+            self.intra[cluster] = self.compute_intra_sparse(cluster, cells, bounds)
+            return
+        self.trees.pop(cluster, None)
+
+        edges = {}
+        for i, source in enumerate(cells):
+            for target, (cost, path) in self.local_search(source, cells[i + 1:], bounds).items():
+                edges[(source, target)] = (cost, path)
+                edges[(target, source)] = (cost, path[::-1])
+        self.intra[cluster] = edges
+
+    def compute_intra_sparse(self, cluster, cells, bounds):
+        # Same as compute_intra, with every transition searched at once by scipy
+        x0, x1, y0, y1 = bounds
+        width, height = x1 - x0, y1 - y0
+        sources, targets, weights = self.grid.edge_arrays(bounds)
+        matrix = coo_matrix((weights, (sources, targets)), shape=(width * height, width * height)).tocsr()
+
+        local = np.arange(width * height)
+        global_ids = ((local // height + x0) * self.height + local % height + y0).tolist()
+        local_ids = {cell: index for index, cell in enumerate(global_ids)}
+        sources = [local_ids[cell] for cell in cells]
+        distances, predecessors = sparse_dijkstra(matrix, indices=sources, return_predecessors=True)
+        distances = distances[:, sources].tolist()
+
+        # Cell paths are only walked back from the predecessors when a query actually uses the edge
+        self.trees[cluster] = ({cell: i for i, cell in enumerate(cells)}, predecessors, global_ids, local_ids)
+        edges = {}
+        for i, source in enumerate(cells):
+            for j, target in enumerate(cells):
+                if i != j and distances[i][j] != GridMap.INF:
+                    edges[(source, target)] = (distances[i][j], None)
+        return edges
+
+    def intra_path(self, source, target):
+        rows, predecessors, global_ids, local_ids = self.trees[self.cluster_of(source)]
+        row = predecessors[rows[source]]
+        path = [local_ids[target]]
+        while global_ids[path[-1]] != source:
+            path.append(row[path[-1]])
+        return [global_ids[index] for index in reversed(path)]
+
+    def refresh(self):
+        if not self.dirty and self.abstract is not None:
+            return
+
+        # Row-per-node copy of the live weights, plain lists are much faster to walk than numpy rows
+        self.weights = self.grid.weights.reshape(-1, len(GridMap.OFFSETS)).tolist()
+
+        rebuild = set(self.dirty)
+        for cluster in self.dirty:
+            for other in self.neighbour_clusters(cluster):
+                key = (min(cluster, other), max(cluster, other))
+                transitions = self.compute_border(*key)
+                if self.borders.get(key) != transitions:
+                    self.borders[key] = transitions
+                    rebuild.add(other)
+
+        for cluster in rebuild:
+            self.compute_intra(cluster)
+        self.dirty = set()
+
+        abstract = {}
+        for edges in self.intra.values():
+            for (source, target), edge in edges.items():
+                abstract.setdefault(source, {})[target] = edge
+        for transitions in self.borders.values():
+            for cell_a, cell_b, weight in transitions:
+                abstract.setdefault(cell_a, {})[cell_b] = (weight, [cell_a, cell_b])
+                abstract.setdefault(cell_b, {})[cell_a] = (weight, [cell_b, cell_a])
+        self.abstract = abstract
+
+    def notify_changes(self, nodes):
+        """Obstacle flags of the given nodes changed, only their clusters are recomputed."""
+        for node in nodes:
+            self.dirty.add(self.cluster_of(self.node_id(node)))
+
+    def connect(self, cell, goal=None):
+        # Temporary edges from a query cell to the transitions of its cluster (and the goal if it shares it)
+        cluster = self.cluster_of(cell)
+        targets = self.transition_cells(cluster)
+        if goal is not None and self.cluster_of(goal) == cluster:
+            targets.append(goal)
+        return self.local_search(cell, targets, self.bounds(cluster))
+
+    def abstract_search(self, start, goal):
+        start_edges = self.connect(start, goal)
+        goal_edges = {cell: (cost, path[::-1]) for cell, (cost, path) in self.connect(goal).items()}
+
+        costs = {start: 0.0}
+        parents = {start: None}
+        closed = set()
+        heap = [(self.heuristic(start, goal), 0.0, start)]
+        while heap:
+            _, cost, u = heapq.heappop(heap)
+            if u in closed:
+                continue
+            closed.add(u)
+            if u == goal:
+                break
+
+            edges = list(self.abstract.get(u, {}).items())
+            if u == start:
+                edges.extend(start_edges.items())
+            if u in goal_edges:
+                edges.append((goal, goal_edges[u]))
+            for v, (weight, path) in edges:
+                new_cost = cost + weight
+                if v not in closed and new_cost < costs.get(v, GridMap.INF):
+                    costs[v] = new_cost
+                    parents[v] = (u, path)
+                    heapq.heappush(heap, (new_cost + self.heuristic(v, goal), new_cost, v))
+
+        if goal not in closed:
+            return None
+
+        # Refine by stitching the stored cell paths of every abstract edge
+        segments = []
+        v = goal
+        while parents[v] is not None:
+            u, path = parents[v]
+            segments.append(path if path is not None else self.intra_path(u, v))
+            v = u
+        path = [start]
+        for segment in reversed(segments):
+            path.extend(segment[1:])
+        return path
+
+    def path(self, start_node, goal_node):
+        start, goal = self.node_id(start_node), self.node_id(goal_node)
+        if start == goal:
+            return [tuple(start_node)]
+        if not self.grid.is_reachable(tuple(start_node), tuple(goal_node)):
+            print(f"No path exists between {start_node} and {goal_node}.")
+            return None
+
+        self.refresh()
+        path = self.abstract_search(start, goal)
+        if path is None:
+            # The clusters only connect through a diagonal corner step, search the whole grid
+            path = self.local_search(start, [goal], (0, self.width, 0, self.height)).get(goal, (None, None))[1]
+        return [self.node_of(u) for u in path] if path is not None else None
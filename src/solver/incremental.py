@@ -0,0 +1,160 @@
+import heapq
+import math
+
+import numpy as np
+
+from solver.grid_map import GridMap
+
+
+class DStarLite:
+    """
+    D* Lite planner for one robot-goal pair on a GridMap.
+
+    The search runs backwards from the goal, so a moving start only shifts the key
+    modifier and obstacle changes only repair the part of the search tree whose edge
+    costs changed (see notify_changes). Edge costs are read live from the grid's weight
+    array, which the world model updates in place.
+    """
+
+    INF = GridMap.INF
+
+    def __init__(self, grid, start_node, goal_node):
+        self.grid = grid
+        self.height = grid.height
+        self.offsets = [dx * grid.height + dy for dx, dy in GridMap.OFFSETS]
+        self.weights = grid.weights.reshape(-1, len(GridMap.OFFSETS))
+
+        # Cheapest unblocked cm per grid unit keeps the heuristic admissible as obstacles come and go
+        distances = grid.distances.reshape(-1, len(GridMap.OFFSETS))
+        per_unit = [distances[:, k][np.isfinite(distances[:, k])] / math.hypot(*GridMap.OFFSETS[k]) for k in range(len(GridMap.OFFSETS))]
+        per_unit = [w.min() for w in per_unit if len(w)]
+        self.cm_per_unit = min(per_unit) if per_unit else 0.0
+
+        size = grid.width * grid.height
+        self.g = [DStarLite.INF] * size
+        self.rhs = [DStarLite.INF] * size
+        self.queue = []
+        self.queued = {}
+        self.km = 0.0
+
+        self.start = self.node_id(start_node)
+        self.last = self.start
+        self.goal = self.node_id(goal_node)
+        self.goal_node = goal_node
+
+        self.rhs[self.goal] = 0.0
+        self.push(self.goal, self.calculate_key(self.goal))
+
+    def node_id(self, node):
+        return node[0] * self.height + node[1]
+
+    def node_of(self, node_id):
+        return divmod(node_id, self.height)
+
+    def heuristic(self, a, b):
+        ax, ay = divmod(a, self.height)
+        bx, by = divmod(b, self.height)
+        return math.hypot(ax - bx, ay - by) * self.cm_per_unit
+
+    def calculate_key(self, u):
+        best = min(self.g[u], self.rhs[u])
+        return (best + self.heuristic(self.start, u) + self.km, best)
+
+    def push(self, u, key):
+        self.queued[u] = key
+        heapq.heappush(self.queue, (key, u))
+
+    def top(self):
+        # Drop stale heap entries left behind by re-inserts and removals
+        while self.queue:
+            key, u = self.queue[0]
+            if self.queued.get(u) == key:
+                return key, u
+            heapq.heappop(self.queue)
+        return (DStarLite.INF, DStarLite.INF), None
+
+    def successors(self, u):
+        row = self.weights[u].tolist()
+        for k, offset in enumerate(self.offsets):
+            if row[k] != DStarLite.INF:
+                yield u + offset, row[k]
+
+    def neighbours(self, u):
+        x, y = divmod(u, self.height)
+        for (dx, dy), offset in zip(GridMap.OFFSETS, self.offsets):
+            if 0 <= x + dx < self.grid.width and 0 <= y + dy < self.height:
+                yield u + offset
+
+    def update_vertex(self, u):
+        if u != self.goal:
+            self.rhs[u] = min((cost + self.g[v] for v, cost in self.successors(u)), default=DStarLite.INF)
+        self.queued.pop(u, None)
+        if self.g[u] != self.rhs[u]:
+            self.push(u, self.calculate_key(u))
+
+    def compute_shortest_path(self):
+        while True:
+            key_old, u = self.top()
+            if u is None or (key_old >= self.calculate_key(self.start) and self.rhs[self.start] == self.g[self.start]):
+                return
+
+            key_new = self.calculate_key(u)
+            if key_old < key_new:
+                self.push(u, key_new)
+            elif self.g[u] > self.rhs[u]:
+                self.queued.pop(u)
+                self.g[u] = self.rhs[u]
+                for v in self.neighbours(u):
+                    self.update_vertex(v)
+            else:
+                self.queued.pop(u)
+                self.g[u] = DStarLite.INF
+                self.update_vertex(u)
+                for v in self.neighbours(u):
+                    self.update_vertex(v)
+
+    def move_start(self, start_node):
+        start = self.node_id(start_node)
+        if start == self.start:
+            return
+        self.km += self.heuristic(self.last, start)
+        self.last = start
+        self.start = start
+
+    def notify_changes(self, nodes):
+        """Edge costs around the given nodes changed, repair only the affected vertices."""
+        affected = set()
+        for node in nodes:
+            u = self.node_id(node)
+            affected.add(u)
+            affected.update(self.neighbours(u))
+
+        for u in affected:
+            self.update_vertex(u)
+
+    def path(self):
+        # Follow the cheapest successors from the start, None if the goal is unreachable
+        if not self.grid.is_reachable(self.node_of(self.start), self.goal_node):
+            return None
+
+        self.compute_shortest_path()
+        if self.g[self.start] == DStarLite.INF:
+            return None
+
+        path = [self.start]
+        visited = {self.start}
+        while path[-1] != self.goal:
+            u = path[-1]
+            best, best_cost = None, DStarLite.INF
+            for v, cost in self.successors(u):
+                if cost + self.g[v] < best_cost:
+                    best, best_cost = v, cost + self.g[v]
+            if best is None or best in visited:
+                return None
+            path.append(best)
+            visited.add(best)
+        return [self.node_of(u) for u in path]
+
+    def cost(self):
+        self.compute_shortest_path()
+        return self.g[self.start]
@@ -0,0 +1,142 @@
+import heapq
+import math
+
+from solver.grid_map import GridMap
+
+
+class JumpPointSearch:
+    """
+    Jump Point Search over the 8-connected GridMap.
+
+    Only valid while every straight edge costs the same and every diagonal edge costs
+    the same (GridMap.uniform_step_costs), so symmetric paths through open floor can be
+    skipped by jumping straight to the next node with a forced neighbour. Diagonal moves
+    only need their destination to be free, matching the grid's edges.
+    The returned path is expanded back into every cell it passes through.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.width = grid.width
+        self.height = grid.height
+        self.free = (~grid.near_obstacle).tolist()
+
+        step_costs = grid.uniform_step_costs()
+        self.straight_cost, self.diagonal_cost = step_costs if step_costs else (1.0, math.sqrt(2))
+
+    def walkable(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and self.free[x][y]
+
+    def distance(self, node_a, node_b):
+        # Octile distance, also the exact cost between two jump points on one line
+        dx, dy = abs(node_a[0] - node_b[0]), abs(node_a[1] - node_b[1])
+        return self.straight_cost * abs(dx - dy) + self.diagonal_cost * min(dx, dy)
+
+    def directions(self, node, parent):
+        # Natural and forced neighbour directions when arriving at node from parent
+        x, y = node
+        if parent is None:
+            return [(dx, dy) for dx, dy in GridMap.OFFSETS if self.walkable(x + dx, y + dy)]
+
+        dx = (x > parent[0]) - (x < parent[0])
+        dy = (y > parent[1]) - (y < parent[1])
+        directions = []
+        if dx and dy:
+            if self.walkable(x, y + dy):
+                directions.append((0, dy))
+            if self.walkable(x + dx, y):
+                directions.append((dx, 0))
+            if self.walkable(x + dx, y + dy):
+                directions.append((dx, dy))
+            if not self.walkable(x - dx, y) and self.walkable(x - dx, y + dy):
+                directions.append((-dx, dy))
+            if not self.walkable(x, y - dy) and self.walkable(x + dx, y - dy):
+                directions.append((dx, -dy))
+        elif dx:
+            if self.walkable(x + dx, y):
+                directions.append((dx, 0))
+            for side in (1, -1):
+                if not self.walkable(x, y + side) and self.walkable(x + dx, y + side):
+                    directions.append((dx, side))
+        else:
+            if self.walkable(x, y + dy):
+                directions.append((0, dy))
+            for side in (1, -1):
+                if not self.walkable(x + side, y) and self.walkable(x + side, y + dy):
+                    directions.append((side, dy))
+        return directions
+
+    def jump(self, x, y, dx, dy, goal):
+        # Walk from (x, y) in direction (dx, dy) until the goal, a forced neighbour or a wall
+        while True:
+            x, y = x + dx, y + dy
+            if not self.walkable(x, y):
+                return None
+            if (x, y) == goal:
+                return (x, y)
+
+            if dx and dy:
+                if (self.walkable(x - dx, y + dy) and not self.walkable(x - dx, y)) or \
+                   (self.walkable(x + dx, y - dy) and not self.walkable(x, y - dy)):
+                    return (x, y)
+                if self.jump(x, y, dx, 0, goal) is not None or self.jump(x, y, 0, dy, goal) is not None:
+                    return (x, y)
+            elif dx:
+                if (self.walkable(x + dx, y + 1) and not self.walkable(x, y + 1)) or \
+                   (self.walkable(x + dx, y - 1) and not self.walkable(x, y - 1)):
+                    return (x, y)
+            else:
+                if (self.walkable(x + 1, y + dy) and not self.walkable(x + 1, y)) or \
+                   (self.walkable(x - 1, y + dy) and not self.walkable(x - 1, y)):
+                    return (x, y)
+
+    def search(self, start_node, goal_node):
+        start_node, goal_node = tuple(start_node), tuple(goal_node)
+        if start_node == goal_node:
+            return [start_node]
+        if not self.grid.is_reachable(start_node, goal_node):
+            print(f"No path exists between {start_node} and {goal_node}.")
+            return None
+
+        costs = {start_node: 0.0}
+        parents = {start_node: None}
+        closed = set()
+        heap = [(self.distance(start_node, goal_node), 0.0, start_node)]
+
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node in closed:
+                continue
+            closed.add(node)
+
+            if node == goal_node:
+                jump_points = []
+                while node is not None:
+                    jump_points.append(node)
+                    node = parents[node]
+                return JumpPointSearch.expand(jump_points[::-1])
+
+            for dx, dy in self.directions(node, parents[node]):
+                jump_point = self.jump(node[0], node[1], dx, dy, goal_node)
+                if jump_point is None or jump_point in closed:
+                    continue
+                new_cost = cost + self.distance(node, jump_point)
+                if new_cost < costs.get(jump_point, GridMap.INF):
+                    costs[jump_point] = new_cost
+                    parents[jump_point] = node
+                    heapq.heappush(heap, (new_cost + self.distance(jump_point, goal_node), new_cost, jump_point))
+
+        print(f"No path exists between {start_node} and {goal_node}.")
+        return None
+
+    @staticmethod
+    def expand(jump_points):
+        # Consecutive jump points always lie on one straight or diagonal line
+        path = [jump_points[0]]
+        for x, y in jump_points[1:]:
+            px, py = path[-1]
+            dx, dy = (x > px) - (x < px), (y > py) - (y < py)
+            while path[-1] != (x, y):
+                px, py = px + dx, py + dy
+                path.append((px, py))
+        return path
@@ -0,0 +1,211 @@
+import heapq
+import math
+
+import numpy as np
+
+from solver.graph import Graph as gr
+from solver.grid_map import GridMap
+
+
+class SpaceTimePlanner:
+    """
+    Collision-free timed paths for several robots on a GridMap.
+
+    Robots are planned one after another (prioritized planning) with a space-time A*
+    over (cell, heading, tick) states. Every planned robot writes the cells it occupies
+    into a reservation table, which the following robots have to avoid:
+        - a turning robot occupies its cell
+        - a moving robot occupies both its source and destination cell
+        - a robot doing a pickup/dropoff spin occupies its cell
+        - a robot that finished its schedule stays parked on its last cell
+    Robots that haven't been planned yet are still sitting on their start cell, so those
+    cells are treated as blocked.
+    """
+
+    ACTIONS_WITH_SPIN = ("PICKUP", "DROPOFF")
+
+    def __init__(self, grid, move_duration_ms, turn_duration_ms, block_size_cm, tick_ms=None, slack_ms=10000):
+        self.grid = grid
+        self.height = grid.height
+        self.move_duration_ms = move_duration_ms
+        self.block_size_cm = block_size_cm
+        self.turn_duration_ms = turn_duration_ms
+        self.tick_ms = tick_ms if tick_ms is not None else turn_duration_ms
+        self.turn_ticks = self.ticks(turn_duration_ms)
+
+        # A full 360 degree spin for pickups and dropoffs
+        self.spin_ticks = gr.HEADINGS * self.turn_ticks
+
+        # How long a robot may wait around on top of its unobstructed travel time
+        self.slack_ticks = self.ticks(slack_ms)
+
+        self.offsets = [dx * self.height + dy for dx, dy in GridMap.OFFSETS]
+        self.move_headings = [gr.heading((0, 0), offset) // 45 for offset in GridMap.OFFSETS]
+        self.weights = grid.weights.reshape(-1, len(GridMap.OFFSETS)).tolist()
+
+        distances = grid.distances.reshape(-1, len(GridMap.OFFSETS))
+        per_unit = [distances[:, k][np.isfinite(distances[:, k])] / math.hypot(*GridMap.OFFSETS[k]) for k in range(len(GridMap.OFFSETS))]
+        per_unit = [w.min() for w in per_unit if len(w)]
+        self.cm_per_unit = min(per_unit) if per_unit else 0.0
+
+        self.reserved = {}
+        self.last_reserved = {}
+        self.parked = {}
+        self.blocked = set()
+
+    def ticks(self, duration_ms):
+        return max(1, math.ceil(duration_ms / self.tick_ms))
+
+    def node_id(self, node):
+        return node[0] * self.height + node[1]
+
+    def node_of(self, node_id):
+        return divmod(node_id, self.height)
+
+    def heuristic(self, cell, goal):
+        # Lower bound on the ticks needed to drive from cell to goal
+        x, y = divmod(cell, self.height)
+        gx, gy = divmod(goal, self.height)
+        return gr.move_duration(math.hypot(gx - x, gy - y) * self.cm_per_unit, self.move_duration_ms, self.block_size_cm) / self.tick_ms
+
+    def is_free(self, robot, cell, tick):
+        owner = self.reserved.get((cell, tick))
+        if owner is not None and owner != robot:
+            return False
+        parked = self.parked.get(cell)
+        return parked is None or parked[1] == robot or tick < parked[0]
+
+    def is_free_during(self, robot, cell, first_tick, last_tick):
+        return all(self.is_free(robot, cell, tick) for tick in range(first_tick, last_tick + 1))
+
+    def can_finish(self, robot, cell, tick, hold_ticks, final):
+        if not self.is_free_during(robot, cell, tick + 1, tick + hold_ticks):
+            return False
+        # A parked robot can't have anybody else drive through its cell later on
+        return not final or self.last_reserved.get(cell, -1) < tick
+
+    def reserve(self, robot, cell, first_tick, last_tick):
+        for tick in range(first_tick, last_tick + 1):
+            self.reserved[(cell, tick)] = robot
+        if last_tick >= first_tick:
+            self.last_reserved[cell] = max(self.last_reserved.get(cell, -1), last_tick)
+
+    def reserve_states(self, robot, states, hold_ticks, final):
+        cell, heading, tick = states[0]
+        self.reserve(robot, cell, tick, tick)
+        for (cell, heading, tick), (next_cell, next_heading, next_tick) in zip(states[:-1], states[1:]):
+            if cell == next_cell:
+                self.reserve(robot, cell, tick + 1, next_tick)
+                continue
+            turn = gr.heading_steps(heading, next_heading) * self.turn_ticks if heading >= 0 else 0
+            self.reserve(robot, cell, tick + 1, next_tick)
+            self.reserve(robot, next_cell, tick + turn + 1, next_tick)
+
+        cell, heading, tick = states[-1]
+        self.reserve(robot, cell, tick + 1, tick + hold_ticks)
+        if final:
+            self.parked[cell] = (tick + hold_ticks, robot)
+
+    def plan_leg(self, robot, start, goal, heading, start_tick, earliest_tick, hold_ticks, final):
+        # Space-time A*, returns the (cell, heading, tick) states from start to goal
+        if not self.grid.is_reachable(self.node_of(start), self.node_of(goal)):
+            return None
+
+        departure = max(start_tick, earliest_tick)
+        limit = departure + math.ceil(2 * self.heuristic(start, goal)) + self.slack_ticks
+
+        initial = (start, heading, start_tick)
+        parents = {initial: None}
+        closed = set()
+        heap = [(start_tick + self.heuristic(start, goal), start_tick, start, heading)]
+
+        while heap:
+            _, tick, cell, heading = heapq.heappop(heap)
+            state = (cell, heading, tick)
+            if state in closed:
+                continue
+            closed.add(state)
+
+            if cell == goal and tick >= earliest_tick and self.can_finish(robot, cell, tick, hold_ticks, final):
+                states = []
+                while state is not None:
+                    states.append(state)
+                    state = parents[state]
+                return states[::-1]
+
+            if tick >= limit:
+                continue
+
+            successors = []
+            if self.is_free(robot, cell, tick + 1):
+                successors.append((cell, heading, tick + 1))
+
+            if tick >= earliest_tick:
+                row = self.weights[cell]
+                for k, offset in enumerate(self.offsets):
+                    if row[k] == GridMap.INF or cell + offset in self.blocked:
+                        continue
+                    new_heading = self.move_headings[k]
+                    turn = gr.heading_steps(heading, new_heading) * self.turn_ticks if heading >= 0 else 0
+                    arrival = tick + turn + self.ticks(gr.move_duration(row[k], self.move_duration_ms, self.block_size_cm))
+                    if arrival > limit:
+                        continue
+                    if self.is_free_during(robot, cell, tick + 1, arrival) and \
+                       self.is_free_during(robot, cell + offset, tick + turn + 1, arrival):
+                        successors.append((cell + offset, new_heading, arrival))
+
+            for successor in successors:
+                if successor in closed or successor in parents:
+                    continue
+                parents[successor] = state
+                next_cell, next_heading, next_tick = successor
+                heapq.heappush(heap, (next_tick + self.heuristic(next_cell, goal), next_tick, next_cell, next_heading))
+        return None
+
+    def plan(self, robot_schedules):
+        """
+        robot_schedules -> per robot list of {'location', 'time', 'action'} entries
+                           (see VideoToGraph.convert_solution_to_schedules)
+
+        Returns, per robot, a list of legs where every leg is a list of (node, time_ms)
+        pairs; a repeated node means the robot waits. A robot is None if no
+        collision-free plan was found for it.
+        """
+        self.reserved = {}
+        self.last_reserved = {}
+        self.parked = {}
+
+        waiting = {robot: self.node_id(schedule[0]['location']) for robot, schedule in enumerate(robot_schedules) if schedule}
+        timed_paths = []
+
+        for robot, schedule in enumerate(robot_schedules):
+            waiting.pop(robot, None)
+            self.blocked = set(waiting.values())
+
+            if len(schedule) < 2:
+                if schedule:
+                    self.parked[self.node_id(schedule[0]['location'])] = (0, robot)
+                timed_paths.append([])
+                continue
+
+            legs = []
+            cell, heading, tick = self.node_id(schedule[0]['location']), -1, 0
+            for i in range(len(schedule) - 1):
+                goal = self.node_id(schedule[i + 1]['location'])
+                earliest_tick = int(schedule[i]['time'] // self.tick_ms)
+                hold_ticks = self.spin_ticks if schedule[i + 1]['action'] in SpaceTimePlanner.ACTIONS_WITH_SPIN else 0
+                final = i == len(schedule) - 2
+
+                states = self.plan_leg(robot, cell, goal, heading, tick, earliest_tick, hold_ticks, final)
+                if states is None:
+                    print(f"No collision-free path for robot {robot} to {self.node_of(goal)}")
+                    legs = None
+                    break
+
+                self.reserve_states(robot, states, hold_ticks, final)
+                legs.append([(self.node_of(c), t * self.tick_ms) for c, _, t in states])
+                cell, heading, tick = states[-1]
+                tick += hold_ticks
+
+            timed_paths.append(legs)
+        return timed_paths
@@ -0,0 +1,68 @@
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+class NodeLookup:
+    """
+    Pixel -> grid node lookup for a GridMap.
+
+    Query points are pulled back into grid space through the cached inverse of the
+    grid's transformation matrix, then the best of the surrounding 3x3 nodes is picked
+    in pixel space. Points that land outside the grid (or hit a degenerate projective
+    scale) fall back to an exact KD-tree query over all node positions.
+    """
+
+    # How far (in grid cells) a mapped point may fall outside the grid before falling back
+    OUTSIDE_TOLERANCE = 1.0
+    EPS = 1e-9
+
+    NEIGHBOURHOOD = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.inverse = np.linalg.inv(np.asarray(grid.matrix, dtype=np.float64))
+        self.positions = grid.pixel_pos[..., :2].reshape(-1, 2)
+        self.tree = None
+
+    def nearest(self, query_point):
+        return self.nearest_batch([query_point])[0]
+
+    def nearest_batch(self, query_points):
+        points = np.array([tuple(p)[:2] for p in query_points], dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return []
+
+        homogeneous = np.column_stack([points, np.ones(len(points))])
+        mapped = homogeneous @ self.inverse.T
+        w = mapped[:, 2]
+        valid = np.abs(w) > NodeLookup.EPS
+        grid_xy = mapped[:, :2] / np.where(valid, w, 1.0)[:, None]
+
+        upper = np.array([self.grid.width - 1, self.grid.height - 1])
+        outside = ~valid | (grid_xy < -NodeLookup.OUTSIDE_TOLERANCE).any(axis=1) \
+            | (grid_xy > upper + NodeLookup.OUTSIDE_TOLERANCE).any(axis=1)
+
+        base = np.rint(np.clip(grid_xy, 0, upper)).astype(int)
+        candidates = np.clip(base[:, None, :] + NodeLookup.NEIGHBOURHOOD[None], 0, upper)
+        candidate_pos = self.grid.pixel_pos[candidates[..., 0], candidates[..., 1], :2]
+        distances = ((candidate_pos - points[:, None, :]) ** 2).sum(axis=-1)
+        nearest = candidates[np.arange(len(points)), distances.argmin(axis=1)]
+
+        if outside.any():
+            nearest[outside] = self.nearest_exact(points[outside])
+
+        return [tuple(node) for node in nearest.tolist()]
+
+    def nearest_exact(self, points):
+        if cKDTree is not None:
+            if self.tree is None:
+                self.tree = cKDTree(self.positions)
+            _, indices = self.tree.query(points)
+        else:
+            distances = ((self.positions[None, :, :] - points[:, None, :]) ** 2).sum(axis=-1)
+            indices = distances.argmin(axis=1)
+        return np.column_stack(np.unravel_index(indices, (self.grid.width, self.grid.height)))
@@ -0,0 +1,231 @@
+import heapq
+import math
+
+import cv2 as cv
+import numpy as np
+
+from solver.grid_map import GridMap
+
+
+class QuadtreeGrid:
+    """
+    Adaptive multi-resolution view of a GridMap.
+
+    The grid is tiled with MAX_SIZE blocks which are split into quadrants until every
+    leaf is either open floor, fully blocked, or a single cell. Cells within `margin`
+    of an obstacle, with a clearance penalty, or near one of the refine nodes (action
+    points) always end up as single cells, so precision is only given up in open space.
+
+    Each leaf is represented by its center cell, and leaves touching along an edge or a
+    corner are neighbours. Weights are the straight line length in cm between the two
+    representatives, so paths are any-angle waypoint lists. nodes / neighbors /
+    passable_neighbors / weight / edges / is_reachable mirror the GridMap interface.
+    `version` is the map version the tree was built for.
+    """
+
+    MAX_SIZE = 16
+
+    # Cells this close (in cells) to an obstacle or a refine node are never merged
+    MARGIN = 2
+
+    def __init__(self, grid, refine_nodes=(), version=None, max_size=MAX_SIZE, margin=MARGIN):
+        self.grid = grid
+        self.width = grid.width
+        self.height = grid.height
+        self.refine_nodes = tuple(tuple(node) for node in refine_nodes)
+        self.version = version
+        self.max_size = max_size
+        self.margin = margin
+        self.build()
+
+    def fine_mask(self):
+        grid = self.grid
+        refine = grid.near_obstacle.astype(np.uint8)
+        for node in self.refine_nodes:
+            if grid.in_bounds(node):
+                refine[node] = 1
+        if self.margin > 0:
+            kernel = np.ones((2 * self.margin + 1, 2 * self.margin + 1), dtype=np.uint8)
+            refine = cv.dilate(refine, kernel)
+        return (refine > 0) | (grid.penalty > 0)
+
+    @staticmethod
+    def integral(mask):
+        # Summed area table with a zero border, block sums in O(1)
+        table = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int64)
+        table[1:, 1:] = mask.cumsum(axis=0).cumsum(axis=1)
+        return table
+
+    @staticmethod
+    def block_sum(table, x0, x1, y0, y1):
+        return table[x1, y1] - table[x0, y1] - table[x1, y0] + table[x0, y0]
+
+    def build(self):
+        grid = self.grid
+        fine = QuadtreeGrid.integral(self.fine_mask())
+        blocked = QuadtreeGrid.integral(grid.near_obstacle)
+
+        # (x0, x1, y0, y1) of every leaf
+        leaves, leaf_blocked = [], []
+        stack = [(x0, min(x0 + self.max_size, self.width), y0, min(y0 + self.max_size, self.height))
+                 for x0 in range(0, self.width, self.max_size) for y0 in range(0, self.height, self.max_size)]
+        while stack:
+            x0, x1, y0, y1 = stack.pop()
+            area = (x1 - x0) * (y1 - y0)
+            obstacles = QuadtreeGrid.block_sum(blocked, x0, x1, y0, y1)
+            if area == 1 or obstacles == area or QuadtreeGrid.block_sum(fine, x0, x1, y0, y1) == 0:
+                leaves.append((x0, x1, y0, y1))
+                leaf_blocked.append(bool(obstacles == area))
+                continue
+            mx, my = x0 + (x1 - x0 + 1) // 2, y0 + (y1 - y0 + 1) // 2
+            for bounds in ((x0, mx, y0, my), (mx, x1, y0, my), (x0, mx, my, y1), (mx, x1, my, y1)):
+                if bounds[0] < bounds[1] and bounds[2] < bounds[3]:
+                    stack.append(bounds)
+
+        self.bounds = leaves
+        self.blocked = leaf_blocked
+        self.representatives = [((x0 + x1 - 1) // 2, (y0 + y1 - 1) // 2) for x0, x1, y0, y1 in leaves]
+        self.index = {node: i for i, node in enumerate(self.representatives)}
+        self.leaf_of = np.empty((self.width, self.height), dtype=np.int64)
+        for i, (x0, x1, y0, y1) in enumerate(leaves):
+            self.leaf_of[x0:x1, y0:y1] = i
+
+        # Leaf penalty is only non zero for single cells, coarse leaves never see the clearance layer
+        self.penalties = [float(grid.penalty[node]) for node in self.representatives]
+        xs, ys = np.array(self.representatives).reshape(-1, 2).T
+        self.pixel_positions = grid.pixel_pos[xs, ys]
+        self.positions = self.pixel_positions[:, :2].tolist()
+        self.cm_per_pixel = grid.cm_per_pixel() or 1.0
+
+        # Every pair of leaves sharing an edge or a corner, found from the cell level edges
+        pairs = []
+        for dx, dy in GridMap.FORWARD_OFFSETS:
+            src, dst = GridMap.shifted_slices(dx, dy, self.width, self.height)
+            a, b = self.leaf_of[src].ravel(), self.leaf_of[dst].ravel()
+            different = a != b
+            pairs.append(np.minimum(a, b)[different] * len(leaves) + np.maximum(a, b)[different])
+        codes = np.unique(np.concatenate(pairs)) if pairs else np.array([], dtype=np.int64)
+
+        self.adjacency = [{} for _ in leaves]
+        for a, b in zip((codes // len(leaves)).tolist(), (codes % len(leaves)).tolist()):
+            weight = GridMap.INF if self.blocked[a] or self.blocked[b] else self.leaf_weight(a, b)
+            self.adjacency[a][b] = weight
+            self.adjacency[b][a] = weight
+
+    def distance(self, position_a, position_b):
+        return math.hypot(position_a[0] - position_b[0], position_a[1] - position_b[1]) * self.cm_per_pixel
+
+    def leaf_weight(self, a, b, position_a=None, position_b=None):
+        length = self.distance(position_a or self.positions[a], position_b or self.positions[b])
+        return length * (1.0 + (self.penalties[a] + self.penalties[b]) / 2)
+
+    def is_stale(self, grid, refine_nodes, version):
+        return grid is not self.grid or tuple(tuple(node) for node in refine_nodes) != self.refine_nodes or version != self.version
+
+    def node_count(self):
+        return len(self.representatives)
+
+    def representative(self, cell):
+        # Node of the leaf that holds a grid cell
+        return self.representatives[int(self.leaf_of[tuple(cell)])]
+
+    def in_bounds(self, node):
+        return tuple(node) in self.index
+
+    # Node ids are leaf indices, same array layout as GridMap.node_positions / node_flags
+    def node_ids(self, nodes):
+        return np.array([self.index[tuple(node)] for node in nodes], dtype=np.int64)
+
+    def node_of(self, node_ids):
+        return [self.representatives[node_id] for node_id in np.asarray(node_ids).tolist()]
+
+    def node_positions(self):
+        return self.pixel_positions
+
+    def node_flags(self):
+        return np.array(self.blocked, dtype=bool)
+
+    def nodes(self):
+        return iter(self.representatives)
+
+    def neighbors(self, node):
+        for j in self.adjacency[self.index[tuple(node)]]:
+            yield self.representatives[j]
+
+    def passable_neighbors(self, node):
+        for j, weight in self.adjacency[self.index[tuple(node)]].items():
+            if weight != GridMap.INF:
+                yield self.representatives[j], weight
+
+    def weight(self, node_a, node_b):
+        a, b = self.index.get(tuple(node_a)), self.index.get(tuple(node_b))
+        if a is None or b is None:
+            return None
+        return self.adjacency[a].get(b)
+
+    def edges(self):
+        for a, neighbours in enumerate(self.adjacency):
+            for b, weight in neighbours.items():
+                if a < b and weight != GridMap.INF:
+                    yield self.representatives[a], self.representatives[b], weight
+
+    def is_near_obstacle(self, node_a, node_b=None):
+        if node_b is not None:
+            return self.blocked[self.index[tuple(node_a)]] or self.blocked[self.index[tuple(node_b)]]
+        return self.blocked[self.index[tuple(node_a)]]
+
+    def is_reachable(self, node_a, node_b):
+        # Leaves never mix free and blocked cells, so connectivity is the same as on the grid
+        return self.grid.is_reachable(tuple(node_a), tuple(node_b))
+
+    def get_pixel_pos(self, node):
+        return self.grid.get_pixel_pos(tuple(node))
+
+    def path(self, start_cell, goal_cell):
+        """A* over the leaves between two grid cells, returns [start, leaf nodes..., goal] waypoints."""
+        start_cell, goal_cell = tuple(start_cell), tuple(goal_cell)
+        if start_cell == goal_cell:
+            return [start_cell]
+        if not self.is_reachable(start_cell, goal_cell):
+            print(f"No path exists between {start_cell} and {goal_cell}.")
+            return None
+
+        # The start and goal leaves are entered at the query cells themselves, not their centers
+        start, goal = int(self.leaf_of[start_cell]), int(self.leaf_of[goal_cell])
+        anchors = {start: self.grid.pixel_pos[start_cell][:2].tolist(), goal: self.grid.pixel_pos[goal_cell][:2].tolist()}
+        if start == goal:
+            return [start_cell, goal_cell]
+
+        costs = {start: 0.0}
+        parents = {start: None}
+        closed = set()
+        heap = [(self.distance(anchors[start], anchors[goal]), 0.0, start)]
+        while heap:
+            _, cost, u = heapq.heappop(heap)
+            if u in closed:
+                continue
+            closed.add(u)
+            if u == goal:
+                break
+
+            for v, weight in self.adjacency[u].items():
+                if weight == GridMap.INF or v in closed:
+                    continue
+                if u in anchors or v in anchors:
+                    weight = self.leaf_weight(u, v, anchors.get(u), anchors.get(v))
+                new_cost = cost + weight
+                if new_cost < costs.get(v, GridMap.INF):
+                    costs[v] = new_cost
+                    parents[v] = u
+                    heapq.heappush(heap, (new_cost + self.distance(anchors.get(v) or self.positions[v], anchors[goal]), new_cost, v))
+
+        if goal not in closed:
+            print(f"No path exists between {start_cell} and {goal_cell}.")
+            return None
+
+        leaves = []
+        u = parents[goal]
+        while u != start:
+            leaves.append(self.representatives[u])
+            u = parents[u]
+        return [start_cell] + leaves[::-1] + [goal_cell]
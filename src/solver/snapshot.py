@@ -0,0 +1,84 @@
+import math
+import os
+
+import cv2 as cv
+import numpy as np
+
+from utils import UtilityFunctions as uf
+
+
+class SessionSnapshot:
+    """
+    Calibrated session state stored in one compressed npz file:
+        corners, H                   -> clicked arena corners and the camera homography
+        matrix, pixel_conversion     -> grid to pixel transform and cm per pixel factors
+        grid obstacle layers         -> contour/marked flags and obstacle distances
+        robot_names, robot_calibration -> RobotPhysicalInterface calibration factors
+        thumbnail                    -> small grayscale frame used for the drift check
+    """
+
+    CORNER_ORDER = (uf.TOP_LEFT, uf.TOP_RIGHT, uf.BOTTOM_LEFT, uf.BOTTOM_RIGHT)
+    THUMBNAIL_WIDTH = 160
+
+    # Largest camera shift (in full resolution pixels) for which the snapshot is still trusted
+    MAX_DRIFT_PX = 4.0
+
+    @staticmethod
+    def thumbnail(frame):
+        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        height = max(1, round(gray.shape[0] * SessionSnapshot.THUMBNAIL_WIDTH / gray.shape[1]))
+        return cv.resize(gray, (SessionSnapshot.THUMBNAIL_WIDTH, height), interpolation=cv.INTER_AREA).astype(np.float32)
+
+    @staticmethod
+    def save(path, corners, H, matrix, pixel_conversion, block_size_cm, grid=None, calibrations=None, frame=None):
+        arrays = {
+            "corners": np.array([corners[name] for name in SessionSnapshot.CORNER_ORDER], dtype=np.int32),
+            "H": np.asarray(H, dtype=np.float64),
+            "matrix": np.asarray(matrix, dtype=np.float64),
+            "pixel_conversion": np.asarray(pixel_conversion, dtype=np.float64),
+            "block_size_cm": np.float64(block_size_cm),
+            "robot_names": np.array(list((calibrations or {}).keys()), dtype=str),
+            "robot_calibration": np.array(list((calibrations or {}).values()), dtype=np.float64),
+        }
+        if grid is not None:
+            arrays["grid_shape"] = np.array([grid.width, grid.height])
+            arrays["contour_obstacle"] = grid.contour_obstacle
+            arrays["marked_obstacle"] = grid.marked_obstacle
+            arrays["obstacle_distance"] = grid.obstacle_distance.astype(np.float32)
+        if frame is not None:
+            arrays["thumbnail"] = SessionSnapshot.thumbnail(frame)
+            arrays["frame_shape"] = np.array(frame.shape[:2])
+
+        # Write next to the target and swap it in, so a crash mid-save never leaves a broken snapshot
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def load(path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return {key: data[key] for key in data.files}
+        except (OSError, ValueError) as e:
+            print(f"Couldn't read snapshot {path}: {e}")
+            return None
+
+    @staticmethod
+    def corners(snapshot):
+        return {name: tuple(int(v) for v in point) for name, point in zip(SessionSnapshot.CORNER_ORDER, snapshot["corners"].tolist())}
+
+    @staticmethod
+    def calibrations(snapshot):
+        return dict(zip(snapshot["robot_names"].tolist(), snapshot["robot_calibration"].tolist()))
+
+    @staticmethod
+    def drift(snapshot, frame):
+        # Camera shift between the snapshot and the live frame in full resolution pixels (inf if it can't be checked)
+        if "thumbnail" not in snapshot or tuple(snapshot["frame_shape"]) != tuple(frame.shape[:2]):
+            return math.inf
+        live = SessionSnapshot.thumbnail(frame)
+        (dx, dy), _ = cv.phaseCorrelate(snapshot["thumbnail"], live)
+        return math.hypot(dx, dy) * frame.shape[1] / live.shape[1]
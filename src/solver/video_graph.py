@@ -1,8 +1,8 @@
+import math
 import cv2 as cv
 import networkx as nx
 import numpy as np
 import threading
-import queue
 import asyncio
 import sys 
 import os 
@@ -11,6 +11,14 @@ from SMrTa.MRTASolver import MRTASolver, Robot
 from SMrTa.MRTASolver.objects import Task
 
 from solver.graph import Graph as gr
+from solver.cost_matrix import CostMatrixBuilder
+from solver.world_model import WorldModel
+from solver.incremental import DStarLite
+from solver.multi_robot import SpaceTimePlanner
+from solver.quadtree import QuadtreeGrid
+from solver.snapshot import SessionSnapshot
+from central.pipeline import StampedFrame, DropOldestQueue, LatestFrameCapture
+from central.tracking_pool import TrackerPool
 from utils import UtilityFunctions as uf
 
 
@@ -19,12 +27,24 @@ TURN_DURATION_MS = 50  # 50 ms to turn 45 degrees
 DIAGONAL_MULTIPLIER = 1.414  # sqrt(2) for diagonal movement
 
 class VideoToGraph:
+
+    PICKUP_CMD = "P" # Do a spin
+    DROPOFF_CMD = "D" # Do a spin
+    FORWARD_CMD = "F"
+    TURN_LEFT_CMD = "L"
+    TURN_RIGHT_CMD = "R"
+    WAIT_CMD = "W"
+
+    # Heading changes below this are driven straight through
+    MIN_TURN_DEGREES = 1.0
     
     #initialize
-    def __init__(self, height, length, video_file, robots, metric = True, thread = True):
+    def __init__(self, height, length, video_file, robots, metric = True, thread = True, marker_detector = None, tracker_workers = None):
 
-        # video feed
+        # video feed, read on its own thread so the other stages always get the newest frame
         self.cap = VideoToGraph.initialize_camera(video_file)
+        fps = self.cap.get(cv.CAP_PROP_FPS) if not isinstance(video_file, int) else 0
+        self.capture = LatestFrameCapture(self.cap, 1 / fps if fps and fps > 0 else 0.0)
 
         # Display toggles
         self.display_grid = True
@@ -47,11 +67,43 @@ class VideoToGraph:
         self.pixel_conversion = []
         self.corners = {}
         self.matrix = any
-        self.graph = nx.Graph()
+
+        # Warm restarts: calibrated session saved to / restored from this file (None disables it)
+        self.snapshot_path = "session_snapshot.npz"
+        self.snapshot_frame = None
+        self.snapshot_pending = False
+        self.robot_calibrations = {}
+        self.world = WorldModel()
+        self.graph = self.world.graph
+        self.grid = None
+        self.solver_workers = None
+        self.action_point_paths = {}
 
         # shortest paths from robot to goal
         self.paths = {}
         self.robot_goals = {}
+        self.planners = {}
+        # Action points whose flow field get_next_step has been asked for, kept current by the planning stage
+        self.flow_field_actions = set()
+        self.collision_free_planning = True
+        # Shortest legs with Jump Point Search (plain A* once the clearance layer makes step costs uneven)
+        # instead of the lattice planner, also used for robots sharing a goal in find_paths
+        self.jump_point_search = False
+        # Smooth each leg into a few straight segments with arbitrary turn angles
+        self.any_angle_paths = True
+        # Legs are planned by the heading-aware lattice unless one of these picks a distance planner:
+        # cluster-level planning (HPA*) for large or fine-resolution arenas, or one D* Lite per robot
+        # and goal that only repairs what changed when a RECOMPUTE plans the same leg on a newer map
+        self.hierarchical_planning = False
+        self.incremental_planning = False
+        # Plan legs on a quadtree that is only fine near obstacles and action points, paths come back as
+        # waypoints and are always driven as any-angle segments
+        self.adaptive_grid = False
+        self.quadtree = None
+        # Clearance cost layer around obstacles, sized for the largest robot footprint
+        self.robot_footprints_cm = {}
+        self.clearance_inflation_cm = 10
+        self.clearance_penalty = 1.0
         self.deadline_threshold = 2000
 
         # QR Code tracking 
@@ -65,9 +117,22 @@ class VideoToGraph:
         self.robots = robots
         self.robot_trackers = []
         self.robot_bounding_boxes = []
-
-        # relay processed video via thread to avoid creating a blocking call
-        self.frame_queue = queue.Queue(maxsize=1)
+        # Size of the process pool running the actor trackers, None or 1 tracks in the vision stage itself
+        self.tracker_workers = tracker_workers
+        self.tracker_pool = None
+        # MarkerDetector for the fiducial marker mode: arena corners, robots and action points all
+        # come from one marker detection pass per frame instead of clicking and per actor trackers
+        self.marker_detector = marker_detector
+        self.missing_markers = None
+
+        # Pipeline stages: capture -> vision -> planning and render, linked by drop-oldest queues.
+        # frame_queue relays the rendered frames to the display.
+        self.planning_queue = DropOldestQueue(maxsize=1)
+        self.render_queue = DropOldestQueue(maxsize=1)
+        self.frame_queue = DropOldestQueue(maxsize=1)
+        self.map_lock = threading.Lock()
+        self.stage_threads = []
+        self.stage_stamps = {}
         self.running = True
 
         if thread:
@@ -89,11 +154,16 @@ class VideoToGraph:
     # Release the camera 
     def tear_down(self):
         self.running = False
-        self.cap.release()
+        self.capture.release()
         try:
             self.thread.join()
+            for stage in self.stage_threads:
+                stage.join()
         except:
             print("Thread couldn't be joined")
+        if self.tracker_pool is not None:
+            self.tracker_pool.close()
+        self.save_snapshot()
         cv.destroyAllWindows()
 
     def has_robot_position(self, name):
@@ -103,6 +173,10 @@ class VideoToGraph:
         center = self.tracked_robots[robot].get_location()
         return center
 
+    def predict_robot_position(self, robot, dt):
+        # Where the robot will be dt seconds from now, e.g. once a command sent now reaches it
+        return self.tracked_robots[robot].predict_location(dt)
+
     def get_action_point(self, action_point):
         action_point = self.tracked_qr_objects[action_point] if self.tracked_qr_objects.__contains__(action_point) else None
         return action_point
@@ -128,11 +202,15 @@ class VideoToGraph:
         except Exception as e:
             print(e)
 
+        # Map every robot and action point location onto the grid in one batch
+        robot_nodes = gr.find_nearest_nodes(self.graph, [r.get_location() for r in robots])
+        action_nodes = gr.find_nearest_nodes(self.graph, [a.get_location() for a in actions])
+
         agents = []
 
         for i, r in enumerate(robots):
             agents.append(
-                Robot(id=i, start = gr.find_nearest_node(self.graph, r.get_location()))
+                Robot(id=i, start = robot_nodes[i])
             )
         
         # Insanely high number, 
@@ -145,16 +223,16 @@ class VideoToGraph:
             for i in range(1, len(actions) - 1):
                 tasks.append(
                     Task(id = i, 
-                        start=gr.find_nearest_node(self.graph, actions[i-1].get_location()),
-                        end=gr.find_nearest_node(self.graph, actions[i].get_location()),
+                        start=action_nodes[i-1],
+                        end=action_nodes[i],
                         deadline=deadline
                         )
                 )
             
             tasks.append(Task(
                 id = len(tasks),
-                start=gr.find_nearest_node(self.graph, actions[-1].get_location()),
-                end=gr.find_nearest_node(self.graph, actions[0].get_location()),
+                start=action_nodes[-1],
+                end=action_nodes[0],
                 deadline=deadline
             ))
         
@@ -162,7 +240,7 @@ class VideoToGraph:
             tasks.append(Task(
                 id = 0, 
                 start=gr.find_nearest_node(self.graph, (1, 1)),
-                end=gr.find_nearest_node(self.graph, actions[-1].get_location()),
+                end=action_nodes[-1],
                 deadline=deadline
             ))
 
@@ -198,56 +276,21 @@ class VideoToGraph:
             t.start = self.action_points.index(t.start)
             t.end = self.action_points.index(t.end)
 
-        solver_size = len(self.action_points)
-        solver_graph = np.ones((solver_size, solver_size)) * 10000
-        for i in range(solver_size):
-            for j in range(solver_size):
-                if i == j:
-                    solver_graph[i][j] = 0
-                    solver_graph[j][i] = 0
-                else:
-                    try:
-                        
-                        path = gr.safe_astar_path(graph, self.action_points[i], self.action_points[j], gr.heuristic)
-                        if path is None:
-                            continue
-                        print(path)
-                        turning_cost = 0
-                        movement_cost = gr.print_path_weights(graph, path)*MOVE_DURATION_MS//self.block_size_cm
-                        # print(f"Movement cost: {movement_cost}")
-                        # Add turning costs to edges along path
-                        prev_direction = 0 # North
-                        for src, dest in zip(path[:-1], path[1:]):
-                            src_pos = graph.nodes[src].get(gr.GRID_POS)
-                            dest_pos = graph.nodes[dest].get(gr.GRID_POS)
-                            
-                            # Calculate direction vector
-                            dx = dest_pos[0] - src_pos[0]
-                            dy = dest_pos[1] - src_pos[1]
-                            
-                            if dx == 0:
-                                new_direction = 90 if dy > 0 else 270
-                            elif dy == 0:
-                                new_direction = 0 if dx > 0 else 180  
-                            elif dx > 0:
-                                new_direction = 45 if dy > 0 else 315
-                            else:
-                                new_direction = 135 if dy > 0 else 225
-                                
-                            angle_diff = abs(new_direction - prev_direction)
-                            if angle_diff > 180:
-                                angle_diff = 360 - angle_diff
-                                
-                            turning_cost += (angle_diff / 45) * TURN_DURATION_MS
-                                
-                            prev_direction = new_direction
-                        total_cost = movement_cost + turning_cost
-                        # print(f"Total cost: {total_cost}")
-                        solver_graph[i][j] = int(total_cost)
-                        solver_graph[j][i] = int(total_cost)
-                        # print(solver_graph[i][j])
-                    except Exception as e:
-                        print(e)
+        # One lattice search per action point gives the whole duration matrix and its paths,
+        # cached for the current map version so a RECOMPUTE with the same action points is free
+        cache = gr.get_path_cache(graph)
+        version = gr.get_map_version(graph)
+        key = (gr.COST_MATRIX, tuple(self.action_points), self.block_size_cm, MOVE_DURATION_MS, TURN_DURATION_MS)
+        entry = cache.get(key, version)
+        if entry is None:
+            builder = CostMatrixBuilder(gr.get_grid_map(graph), MOVE_DURATION_MS, TURN_DURATION_MS, self.block_size_cm)
+            entry = builder.build(self.action_points, workers=self.solver_workers)
+            cache.put(key, version, entry)
+            # First legs are planned with a free heading, exactly the query the matrix answered
+            for (i, j), (path, duration) in entry[1].items():
+                key = gr.lattice_key(self.action_points[i], self.action_points[j], MOVE_DURATION_MS, TURN_DURATION_MS, self.block_size_cm)
+                gr.seed_path_cache(graph, key, path, duration)
+        solver_graph, self.action_point_paths = entry
 
         print(agents, tasks_stream)
         solver = MRTASolver(
@@ -289,39 +332,67 @@ class VideoToGraph:
 
     # Create and update graph from the video input
     def start_environment(self):
+        # Vision stage, capture, planning and render each run on their own thread
+        self.capture.start()
+        self.stage_threads = [threading.Thread(target=stage, daemon=True) for stage in (self.run_planning_stage, self.run_render_stage)]
+        for stage in self.stage_threads:
+            stage.start()
+
         frame_count = 0  # Count frames to update the overlay after a set number of frames
-        refresh_graph = True  
+        frame_id = 0
 
         while self.running:
 
-            # Capture frame-by-frame
-            ret, frame = self.cap.read()
-
-            # if frame is read correctly ret is True
-            if not ret:
-                print("Can't receive frame (stream end?). Exiting ...")
-                self.running = False
-                break
-
-            if self.corners == {}:
-                self.corners, self.H = uf.find_corners_feed(self.cap)
+            # Newest captured frame, anything older was skipped while this stage was busy
+            stamped = self.capture.next_frame(frame_id, timeout=0.5)
+            if stamped is None:
+                if self.capture.ended:
+                    print("Can't receive frame (stream end?). Exiting ...")
+                    self.running = False
+                continue
+            frame_id = stamped.frame_id
+            frame = stamped.frame
+
+            if self.corners == {} and not self.restore_snapshot(frame):
+                if self.marker_detector is not None:
+                    arena = self.marker_detector.find_arena(frame)
+                    if arena is None:
+                        # Wait for a frame with all four corner markers in view
+                        continue
+                    self.corners, self.H = arena
+                else:
+                    self.corners, self.H = uf.find_corners_feed(self.capture)
+                self.snapshot_frame = frame
+                self.snapshot_pending = True
 
             # frame = cv.warpPerspective(frame, self.H, (frame.shape[1], frame.shape[0]))
-            refresh_graph = True if frame_count % self.overlay_update_frame_interval*3 == 0 else False
-            overlay_image = frame.copy()
+            refresh_graph = True if frame_count % (self.overlay_update_frame_interval*3) == 0 else False
             update = frame_count % self.overlay_update_frame_interval == 0
             
             if update:
-                self.convert_image_to_graph(overlay_image, refresh_graph)
+                with self.map_lock:
+                    self.convert_image_to_graph(frame, refresh_graph)
 
+                # First grid after clicking the corners, keep it for the next start
+                if self.snapshot_pending and self.grid is not None:
+                    self.save_snapshot()
+                    self.snapshot_pending = False
 
-                #self.detect_qr_objects(overlay_image)
-                refresh_graph = False
+                #self.detect_qr_objects(frame)
  
             
             if self.tracked_robots == {}:
                 # Find all robots, actions, and grab the SMT solution
-                o = uf.get_all_objects(self.cap)
+                if self.marker_detector is not None:
+                    o = self.find_marker_objects(frame)
+                    if o is None:
+                        self.planning_queue.put(stamped)
+                        self.render_queue.put(stamped)
+                        frame_count += 1
+                        continue
+                else:
+                    o = uf.get_all_objects(self.capture, self.get_tracker_pool())
+                self.apply_robot_calibrations(o.values())
 
                 actions = [ o[a] for a in o if a.startswith('action')]
                 robots = [ o[a] for a in o if a.startswith('robot')]
@@ -334,13 +405,42 @@ class VideoToGraph:
                 self.tracked_robots = o
 
             # print("Updating robot positions from trackers")
-            self.update_robot_positions_from_trackers(frame)
+            self.update_robot_positions_from_trackers(frame, stamped.stamps[StampedFrame.CAPTURE])
+            stamped.stamp(StampedFrame.VISION)
+
+            self.planning_queue.put(stamped)
+            self.render_queue.put(stamped)
+            frame_count += 1
+
+        # Wake the other stages so they can exit
+        self.planning_queue.put(None)
+        self.render_queue.put(None)
+
+    def run_planning_stage(self):
+        while self.running:
+            stamped = self.planning_queue.get()
+            if stamped is None:
+                break
+            if self.flow_field_actions:
+                with self.map_lock:
+                    self.refresh_flow_fields()
+            stamped.stamp(StampedFrame.PLANNING)
+
+    def run_render_stage(self):
+        while self.running:
+            stamped = self.render_queue.get()
+            if stamped is None:
+                break
+            overlay_image = stamped.frame.copy()
+
+            self.draw_tracked_actors(overlay_image)
             for i in range(len(self.robot_trackers)):
                 self.draw_robot_position(overlay_image, i)
 
             # self.detect_robots(overlay_image, self.robots_colors)
             if self.display_grid:
-                self.draw_grid(overlay_image, self.graph)
+                with self.map_lock:
+                    self.draw_grid(overlay_image, self.graph)
 
             if self.display_qr_objects:
                 self.draw_qr_objects(overlay_image)
@@ -351,32 +451,17 @@ class VideoToGraph:
             if self.display_deadline:
                 self.draw_deadline(overlay_image)            
             
+            stamped.stamp(StampedFrame.RENDER)
+            self.stage_stamps = stamped.stamps
             self.draw_HUD(overlay_image)
 
-            # try:
-            #     no_robots = self.no_robots()
-            #     if no_robots:
-            #         pass
-            #     else:
-            #         robot_1_center = self.tracked_robots[uf.ROBOT_ONE][1]
-            #         robot_1 = gr.find_nearest_node(self.graph, robot_1_center)
-            #         robot_2_center = self.tracked_robots[uf.ROBOT_TWO][1]
-            #         robot_2 = gr.find_nearest_node(self.graph, robot_2_center)
-            #         path = gr.safe_astar_path(self.graph, robot_1, robot_2, gr.heuristic)
-            #         if path is not None and self.display_paths:
-            #             overlay_image = gr.draw_transformed_path(overlay_image, self.graph, path)
-            #             gr.print_path_weights(self.graph, path)
-                    
-                
-                
-            # except:
-            #     if update:
-            #         pass
-
             # Display the (frame + overlay)
-            if not self.frame_queue.full():
-                self.frame_queue.put(overlay_image)
-            frame_count += 1
+            self.frame_queue.put(overlay_image)
+
+    def stage_latency_ms(self):
+        # Capture to end of each stage for the last rendered frame
+        return {stage: (stamp - self.stage_stamps[StampedFrame.CAPTURE]) * 1000
+                for stage, stamp in self.stage_stamps.items() if stage != StampedFrame.CAPTURE}
 
     def completed_initial_smt(self):
         return self.done_smt
@@ -390,38 +475,140 @@ class VideoToGraph:
     def no_robots(self):
         return not self.tracked_robots.__contains__(uf.ROBOT_ONE) and not self.tracked_robots.__contains__(uf.ROBOT_TWO)
 
-    def direction_to_turn(self, src, dest):
-        if dest[1] == src[1] and dest[0] < src[0]:
-            return 'N'
-        elif dest[1] == src[1] and dest[0] > src[0]:
-            return 'S'
-        elif dest[0] == src[0] and dest[1] > src[1]:
-            return 'E'
-        elif dest[0] == src[0] and dest[1] < src[1]:
-            return 'W'
-        elif dest[0] > src[0] and dest[1] > src[1]:
-            return 'SE'
-        elif dest[0] > src[0] and dest[1] < src[1]:
-            return 'NE'
-        elif dest[0] < src[0] and dest[1] > src[1]:
-            return 'SW'
-        elif dest[0] < src[0] and dest[1] < src[1]:
-            return 'NW'
-
+    def turn_instruction(self, turn):
+        # Heading change in degrees (Graph.heading frame) as a turn command, None if it's too small to turn for.
+        # Headings grow clockwise on the image, so a positive change is a right turn.
+        turn = (turn + 180) % 360 - 180
+        if turn >= VideoToGraph.MIN_TURN_DEGREES:
+            return f"{VideoToGraph.TURN_RIGHT_CMD}:{round(turn, 2):g}"
+        if turn <= -VideoToGraph.MIN_TURN_DEGREES:
+            return f"{VideoToGraph.TURN_LEFT_CMD}:{round(-turn, 2):g}"
+        return None
+
+    def path_to_instructions(self, path, prev_heading):
+        # Turn a cell path into turn and forward commands, returns them with the last heading driven (see Graph.heading)
+        instructions = []
+        step = 0
+        while step < len(path)-1:
+            heading = gr.heading(path[step], path[step + 1])
+            if prev_heading is not None:
+                turn = self.turn_instruction(heading - prev_heading)
+                if turn is not None:
+                    instructions.append(turn)
+
+            j = 1
+            while (step + j < len(path)-1):
+                if gr.heading(path[step + j], path[step + j + 1]) == heading:
+                    j += 1
+                else:
+                    break
+
+            instructions.append(f"{VideoToGraph.FORWARD_CMD}:{j}")
+            step += j
+            prev_heading = heading
+        return instructions, prev_heading
+
+    def waypoints_to_instructions(self, waypoints, prev_heading):
+        # Any-angle version of path_to_instructions, one turn and one fractional F per straight segment
+        instructions = []
+        for node_a, node_b in zip(waypoints[:-1], waypoints[1:]):
+            dx_cm, dy_cm = gr.segment_vector_cm(self.graph, node_a, node_b)
+
+            # Same frame as Graph.heading, 0 is +x and 90 is +y
+            heading = math.degrees(math.atan2(dy_cm, dx_cm)) % 360
+            if prev_heading is not None:
+                turn = self.turn_instruction(heading - prev_heading)
+                if turn is not None:
+                    instructions.append(turn)
+
+            instructions.append(f"{VideoToGraph.FORWARD_CMD}:{math.hypot(dx_cm, dy_cm) / self.block_size_cm:.2f}")
+            prev_heading = heading
+        return instructions, prev_heading
+
+    def timed_path_to_instructions(self, timed_path, prev_heading):
+        # Same as path_to_instructions, but a repeated node in a (node, time) path becomes a wait
+        instructions = []
+        segment = [timed_path[0][0]]
+        waited = 0
+        for (prev_node, prev_time), (node, time) in zip(timed_path[:-1], timed_path[1:]):
+            if node == prev_node:
+                commands, prev_heading = self.path_to_instructions(segment, prev_heading)
+                instructions.extend(commands)
+                segment = [node]
+                waited += time - prev_time
+                continue
+            if waited > 0:
+                instructions.append(f"{VideoToGraph.WAIT_CMD}:{int(waited)}")
+                waited = 0
+            segment.append(node)
+
+        commands, prev_heading = self.path_to_instructions(segment, prev_heading)
+        instructions.extend(commands)
+        if waited > 0:
+            instructions.append(f"{VideoToGraph.WAIT_CMD}:{int(waited)}")
+        return instructions, prev_heading
+
+    def plan_collision_free_paths(self, robot_schedules):
+        # Timed legs per robot that keep robots out of each other's cells, None entries fall back to independent planning
+        if not self.collision_free_planning or self.grid is None or len(robot_schedules) < 2:
+            return [None] * len(robot_schedules)
+        planner = SpaceTimePlanner(self.grid, MOVE_DURATION_MS, TURN_DURATION_MS, self.block_size_cm)
+        return planner.plan(robot_schedules)
+
+    def plan_leg(self, robot, src, dest, start_heading=None):
+        """
+        (path, duration in ms) of one leg that isn't reserved against the other robots,
+        (None, INF) if dest can't be reached.
+
+        The default lattice planner minimises moves and turns together, and its duration is
+        the same number the cost matrix gave the schedule. hierarchical_planning and
+        incremental_planning hand the leg to HPA* or D* Lite instead, adaptive_grid to the
+        quadtree, whose paths are waypoints rather than neighbouring cells, and
+        jump_point_search to JPS. Their shortest paths are timed by leg_duration.
+        """
+        start, goal = gr.node_grid_pos(self.graph, src), gr.node_grid_pos(self.graph, dest)
+        if self.hierarchical_planning:
+            path, _ = gr.cached_hierarchical_path(self.graph, start, goal)
+        elif self.adaptive_grid:
+            path = self.get_quadtree().path(start, goal)
+        elif self.incremental_planning:
+            path = self.get_incremental_path(robot, goal, start)
+        elif self.jump_point_search:
+            path, _ = gr.cached_astar_path(self.graph, start, goal, jump_points=True)
+        else:
+            return gr.cached_lattice_path(self.graph, start, goal, MOVE_DURATION_MS, TURN_DURATION_MS, self.block_size_cm, start_heading=start_heading)
+
+        if path is None:
+            return None, gr.INF
+        return path, self.leg_duration(path, start_heading)
+
+    def leg_duration(self, path, start_heading=None):
+        # Driving and turning time (ms) of a path on the lattice planner's time scale, None start_heading makes the first turn free
+        duration = 0.0
+        heading = start_heading
+        for node_a, node_b in zip(path[:-1], path[1:]):
+            dx_cm, dy_cm = gr.segment_vector_cm(self.graph, node_a, node_b)
+            new_heading = math.degrees(math.atan2(dy_cm, dx_cm)) % 360
+            if heading is not None:
+                duration += abs((new_heading - heading + 180) % 360 - 180) / 45 * TURN_DURATION_MS
+            # Neighbouring cells cost their edge weight like on the lattice, anything further is driven straight
+            weight = self.grid.weight(node_a, node_b)
+            duration += gr.move_duration(weight if weight is not None else math.hypot(dx_cm, dy_cm), MOVE_DURATION_MS, self.block_size_cm)
+            heading = new_heading
+        return duration
 
     def generate_point_to_point_movement_instructions(self, robot_schedules):
-        paths = []
-        PICKUP_CMD = "P" # Do a spin
-        DROPOFF_CMD = "D" # Do a spin
-        FORWARD_CMD = "F"
-        TURN_LEFT_CMD = "L"
-        TURN_RIGHT_CMD = "R"
-        WAIT_CMD = "W"
         instructions_set = []
+        timed_paths = self.plan_collision_free_paths(robot_schedules)
         for i, rschedule in enumerate(robot_schedules):
             robot_id = "robot 1" if i == 0 else "robot 2"
+            timed_legs = timed_paths[i]
+            if timed_legs is None and self.collision_free_planning and len(robot_schedules) > 1:
+                # The space-time planner gave up on this robot, its legs aren't reserved against the others
+                print(f"No collision-free plan for {robot_id}, falling back to independent paths that may collide")
             instructions = []
-            prev_direction = None
+            # Heading the robot drives in after the last leg (see Graph.heading), None before it has moved
+            prev_heading = None
             movement_start = False
             # print(f"Robot {robot_id} paths:")
             for i in range(len(rschedule)-1):
@@ -431,58 +618,39 @@ class VideoToGraph:
                 next_action = rschedule[i+1]['action']
                 if i > 0 and next_action != "WAIT":
                     movement_start = True
-                # Compute full path between src and dest
-                path = gr.safe_astar_path(self.graph, self.graph.nodes[src].get(gr.GRID_POS), self.graph.nodes[dest].get(gr.GRID_POS), gr.heuristic)
+
+                if timed_legs is not None:
+                    # Space-time plan already holds every wait needed to stay clear of the other robots
+                    timed_path = timed_legs[i]
+                    path = [node for k, (node, _) in enumerate(timed_path) if k == 0 or node != timed_path[k - 1][0]]
+                    commands, prev_heading = self.timed_path_to_instructions(timed_path, prev_heading)
+                else:
+                    # Compute full path between src and dest and its driving and turning time
+                    path, leg_ms = self.plan_leg(robot_id, src, dest, prev_heading)
+                    if path is None:
+                        # Every later leg starts where this one can't get to, so the robot stops here
+                        print(f"No path for {robot_id} from {src} to {dest}, dropping its remaining legs")
+                        break
+                    if movement_start == False and leg_ms < rschedule[i+1]['time'] - rschedule[i]['time']:
+                        instructions.append(f"{VideoToGraph.WAIT_CMD}:{int(rschedule[i+1]['time'] - rschedule[i]['time'] - leg_ms)}")
+                    if self.any_angle_paths or self.adaptive_grid:
+                        # Quadtree paths already skip over open space, only the any-angle commands can drive them
+                        commands, prev_heading = self.waypoints_to_instructions(gr.smooth_path(self.graph, path), prev_heading)
+                    else:
+                        commands, prev_heading = self.path_to_instructions(path, prev_heading)
+
                 print(path)
                 if self.paths.get(robot_id) is None:
                     self.paths[robot_id] = []
                 self.paths[robot_id].append(path)
 
-                if movement_start == False and gr.print_path_weights(self.graph, path) < rschedule[i+1]['time'] - rschedule[i]['time']:
-                    instructions.append(f"{WAIT_CMD}:{int(rschedule[i+1]['time'] - rschedule[i]['time'] - gr.print_path_weights(self.graph, path))}")
-                # print(path)
-
-                if len(path) > 1:
-                    step = 0
-                    while step < len(path)-1:
-                        direction = self.direction_to_turn(path[step], path[step + 1])
-                        if prev_direction is not None and prev_direction != direction:
-                            direction_angles = {
-                                'N': 0,
-                                'NE': 45,
-                                'E': 90,
-                                'SE': 135,
-                                'S': 180,
-                                'SW': 225,
-                                'W': 270,
-                                'NW': 315
-                            }
-                            angle = direction_angles[direction] - direction_angles[prev_direction]
-                            if angle > 180:
-                                angle = 360 - angle
-
-                            angle = int(abs(angle))
-                            if angle > 0:
-                                instructions.append(f"{TURN_RIGHT_CMD}:{angle}")
-                            elif angle < 0:
-                                instructions.append(f"{TURN_LEFT_CMD}:{angle}")
-
-                        j = 1
-                        while (step + j < len(path)-1):
-                            if self.direction_to_turn(path[step + j], path[step + j + 1]) == direction:
-                                j += 1
-                            else:
-                                break
-
-                        instructions.append(f"{FORWARD_CMD}:{j}")
-                        step += j
-                        prev_direction = direction
+                instructions.extend(commands)
 
                 # After movement
                 if next_action == "PICKUP":
-                    instructions.append(PICKUP_CMD)
+                    instructions.append(VideoToGraph.PICKUP_CMD)
                 elif next_action == "DROPOFF":
-                    instructions.append(DROPOFF_CMD)                        
+                    instructions.append(VideoToGraph.DROPOFF_CMD)
 
             instructions_set.append(instructions)
             print(f"Robot {robot_id} Instructions: {instructions}")
@@ -544,22 +712,66 @@ class VideoToGraph:
     def convert_image_to_graph(self, image, refresh_graph):
         if refresh_graph:
             #corners = uf.find_corners(image)
-            corners = self.corners
-            # if self.corners != corners:
-            self.corners = corners
+            # The world model only rebuilds the grid if the corners or homography moved
             self.set_dimensions(self.corners)
-            self.graph = nx.grid_2d_graph(self.graph_x_nodes, self.graph_y_nodes)
-            gr.add_diagonal_edges(self.graph_x_nodes, self.graph_y_nodes, self.graph)
             self.refresh_matrix(self.corners)
-            gr.set_node_positions(self.graph, self.matrix)
-            self.update_robot_positions_from_trackers(image)
+            self.compute_pixel_conversion()
+            self.world.update_geometry(self.corners, self.graph_x_nodes, self.graph_y_nodes, self.matrix, self.pixel_conversion)
+            self.grid = self.world.grid
+            self.graph = self.world.graph
+
+        if self.grid is not None:
+            # Only nodes whose obstacle flags flip (and their edges) are updated
             self.detect_static_obstacles(image)
             # self.detect_qr_objects(image)
             # self.detect_robots(image, self.robots_colors)
-            self.compute_pixel_conversion()
-            gr.adjust_graph_weights(self.graph, self.pixel_conversion)        
 
         return self.graph
+
+    def save_snapshot(self):
+        if self.snapshot_path is None or self.grid is None or len(self.corners) < 4:
+            return
+        try:
+            SessionSnapshot.save(self.snapshot_path, self.corners, self.H, self.matrix, self.pixel_conversion, self.block_size_cm,
+                                 self.grid, self.robot_calibrations, self.snapshot_frame)
+        except OSError as e:
+            print(f"Couldn't save snapshot: {e}")
+
+    def restore_snapshot(self, frame):
+        # Skip the corner clicking if a saved session still lines up with the live frame
+        if self.snapshot_path is None:
+            return False
+        snapshot = SessionSnapshot.load(self.snapshot_path)
+        if snapshot is None:
+            return False
+
+        drift = SessionSnapshot.drift(snapshot, frame)
+        if drift > SessionSnapshot.MAX_DRIFT_PX:
+            print(f"Camera moved {drift:.1f}px since the snapshot, recalibrating")
+            return False
+        if float(snapshot["block_size_cm"]) != self.block_size_cm:
+            print("Block size changed since the snapshot, recalibrating")
+            return False
+
+        self.corners = SessionSnapshot.corners(snapshot)
+        self.H = snapshot["H"]
+        self.set_dimensions(self.corners)
+        self.matrix = snapshot["matrix"]
+        self.pixel_conversion = snapshot["pixel_conversion"].tolist()
+        self.world.update_geometry(self.corners, self.graph_x_nodes, self.graph_y_nodes, self.matrix, self.pixel_conversion)
+        self.grid = self.world.grid
+        self.graph = self.world.graph
+
+        if "contour_obstacle" in snapshot:
+            changed = self.world.restore_obstacles(snapshot["contour_obstacle"], snapshot["marked_obstacle"], snapshot["obstacle_distance"])
+            self.notify_planners(changed)
+        self.robot_calibrations = SessionSnapshot.calibrations(snapshot)
+        self.snapshot_frame = frame
+        print(f"Restored session snapshot (drift {drift:.1f}px)")
+        return True
+
+    def get_map_version(self):
+        return self.world.version
     
     def refresh_matrix(self, corners):
         matrix = uf.compute_affine_transformation(corners, self.graph_x_nodes, self.graph_y_nodes)
@@ -572,7 +784,7 @@ class VideoToGraph:
         return overlay_image
 
     def draw_qr_objects(self, overlay_image):
-        for i, key in enumerate(self.tracked_qr_objects.keys()):
+        for i, key in enumerate(list(self.tracked_qr_objects.keys())):
             # print(i, key)
             actor = self.tracked_qr_objects[key]
             pts = np.array(actor.get_bbox())
@@ -595,14 +807,25 @@ class VideoToGraph:
         return overlay_image
     
     def find_paths(self, robot_goal):
+        robots = [robot for robot in robot_goal if robot in self.tracked_qr_objects]
+        if not robots:
+            return {}
+
+        # All robots are mapped onto the grid in one call, robots heading for the same goal share one search
+        starts = gr.find_nearest_nodes(self.graph, [self.tracked_qr_objects[robot].get_location() for robot in robots])
+        goals = [robot_goal[robot] for robot in robots]
+        shared = [goals.count(goal) > 1 for goal in goals]
+
         paths = {}
-        for robot, goal in robot_goal.items():
-            try:
-                _, center = self.tracked_qr_objects[robot]
-            except:
-                continue
-            path = gr.a_star_from_pixel_pos(self.graph, center, goal)
-            paths[robot] = path
+        for robot, start, goal, is_shared in zip(robots, starts, goals, shared):
+            if not is_shared:
+                paths[robot], _ = self.plan_leg(robot, start, goal)
+
+        batch = [(robot, start, goal) for robot, start, goal, is_shared in zip(robots, starts, goals, shared) if is_shared]
+        if batch:
+            results = gr.batch_paths(self.graph, [start for _, start, _ in batch], [goal for _, _, goal in batch], self.jump_point_search)
+            for (robot, _, _), (path, _) in zip(batch, results):
+                paths[robot] = path
         return paths
 
     def set_robot_goals(self, goals):
@@ -625,14 +848,16 @@ class VideoToGraph:
 
     def compute_pixel_conversion(self):
         try:
-            self.pixel_conversion.append(self.square_length_cm / self.square_pixel_length)
-            self.pixel_conversion.append(self.square_height_cm / self.square_pixel_height)
-            self.pixel_conversion.append((self.square_length_cm**2 + self.square_height_cm**2) ** 0.5 / (self.square_pixel_length**2 + self.square_pixel_height**2) ** 0.5)
+            self.pixel_conversion = [
+                self.square_length_cm / self.square_pixel_length,
+                self.square_height_cm / self.square_pixel_height,
+                (self.square_length_cm**2 + self.square_height_cm**2) ** 0.5 / (self.square_pixel_length**2 + self.square_pixel_height**2) ** 0.5,
+            ]
         except Exception as e:
             print(e)
             print("Couldn't compute pixel dimensions")
 
-    def detect_static_obstacles(self, image, proximity_threshold=60):
+    def detect_static_obstacles(self, image, proximity_threshold=60, proximity_threshold_cm=None):
         overlay_image = image.copy()
         hsv_image = cv.cvtColor(overlay_image, cv.COLOR_BGR2HSV)
         pink_lower = [140, 50, 50]
@@ -644,27 +869,113 @@ class VideoToGraph:
 
         for contour in filtered_contours:
             cv.drawContours(overlay_image, [contour], -1, uf.RED, 2)
-            gr.update_graph_based_on_obstacle(self.graph, contour, proximity_threshold)
 
-    def update_robot_positions_from_trackers(self, image):
+        # With a known footprint only what a robot can't fit past is blocked, the rest is left to the clearance costs
+        if proximity_threshold_cm is None and self.robot_footprints_cm:
+            proximity_threshold_cm = max(self.robot_footprints_cm.values())
+
+        # Threshold in cm is converted with the mean of the horizontal/vertical pixel conversion
+        if proximity_threshold_cm is not None and self.pixel_conversion:
+            proximity_threshold = proximity_threshold_cm / ((self.pixel_conversion[0] + self.pixel_conversion[1]) / 2)
+
+        changed = self.world.update_obstacles(filtered_contours, image.shape, proximity_threshold)
+        self.notify_planners(changed)
+        return changed
+
+    def set_robot_footprint(self, robot, radius_cm):
+        self.robot_footprints_cm[robot] = radius_cm
+        changed = self.world.set_clearance(max(self.robot_footprints_cm.values()), self.clearance_inflation_cm, self.clearance_penalty)
+        self.notify_planners(changed)
+        return changed
+
+    def get_incremental_path(self, robot, goal, start=None):
+        # One D* Lite planner per robot-goal pair, recreated when the grid itself is rebuilt
+        if start is None:
+            start = gr.find_nearest_node(self.graph, self.tracked_qr_objects[robot].get_location())
+        planner = self.planners.get((robot, goal))
+        if planner is None or planner.grid is not self.grid:
+            planner = DStarLite(self.grid, start, goal)
+            self.planners[(robot, goal)] = planner
+        else:
+            planner.move_start(start)
+        return planner.path()
+
+    def get_quadtree(self):
+        # Rebuilt when the map version or the action point nodes change
+        actions = [actor.get_location() for name, actor in self.tracked_robots.items() if name.startswith('action') and actor.get_location() is not None]
+        refine_nodes = gr.find_nearest_nodes(self.graph, actions) if actions else []
+        version = self.get_map_version()
+        if self.quadtree is None or self.quadtree.is_stale(self.grid, refine_nodes, version):
+            self.quadtree = QuadtreeGrid(self.grid, refine_nodes, version)
+        return self.quadtree
+
+    def flow_field(self, action):
+        # Flow field towards an action point for the current map, None until the action point is tracked
+        actor = self.tracked_robots.get(action)
+        if self.grid is None or actor is None or actor.get_location() is None:
+            return None
+        return gr.cached_flow_field(self.graph, gr.find_nearest_node(self.graph, actor.get_location()))
+
+    def refresh_flow_fields(self):
+        # Only fields somebody asked for are rebuilt after a map change, nothing is computed until then
+        for action in list(self.flow_field_actions):
+            self.flow_field(action)
+
+    def get_next_step(self, robot, action):
+        # Next grid cell for the robot towards the action point, straight from the action point's flow field
+        actor = self.tracked_robots.get(robot)
+        if actor is None or actor.get_location() is None:
+            return None
+        with self.map_lock:
+            field = self.flow_field(action)
+            if field is None:
+                return None
+            self.flow_field_actions.add(action)
+            return field.next_step(gr.find_nearest_node(self.graph, actor.get_location()))
+
+    def notify_planners(self, changed_nodes):
+        if not changed_nodes:
+            return
+        for planner in self.planners.values():
+            if planner.grid is self.grid:
+                planner.notify_changes(changed_nodes)
+
+    def apply_robot_calibrations(self, actors):
+        # Calibration factors restored from the session snapshot go to the robots as they are created
+        for actor in actors:
+            interface = actor.physical_interface
+            if interface is not None and interface.device_name in self.robot_calibrations:
+                interface.set_calibration(self.robot_calibrations[interface.device_name])
+
+    def find_marker_objects(self, frame):
+        # Actors of every configured marker, None until they are all in view at once
+        detections = self.marker_detector.detect(frame)
+        missing = [name for name in self.marker_detector.actor_names() if name not in detections]
+        if missing:
+            if missing != self.missing_markers:
+                print("Waiting for markers", missing)
+                self.missing_markers = missing
+            return None
+        return self.marker_detector.create_actors(frame, detections)
+
+    def update_robot_positions_from_trackers(self, image, stamp=None):
+
+        # Update the trackers of each individual actor, drawing is left to the render stage.
+        # Actors between tracker updates only advance their pose filters to stamp.
+        # In marker mode one detection pass replaces all the trackers.
+        pool = None
+        if self.marker_detector is not None:
+            self.marker_detector.update(image, self.tracked_robots.values(), stamp)
+        else:
+            pool = self.get_tracker_pool()
+        if pool is not None:
+            pool.update(image, self.tracked_robots.values(), stamp)
 
-        # Update the trackers of each individual actor
         for actor_name in self.tracked_robots:
             # print("Updating actor", actor_name)
             actor = self.tracked_robots[actor_name]
-
-            if actor.update(image):
-                top_left = (int(actor.bbox[0]), int(actor.bbox[1]))
-                bottom_right = (int(actor.bbox[0] + actor.bbox[2]), int(actor.bbox[1] + actor.bbox[3]))
-                cv.rectangle(image, top_left, bottom_right, (0, 255, 255), 2)
-
-                # Draw orientation arrow
-                if actor.orientation is not None:
-                    center = tuple(map(int, actor.get_location()))
-                    arrow_length = 50
-                    end_x = int(center[0] + arrow_length * np.cos(np.radians(actor.orientation)))
-                    end_y = int(center[1] + arrow_length * np.sin(np.radians(actor.orientation)))
-                    cv.arrowedLine(image, center, (end_x, end_y), (0, 0, 255), 2)
+            if pool is None and self.marker_detector is None:
+                actor.update(image, stamp)
 
             # Track all robot actors 
             if actor.name in [uf.ROBOT_ONE, uf.ROBOT_TWO]:
@@ -697,6 +1008,33 @@ class VideoToGraph:
         #         cv.putText(image, f"Tracking failed for Node {i}", (100, 50 + i * 30), cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
 
 
+    def get_tracker_pool(self):
+        if self.tracker_workers is None or self.tracker_workers <= 1:
+            return None
+        if self.tracker_pool is None:
+            self.tracker_pool = TrackerPool(self.tracker_workers)
+        return self.tracker_pool
+
+    def draw_tracked_actors(self, image):
+        for actor in list(self.tracked_robots.values()):
+            if not actor.tracked or actor.bbox is None:
+                continue
+            # The box follows the filtered pose, which moves on frames the tracker skipped
+            cx, cy, theta = actor.get_pose()
+            w, h = actor.bbox[2], actor.bbox[3]
+            top_left = (int(cx - w / 2), int(cy - h / 2))
+            bottom_right = (int(cx + w / 2), int(cy + h / 2))
+            cv.rectangle(image, top_left, bottom_right, (0, 255, 255), 2)
+
+            # Draw orientation arrow
+            if theta is not None:
+                center = (int(cx), int(cy))
+                arrow_length = 50
+                end_x = int(center[0] + arrow_length * np.cos(np.radians(theta)))
+                end_y = int(center[1] + arrow_length * np.sin(np.radians(theta)))
+                cv.arrowedLine(image, center, (end_x, end_y), (0, 0, 255), 2)
+        return image
+
     def detect_robots(self, image, color_ranges):
         hsv_image = cv.cvtColor(image, cv.COLOR_BGR2HSV)
         robots = {}
@@ -760,12 +1098,17 @@ class VideoToGraph:
                 if key[0] == "a":
                     qr_code_points = self.tracked_qr_objects[key].astype(int)
                     overlapping_nodes = self.check_qr_code_overlap(self.graph, qr_code_points)
-                    gr.update_graph_based_on_qr_code(self.graph, overlapping_nodes, self.overlapping_nodes)
+                    self.update_graph_based_on_qr_code(overlapping_nodes, self.overlapping_nodes)
                     self.overlapping_nodes = overlapping_nodes
             except:
                 pass 
                 # print(f"Invalid QR code detected: {key}")
     
+    def update_graph_based_on_qr_code(self, overlapping_nodes, previous_overlapping_nodes):
+        changed = self.world.set_near_obstacle(overlapping_nodes, True)
+        changed += self.world.set_near_obstacle(previous_overlapping_nodes - overlapping_nodes, False)
+        self.notify_planners(changed)
+
     def check_qr_code_overlap(self, graph, qr_code_points, proximity_threshold=25):
         # Get the bounding box of the QR code in graph space
         min_x = min([pt[0] for pt in qr_code_points])
@@ -822,6 +1165,10 @@ class VideoToGraph:
             overlay_image = self.outline_text(overlay_image, f"Deadline threshold: {self.display_deadline}", (pos_x, pos_y - 3*uf.TEXT_DISTANCE), scale=1.2,outline=4)
             overlay_image = self.outline_text(overlay_image, f"QR objects: {self.display_qr_objects}", (pos_x, pos_y - 4*uf.TEXT_DISTANCE), scale=1.2,outline=4)
             overlay_image = self.outline_text(overlay_image, f"Obstacles: {self.display_obstacles}", (pos_x, pos_y - 5*uf.TEXT_DISTANCE), scale=1.2,outline=4)
+            latency = self.stage_latency_ms()
+            if latency:
+                stages = ", ".join(f"{stage} {ms:.0f}" for stage, ms in latency.items())
+                overlay_image = self.outline_text(overlay_image, f"Latency ms: {stages}", (pos_x, pos_y - 6*uf.TEXT_DISTANCE), scale=1.2,outline=4)
 
         overlay_image = self.outline_text(overlay_image, f"Options: {self.display_HUD}", (pos_x, pos_y+uf.TEXT_DISTANCE), scale=1.2,outline=4)
 
@@ -842,14 +1189,12 @@ class VideoToGraph:
         return image
 
     def check_weights(self):
-        length = gr.safe_astar_path(self.graph, (0,0), (self.graph_x_nodes-1,0), gr.heuristic)
-        height = gr.safe_astar_path(self.graph, (0,0), (0, self.graph_y_nodes-1), gr.heuristic)
-        diagonal = gr.safe_astar_path(self.graph, (0,0), (self.graph_x_nodes - 1 , self.graph_y_nodes-1), gr.heuristic)
+        length, length_cost = gr.cached_astar_path(self.graph, (0,0), (self.graph_x_nodes-1,0), self.jump_point_search)
+        height, height_cost = gr.cached_astar_path(self.graph, (0,0), (0, self.graph_y_nodes-1), self.jump_point_search)
+        diagonal, diagonal_cost = gr.cached_astar_path(self.graph, (0,0), (self.graph_x_nodes - 1 , self.graph_y_nodes-1), self.jump_point_search)
 
         print("Length, height, diagonal")
-        gr.print_path_weights(self.graph, length)
-        gr.print_path_weights(self.graph, height)
-        gr.print_path_weights(self.graph, diagonal)
+        print(length_cost, height_cost, diagonal_cost)
 
 def main():
     video = "img/video/test_red_close.mov"
@@ -0,0 +1,90 @@
+import numpy as np
+import networkx as nx
+
+from solver.graph import Graph as gr
+from solver.grid_map import GridMap
+
+
+class WorldModel:
+    """
+    Versioned owner of the arena grid and its networkx view.
+
+    The grid is only rebuilt when the corners or the transformation matrix change.
+    Obstacle updates touch only the nodes whose flags flipped and their edges.
+    Every change bumps `version`, which is also stored on the graph (Graph.MAP_VERSION)
+    so path and cost caches can key on it.
+    """
+
+    def __init__(self):
+        self.corners = None
+        self.matrix = None
+        self.conversion = None
+        self.grid = None
+        self.graph = nx.Graph()
+        self.version = 0
+
+        # (footprint_cm, inflation_cm, penalty) of the clearance cost layer, kept across rebuilds
+        self.clearance = None
+
+    def bump_version(self):
+        self.version += 1
+        self.graph.graph[gr.MAP_VERSION] = self.version
+        return self.version
+
+    def geometry_changed(self, corners, matrix, conversion):
+        if self.grid is None:
+            return True
+        if dict(corners) != self.corners or list(conversion) != self.conversion:
+            return True
+        return self.matrix.shape != np.shape(matrix) or not np.allclose(self.matrix, matrix)
+
+    def update_geometry(self, corners, width, height, matrix, conversion):
+        # Rebuild the grid and graph only if the calibration actually moved
+        if not self.geometry_changed(corners, matrix, conversion):
+            return False
+
+        previous = self.grid
+        self.corners = dict(corners)
+        self.matrix = np.array(matrix, dtype=np.float64)
+        self.conversion = list(conversion)
+
+        self.grid = GridMap(width, height, self.matrix)
+        if previous is not None:
+            # Keep the last known obstacles until the next detection pass
+            self.grid.copy_obstacles_from(previous)
+        self.grid.clearance = self.clearance
+        self.grid.compute_weights(self.conversion)
+
+        self.graph = gr.from_grid_map(self.grid)
+        self.bump_version()
+        return True
+
+    def apply_changes(self, changed):
+        # Push the nodes whose flags flipped into the networkx view
+        if not changed.any():
+            return []
+        nodes = [tuple(node) for node in np.argwhere(changed).tolist()]
+        gr.sync_nodes_from_grid_map(self.graph, nodes)
+        self.bump_version()
+        return nodes
+
+    def update_obstacles(self, contours, image_shape, proximity_threshold):
+        if self.grid is None:
+            return []
+        return self.apply_changes(self.grid.update_obstacles(contours, image_shape, proximity_threshold))
+
+    def set_clearance(self, footprint_cm, inflation_cm, penalty=1.0):
+        self.clearance = (footprint_cm, inflation_cm, penalty) if footprint_cm is not None else None
+        if self.grid is None:
+            return []
+        return self.apply_changes(self.grid.set_clearance(footprint_cm, inflation_cm, penalty))
+
+    def restore_obstacles(self, contour_obstacle, marked_obstacle, obstacle_distance):
+        if self.grid is None:
+            return []
+        return self.apply_changes(self.grid.restore_obstacles(contour_obstacle, marked_obstacle, obstacle_distance))
+
+    def set_near_obstacle(self, nodes, value=True):
+        if self.grid is None:
+            return []
+        return self.apply_changes(self.grid.set_near_obstacle(nodes, value))
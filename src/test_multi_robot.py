@@ -0,0 +1,107 @@
+import numpy as np
+
+from solver.grid_map import GridMap
+from solver.multi_robot import SpaceTimePlanner
+
+CONVERSION = [0.15, 0.15, 0.15]
+MOVE_DURATION_MS = 13
+TURN_DURATION_MS = 50
+BLOCK_SIZE_CM = 3.0
+
+
+def make_grid(width, height, blocked=()):
+    grid = GridMap(width, height, np.array([[20.0, 0, 50], [0, 20.0, 40], [0, 0, 1]]), CONVERSION)
+    grid.set_near_obstacle(blocked)
+    return grid
+
+
+def occupied_ticks(planner, legs):
+    # (cell, tick) pairs the timed legs surely cover: the first cell at the start, the source
+    # cell of a move or wait until it ends and the destination cell once it's reached
+    first_cell, first_time = legs[0][0]
+    occupied = {(planner.node_id(first_cell), int(first_time // planner.tick_ms))}
+    for leg in legs:
+        for (node_a, time_a), (node_b, time_b) in zip(leg[:-1], leg[1:]):
+            tick_a, tick_b = int(time_a // planner.tick_ms), int(time_b // planner.tick_ms)
+            occupied.update((planner.node_id(node_a), tick) for tick in range(tick_a + 1, tick_b + 1))
+            occupied.add((planner.node_id(node_b), tick_b))
+    return occupied
+
+
+def assert_no_conflicts(planner, schedules, timed_paths):
+    for robot, legs in enumerate(timed_paths):
+        if not legs:
+            continue
+        # Everything a robot drives through is reserved for that robot alone
+        for cell, tick in occupied_ticks(planner, legs):
+            assert planner.reserved.get((cell, tick)) == robot, (robot, planner.node_of(cell), tick)
+
+    # Nobody drives over a parked robot
+    for (cell, tick), robot in planner.reserved.items():
+        parked = planner.parked.get(cell)
+        assert parked is None or parked[1] == robot or tick < parked[0], (robot, planner.node_of(cell), tick)
+
+    # Robots planned early never pass the start cell of a robot that hasn't been planned yet
+    for robot, schedule in enumerate(schedules):
+        if not schedule:
+            continue
+        start = planner.node_id(schedule[0]['location'])
+        assert all(owner >= robot for (cell, _), owner in planner.reserved.items() if cell == start)
+
+
+def schedule(*stops):
+    actions = ['START'] + ['PICKUP'] * (len(stops) - 2) + ['DROPOFF']
+    return [{'location': location, 'time': 0, 'action': action} for location, action in zip(stops, actions)]
+
+
+# user-010: robots swapping sides through a one cell gap have to take turns
+def test_corridor_swap_has_no_conflicts():
+    grid = make_grid(10, 10, [(5, y) for y in range(10) if y != 4])
+    schedules = [schedule((0, 4), (9, 4), (0, 6)),
+                 schedule((9, 5), (0, 5), (9, 0)),
+                 schedule((2, 0), (2, 9))]
+    planner = SpaceTimePlanner(grid, MOVE_DURATION_MS, TURN_DURATION_MS, BLOCK_SIZE_CM)
+    timed_paths = planner.plan(schedules)
+
+    assert all(legs is not None for legs in timed_paths)
+    for robot, legs in enumerate(timed_paths):
+        stops = [stop['location'] for stop in schedules[robot]]
+        assert [leg[0][0] for leg in legs] == stops[:-1] and [leg[-1][0] for leg in legs] == stops[1:]
+        assert all(time_a <= time_b for leg in legs for (_, time_a), (_, time_b) in zip(leg[:-1], leg[1:]))
+    assert_no_conflicts(planner, schedules, timed_paths)
+
+
+# user-010: random crowds on random maps never share a cell in the same tick
+def test_random_schedules_have_no_conflicts():
+    rng = np.random.default_rng(0)
+    for _ in range(15):
+        width, height = (int(v) for v in rng.integers(6, 14, size=2))
+        grid = make_grid(width, height, [tuple(node) for node in np.argwhere(rng.random((width, height)) < 0.15).tolist()])
+        free = [tuple(node) for node in np.argwhere(~grid.near_obstacle).tolist()]
+        robots = int(rng.integers(2, 5))
+        stops = [free[i] for i in rng.choice(len(free), 3 * robots, replace=False)]
+        schedules = [schedule(*stops[3 * i:3 * i + 3]) for i in range(robots)]
+
+        planner = SpaceTimePlanner(grid, MOVE_DURATION_MS, TURN_DURATION_MS, BLOCK_SIZE_CM)
+        timed_paths = planner.plan(schedules)
+        assert_no_conflicts(planner, schedules, [legs or [] for legs in timed_paths])
+
+
+# user-010: a leg doesn't leave before the time of the stop it starts from
+def test_schedule_time_is_respected():
+    grid = make_grid(6, 6)
+    schedules = [schedule((0, 0), (5, 0), (5, 5))]
+    schedules[0][1]['time'] = 2000
+    planner = SpaceTimePlanner(grid, MOVE_DURATION_MS, TURN_DURATION_MS, BLOCK_SIZE_CM)
+    timed_paths = planner.plan(schedules)
+
+    leg = timed_paths[0][1]
+    assert min(time for node, time in leg if node != leg[0][0]) > 2000
+    assert_no_conflicts(planner, schedules, timed_paths)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} passed")
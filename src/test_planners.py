@@ -0,0 +1,367 @@
+import math
+
+import networkx as nx
+import numpy as np
+
+from solver.graph import Graph as gr, PathCache
+from solver.grid_map import GridMap
+from solver.world_model import WorldModel
+from solver.jump_point import JumpPointSearch
+from solver.hierarchical import HierarchicalPlanner
+from solver.incremental import DStarLite
+from solver.flow_field import FlowField
+from solver.quadtree import QuadtreeGrid
+from solver.cost_matrix import CostMatrixBuilder
+
+TRIALS = 30
+CONVERSION = [0.15, 0.15, 0.15]
+BLOCK_SIZE_CM = 3.0
+MOVE_DURATION_MS = 100
+TURN_DURATION_MS = 40
+
+
+def random_matrix(rng, perspective):
+    # 20 px per cell, with an optional tilt so edge lengths vary over the grid
+    matrix = np.array([[20.0, 0, 50], [0, 20.0, 40], [0, 0, 1]])
+    if perspective:
+        matrix += np.array([[rng.uniform(-2, 2), rng.uniform(-2, 2), 0],
+                            [rng.uniform(-2, 2), rng.uniform(-2, 2), 0],
+                            [rng.uniform(0, 2e-3), rng.uniform(0, 2e-3), 0]])
+    return matrix
+
+
+def random_grid(rng, perspective=False, clearance=False):
+    width, height = (int(v) for v in rng.integers(8, 30, size=2))
+    grid = GridMap(width, height, random_matrix(rng, perspective))
+    if clearance:
+        grid.clearance = (3.0, 6.0, 1.0)
+    grid.compute_weights(CONVERSION)
+
+    if clearance:
+        # A few box obstacles in the image, the clearance layer grades the cells around them
+        contours = []
+        for _ in range(int(rng.integers(1, 5))):
+            x, y = rng.uniform(50, 50 + 20 * width), rng.uniform(40, 40 + 20 * height)
+            w, h = rng.uniform(10, 60, size=2)
+            contours.append(np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], dtype=np.int32).reshape(-1, 1, 2))
+        grid.update_obstacles(contours, (40 + 20 * height + 100, 50 + 20 * width + 100), 5)
+    else:
+        grid.set_near_obstacle([tuple(node) for node in np.argwhere(rng.random((width, height)) < 0.25).tolist()])
+    return grid
+
+
+def random_query(rng, grid):
+    free = np.argwhere(~grid.near_obstacle)
+    start, goal = rng.choice(len(free), 2, replace=False)
+    return tuple(free[start].tolist()), tuple(free[goal].tolist())
+
+
+def random_grids(seed, **kwargs):
+    rng = np.random.default_rng(seed)
+    for trial in range(TRIALS):
+        grid = random_grid(rng, perspective=trial % 2 == 1, **kwargs)
+        if (~grid.near_obstacle).sum() < 2:
+            continue
+        yield rng, grid
+
+
+def dijkstra_cost(grid, start, goal):
+    # Reference cost straight from the networkx view, INF if unreachable
+    graph = gr.from_grid_map(grid)
+    try:
+        return nx.dijkstra_path_length(graph, start, goal, weight=gr.passable_weight)
+    except nx.NetworkXNoPath:
+        return math.inf
+
+
+def path_cost(grid, path):
+    # Sum of edge weights, also checks every step is a passable grid edge
+    cost = 0.0
+    for node_a, node_b in zip(path[:-1], path[1:]):
+        weight = grid.weight(node_a, node_b)
+        assert weight is not None and weight != GridMap.INF, (node_a, node_b)
+        cost += weight
+    return cost
+
+
+def assert_optimal(grid, path, start, goal, reference):
+    if reference == math.inf:
+        assert path is None
+        return
+    assert path[0] == start and path[-1] == goal
+    assert math.isclose(path_cost(grid, path), reference, rel_tol=1e-9, abs_tol=1e-9)
+
+
+def pixel_length(grid, path):
+    positions = np.array([grid.get_pixel_pos(node)[:2] for node in path])
+    return np.hypot(*np.diff(positions, axis=0).T).sum() * grid.cm_per_pixel()
+
+
+# user-001, user-009: A* on the array-backed grid with the component reachability check
+def test_astar_matches_dijkstra():
+    for clearance in (False, True):
+        for rng, grid in random_grids(1, clearance=clearance):
+            start, goal = random_query(rng, grid)
+            graph = gr.from_grid_map(grid)
+            path = gr.safe_astar_path(graph, start, goal, gr.heuristic)
+            assert_optimal(grid, path, start, goal, dijkstra_cost(grid, start, goal))
+
+
+# user-011: exact on uniform grids, plain A* as soon as the costs aren't uniform
+def test_jump_point_search_matches_dijkstra():
+    for rng, grid in random_grids(2):
+        start, goal = random_query(rng, grid)
+        reference = dijkstra_cost(grid, start, goal)
+        if grid.uniform_step_costs() and not np.allclose(grid.matrix[2], [0, 0, 1]):
+            # Perspective grids within the uniform tolerance are only approximately optimal
+            path = JumpPointSearch(grid).search(start, goal)
+            if reference != math.inf:
+                assert path_cost(grid, path) <= reference * (1 + 2 * GridMap.UNIFORM_TOLERANCE)
+            continue
+        path = gr.jump_point_path(gr.from_grid_map(grid), start, goal)
+        assert_optimal(grid, path, start, goal, reference)
+
+
+# user-012: HPA* is near-optimal by design, so it may only ever lose against Dijkstra
+def test_hierarchical_path_is_valid():
+    for rng, grid in random_grids(3):
+        start, goal = random_query(rng, grid)
+        reference = dijkstra_cost(grid, start, goal)
+        path = HierarchicalPlanner(grid, cluster_size=5).path(start, goal)
+        if reference == math.inf:
+            assert path is None
+            continue
+        assert path[0] == start and path[-1] == goal
+        assert path_cost(grid, path) >= reference - 1e-9
+
+
+# user-012: only the clusters around changed nodes are recomputed
+def test_hierarchical_path_follows_map_changes():
+    rng = np.random.default_rng(4)
+    world = WorldModel()
+    world.update_geometry({"tl": (0, 0)}, 20, 20, random_matrix(rng, False), CONVERSION)
+    # Build the clusters first, so the wall only reaches them through notify_changes
+    gr.hierarchical_path(world.graph, (0, 10), (19, 10))
+    world.set_near_obstacle([(10, y) for y in range(20) if y != 2])
+
+    path = gr.hierarchical_path(world.graph, (0, 10), (19, 10))
+    assert (10, 2) in path
+    assert path_cost(world.grid, path) >= dijkstra_cost(world.grid, (0, 10), (19, 10)) - 1e-9
+
+
+# user-008: D* Lite from scratch, then repaired after obstacles appear on its path
+def test_dstar_lite_matches_dijkstra():
+    for rng, grid in random_grids(5):
+        start, goal = random_query(rng, grid)
+        planner = DStarLite(grid, start, goal)
+        path = planner.path()
+        assert_optimal(grid, path, start, goal, dijkstra_cost(grid, start, goal))
+        if path is None or len(path) < 3:
+            continue
+
+        blocked = [path[len(path) // 2]]
+        changed = grid.set_near_obstacle(blocked)
+        planner.notify_changes([tuple(node) for node in np.argwhere(changed).tolist()])
+        assert_optimal(grid, planner.path(), start, goal, dijkstra_cost(grid, start, goal))
+
+
+# user-004: with free turns the lattice is plain shortest time, otherwise its duration matches its own path
+def test_lattice_matches_dijkstra():
+    for rng, grid in random_grids(6):
+        start, goal = random_query(rng, grid)
+        graph = gr.from_grid_map(grid)
+        reference = dijkstra_cost(grid, start, goal)
+
+        path, duration = gr.lattice_astar_path(graph, start, goal, BLOCK_SIZE_CM, 0, BLOCK_SIZE_CM)
+        assert_optimal(grid, path, start, goal, reference)
+        if path is None:
+            assert duration == gr.INF
+            continue
+        assert math.isclose(duration, reference)
+
+        start_heading = int(rng.integers(0, 8)) * 45
+        path, duration = gr.lattice_astar_path(graph, start, goal, MOVE_DURATION_MS, TURN_DURATION_MS, BLOCK_SIZE_CM, start_heading)
+        headings = [start_heading] + [gr.heading(a, b) for a, b in zip(path[:-1], path[1:])]
+        turns = sum(gr.heading_steps(a // 45, b // 45) for a, b in zip(headings[:-1], headings[1:]))
+        expected = gr.move_duration(path_cost(grid, path), MOVE_DURATION_MS, BLOCK_SIZE_CM) + turns * TURN_DURATION_MS
+        assert math.isclose(duration, expected)
+        assert duration >= gr.move_duration(reference, MOVE_DURATION_MS, BLOCK_SIZE_CM) - 1e-9
+
+
+# user-013: every node's distance and followed path against Dijkstra
+def test_flow_field_matches_dijkstra():
+    for clearance in (False, True):
+        for rng, grid in random_grids(7, clearance=clearance):
+            start, goal = random_query(rng, grid)
+            field = FlowField(grid, goal)
+            reference = dijkstra_cost(grid, start, goal)
+            assert math.isclose(field.cost(start), reference) or field.cost(start) == reference
+            assert_optimal(grid, field.path(start), start, goal, reference)
+
+            lengths = nx.single_source_dijkstra_path_length(gr.from_grid_map(grid), goal, weight=gr.passable_weight)
+            for node in grid.nodes():
+                assert math.isclose(field.cost(node), lengths.get(node, math.inf))
+
+
+# user-003, user-004: matrix entries are the lattice durations of the returned paths
+def test_cost_matrix_matches_lattice():
+    for rng, grid in random_grids(8):
+        free = np.argwhere(~grid.near_obstacle)
+        points = [tuple(free[i].tolist()) for i in rng.choice(len(free), min(4, len(free)), replace=False)]
+        graph = gr.from_grid_map(grid)
+
+        matrix, paths = CostMatrixBuilder(grid, BLOCK_SIZE_CM, 0, BLOCK_SIZE_CM).build(points)
+        for i, p in enumerate(points):
+            for j, q in enumerate(points):
+                reference = dijkstra_cost(grid, p, q)
+                if i == j:
+                    assert matrix[i][j] == 0
+                elif reference == math.inf:
+                    assert matrix[i][j] == CostMatrixBuilder.UNREACHABLE_COST and (i, j) not in paths
+                else:
+                    path, duration = paths[(i, j)]
+                    assert_optimal(grid, path, p, q, reference)
+                    assert math.isclose(duration, reference) and matrix[i][j] == int(duration)
+
+        matrix, paths = CostMatrixBuilder(grid, MOVE_DURATION_MS, TURN_DURATION_MS, BLOCK_SIZE_CM).build(points)
+        for (i, j), (path, duration) in paths.items():
+            _, lattice_duration = gr.lattice_astar_path(graph, points[i], points[j], MOVE_DURATION_MS, TURN_DURATION_MS, BLOCK_SIZE_CM)
+            assert math.isclose(duration, lattice_duration)
+
+
+# user-003: the process pool gives the same matrix as the in-process build
+def test_cost_matrix_pool_matches_serial():
+    rng = np.random.default_rng(9)
+    grid = random_grid(rng)
+    free = np.argwhere(~grid.near_obstacle)
+    points = [tuple(free[i].tolist()) for i in rng.choice(len(free), 5, replace=False)]
+    builder = CostMatrixBuilder(grid, MOVE_DURATION_MS, TURN_DURATION_MS, BLOCK_SIZE_CM)
+
+    serial, serial_paths = builder.build(points)
+    pooled, pooled_paths = builder.build(points, workers=2)
+    assert np.array_equal(serial, pooled)
+    assert serial_paths.keys() == pooled_paths.keys()
+
+
+# user-017: shared goals come from one flow field, the rest from single searches
+def test_batch_paths_match_dijkstra():
+    for rng, grid in random_grids(10):
+        graph = gr.from_grid_map(grid)
+        free = np.argwhere(~grid.near_obstacle)
+        nodes = [tuple(free[i].tolist()) for i in rng.integers(0, len(free), 6)]
+        starts, goals = nodes[:5], [nodes[5]] * 3 + nodes[3:5][::-1]
+
+        for jump_points in (False, True):
+            for start, goal, (path, cost) in zip(starts, goals, gr.batch_paths(graph, starts, goals, jump_points)):
+                reference = dijkstra_cost(grid, start, goal)
+                if jump_points and grid.uniform_step_costs() and reference != math.inf:
+                    assert path_cost(grid, path) <= reference * (1 + 2 * GridMap.UNIFORM_TOLERANCE)
+                    continue
+                assert_optimal(grid, path, start, goal, reference)
+                assert math.isclose(cost, reference) or cost == reference
+
+
+# user-014: string pulling keeps the endpoints, never cuts through obstacles and never gets longer
+def test_smooth_path_has_line_of_sight():
+    for rng, grid in random_grids(11):
+        start, goal = random_query(rng, grid)
+        graph = gr.from_grid_map(grid)
+        path = gr.safe_astar_path(graph, start, goal, gr.heuristic)
+        if path is None:
+            continue
+        waypoints = gr.smooth_path(graph, path)
+        assert waypoints[0] == start and waypoints[-1] == goal
+        # Without any shortcut the next waypoint is just the next path node, a passable edge
+        for a, b in zip(waypoints[:-1], waypoints[1:]):
+            assert grid.line_of_sight(a, b) or grid.weight(a, b) not in (None, GridMap.INF)
+        assert pixel_length(grid, waypoints) <= pixel_length(grid, path) + 1e-9
+
+
+# user-019: quadtree waypoints connect the query cells whenever the fine grid does
+def test_quadtree_path_reaches_goal():
+    for rng, grid in random_grids(12):
+        start, goal = random_query(rng, grid)
+        path = QuadtreeGrid(grid, refine_nodes=[start, goal]).path(start, goal)
+        if dijkstra_cost(grid, start, goal) == math.inf:
+            assert path is None
+            continue
+        assert path[0] == start and path[-1] == goal
+        assert all(not grid.near_obstacle[node] for node in path)
+        assert pixel_length(grid, path) >= pixel_length(grid, [start, goal]) - 1e-9
+
+
+# user-015: the clearance layer only ever adds cost and flags nothing as blocked
+def test_clearance_only_adds_cost():
+    rng = np.random.default_rng(13)
+    grid = random_grid(rng, clearance=True)
+    finite = np.isfinite(grid.weights)
+    assert grid.penalty.any()
+    assert (grid.weights[finite] >= grid.distances[finite] - 1e-9).all()
+
+    changed = grid.set_clearance(None, 0)
+    assert changed.any() and not grid.penalty.any()
+    assert np.array_equal(np.isfinite(grid.weights), finite)
+    assert np.allclose(grid.weights[finite], grid.distances[finite])
+
+
+# user-007: a cache only answers for the map version it was filled on
+def test_path_cache_evicts_on_version_change():
+    cache = PathCache(maxsize=2)
+    cache.put("a", 1, ([(0, 0)], 0.0))
+    assert cache.get("a", 1) == ([(0, 0)], 0.0)
+    assert cache.get("a", 2) is None
+    assert len(cache.entries) == 0
+
+    # Least recently used entry goes first
+    cache.put("a", 2, 1)
+    cache.put("b", 2, 2)
+    cache.get("a", 2)
+    cache.put("c", 2, 3)
+    assert cache.get("b", 2) is None and cache.get("a", 2) == 1 and cache.get("c", 2) == 3
+
+
+# user-006, user-007: obstacle updates bump the version, so cached paths are replanned
+def test_cached_path_replans_after_map_change():
+    rng = np.random.default_rng(14)
+    world = WorldModel()
+    world.update_geometry({"tl": (0, 0)}, 12, 12, random_matrix(rng, False), CONVERSION)
+    version = world.version
+
+    path, cost = gr.cached_astar_path(world.graph, (0, 6), (11, 6))
+    assert gr.cached_astar_path(world.graph, (0, 6), (11, 6)) == (path, cost)
+    assert gr.get_path_cache(world.graph).hits == 1
+
+    blocked = path[len(path) // 2]
+    assert world.set_near_obstacle([blocked]) == [blocked]
+    assert world.version == version + 1 and gr.get_map_version(world.graph) == world.version
+
+    new_path, new_cost = gr.cached_astar_path(world.graph, (0, 6), (11, 6))
+    assert blocked not in new_path
+    assert math.isclose(new_cost, dijkstra_cost(world.grid, (0, 6), (11, 6)))
+
+    # Marking an already blocked node again is no change at all
+    assert world.set_near_obstacle([blocked]) == [] and world.version == version + 1
+
+
+# user-017: flow fields live in their own cache and never push paths out
+def test_flow_field_cache_is_separate():
+    rng = np.random.default_rng(15)
+    world = WorldModel()
+    world.update_geometry({"tl": (0, 0)}, 10, 10, random_matrix(rng, False), CONVERSION)
+    entry = gr.cached_astar_path(world.graph, (0, 0), (9, 9))
+
+    for goal in range(gr.FLOW_FIELD_CACHE_SIZE + 2):
+        field = gr.cached_flow_field(world.graph, (goal % 10, goal // 10))
+    assert gr.cached_flow_field(world.graph, field.goal) is field
+    assert len(gr.get_flow_field_cache(world.graph).entries) == gr.FLOW_FIELD_CACHE_SIZE
+    assert gr.get_path_cache(world.graph).get((gr.ASTAR, (0, 0), (9, 9)), world.version) == entry
+
+    world.set_near_obstacle([(5, 5)])
+    assert gr.cached_flow_field(world.graph, field.goal) is not field
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} passed")
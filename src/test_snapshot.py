@@ -0,0 +1,96 @@
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from solver.grid_map import GridMap
+from solver.snapshot import SessionSnapshot
+from utils import UtilityFunctions as uf
+
+CORNERS = {uf.TOP_LEFT: (50, 40), uf.TOP_RIGHT: (590, 42), uf.BOTTOM_LEFT: (48, 440), uf.BOTTOM_RIGHT: (592, 438)}
+MATRIX = np.array([[20.0, 0.5, 50], [0.3, 20.0, 40], [0, 0, 1]])
+CONVERSION = [0.15, 0.16, 0.155]
+
+
+def textured_frame(rng):
+    # Smoothed noise gives the phase correlation something to lock onto
+    frame = rng.integers(0, 255, (480, 640, 3)).astype(np.float32)
+    for _ in range(3):
+        frame = (frame + np.roll(frame, 1, axis=0) + np.roll(frame, 1, axis=1)) / 3
+    return frame.astype(np.uint8)
+
+
+def saved_grid(rng):
+    grid = GridMap(20, 15, MATRIX, CONVERSION)
+    contours = [np.array([[200, 150], [260, 150], [260, 220], [200, 220]], dtype=np.int32).reshape(-1, 1, 2)]
+    grid.update_obstacles(contours, (480, 640), 10)
+    grid.set_near_obstacle([tuple(node) for node in np.argwhere(rng.random((20, 15)) < 0.1).tolist()])
+    return grid
+
+
+# user-018: every field written by save comes back from load
+def test_snapshot_round_trip():
+    rng = np.random.default_rng(0)
+    grid = saved_grid(rng)
+    frame = textured_frame(rng)
+    H = rng.normal(size=(3, 3))
+    calibrations = {"robot 1": 1.07, "robot 2": 0.94}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.npz")
+        SessionSnapshot.save(path, CORNERS, H, MATRIX, CONVERSION, 3.0, grid, calibrations, frame)
+        assert not os.path.exists(path + ".tmp")
+        snapshot = SessionSnapshot.load(path)
+
+    assert SessionSnapshot.corners(snapshot) == CORNERS
+    assert SessionSnapshot.calibrations(snapshot) == calibrations
+    assert np.array_equal(snapshot["H"], H) and np.array_equal(snapshot["matrix"], MATRIX)
+    assert snapshot["pixel_conversion"].tolist() == CONVERSION and float(snapshot["block_size_cm"]) == 3.0
+    assert tuple(snapshot["grid_shape"]) == (grid.width, grid.height)
+
+    # A fresh grid of the same geometry ends up with the same obstacles and weights
+    restored = GridMap(grid.width, grid.height, snapshot["matrix"], snapshot["pixel_conversion"].tolist())
+    changed = restored.restore_obstacles(snapshot["contour_obstacle"], snapshot["marked_obstacle"], snapshot["obstacle_distance"])
+    assert changed.any()
+    assert np.array_equal(restored.near_obstacle, grid.near_obstacle)
+    assert np.array_equal(restored.weights, grid.weights)
+
+
+# user-018: grids of another size aren't restored, missing or broken files load as None
+def test_snapshot_rejects_mismatches():
+    rng = np.random.default_rng(1)
+    grid = saved_grid(rng)
+    other = GridMap(grid.width + 1, grid.height, MATRIX, CONVERSION)
+    assert not other.restore_obstacles(grid.contour_obstacle, grid.marked_obstacle, grid.obstacle_distance).any()
+    assert not other.near_obstacle.any()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.npz")
+        assert SessionSnapshot.load(path) is None
+        with open(path, "wb") as f:
+            f.write(b"not a snapshot")
+        assert SessionSnapshot.load(path) is None
+
+
+# user-018: the drift check measures how far the camera moved since the snapshot
+def test_snapshot_drift():
+    rng = np.random.default_rng(2)
+    frame = textured_frame(rng)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.npz")
+        SessionSnapshot.save(path, CORNERS, np.eye(3), MATRIX, CONVERSION, 3.0, frame=frame)
+        snapshot = SessionSnapshot.load(path)
+
+    assert SessionSnapshot.drift(snapshot, frame) < 1.0
+    shifted = np.roll(frame, (12, 16), axis=(0, 1))
+    assert abs(SessionSnapshot.drift(snapshot, shifted) - 20.0) < 4.0
+    assert SessionSnapshot.drift(snapshot, frame[:240]) == math.inf
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} passed")
@@ -42,21 +42,7 @@ def add_actor_to_environment(frame, polygon, name: str):
     bbox = (min_x, min_y, max_x - min_x, max_y - min_y)
 
     # Define actor methods 
-    actor = None 
-
-    if name.startswith('robot'):
-        if IndividualNode.can_connect(name):
-            print("Creating physical robot", name)
-            actor = IndividualNode(name=name)
-        else: 
-            print("Failed to create robot")
-
-    elif name.startswith('action'):
-        print("Creating action point", name)
-        actor = Actor(name=name)
-    else:
-        print("Creating misc actor", name)
-        actor = Actor(name=name)
+    actor = UtilityFunctions.create_actor(name)
 
     if actor is not None:
         actor.initialize_tracker(frame, bbox)
@@ -75,6 +61,22 @@ class UtilityFunctions:
     ROBOT_TWO_RANGE = ((4, 53, 50), (24, 93, 86))
     TEXT_DISTANCE = 65
 
+    @staticmethod
+    def create_actor(name, backend=None):
+        # Robots are only created when their physical device can be reached, None otherwise
+        if name.startswith('robot'):
+            if IndividualNode.can_connect(name):
+                print("Creating physical robot", name)
+                return IndividualNode(name=name, backend=backend)
+            print("Failed to create robot")
+            return None
+
+        if name.startswith('action'):
+            print("Creating action point", name)
+        else:
+            print("Creating misc actor", name)
+        return Actor(name=name, backend=backend)
+
     @staticmethod
     def find_corners_feed(cap):
         
@@ -325,7 +327,7 @@ class UtilityFunctions:
     
 
     @staticmethod
-    def get_all_objects(cap):
+    def get_all_objects(cap, tracker_pool=None):
         global temp_frame
         global points, polygon, tracking, polygon_complete, phase
 
@@ -386,8 +388,11 @@ class UtilityFunctions:
             for x in range(0, mapped_frame.shape[1], environment.get_grid_size()):
                 for y in range(0, mapped_frame.shape[0], environment.get_grid_size()):
                     cv.circle(mapped_frame, (x, y), 2, (0, 255, 0), -1)
+            # A TrackerPool updates every actor at once in its worker processes
+            if tracker_pool is not None:
+                tracker_pool.update(frame, environment.actors)
             for actor in environment.actors:
-                if actor.update(frame):
+                if (actor.tracked if tracker_pool is not None else actor.update(frame)):
                     top_left = (int(actor.bbox[0]), int(actor.bbox[1]))
                     bottom_right = (int(actor.bbox[0] + actor.bbox[2]), int(actor.bbox[1] + actor.bbox[3]))
                     cv.rectangle(mapped_frame, top_left, bottom_right, (0, 255, 255), 2)